@@ -1,2 +1,21 @@
-from .pynode import BRANDNode
-from .pyderivative import PyDerivative
\ No newline at end of file
+import importlib
+
+# the node classes are imported the first time they are used, so importing PyBRAND doesn't pull in yaml, asyncio
+# and every node type when only one is needed
+_exports = {
+    "BRANDNode": ".pynode",
+    "PyDerivative": ".pyderivative",
+    "AsyncBRANDNode": ".pyasyncnode",
+    "BRANDRecorder": ".pyrecorder",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,214 @@
+import asyncio
+import signal
+import json
+import sys
+import os
+from . import pynode_tools as PNT
+import redis
+import redis.asyncio as aioredis
+import traceback
+
+
+'''
+asyncio version of BRANDNode. instead of one blocking work() loop, the node registers a coroutine handler per input
+stream. every handler sits in its own blocking XREAD on its own pooled connection so a fan-in node reacts to
+whichever input arrives first without serializing its I/O in one thread. an optional async work() loop runs next to
+the handlers for publishing. SIGTERM cancels every task and the node shuts down through terminate()
+'''
+
+
+class AsyncBRANDNode():
+    def __init__(self):
+
+        # parse input arguments
+        self.NAME, args = PNT.parse_node_args()
+
+        # the async clients only connect once the event loop is running, so the startup handshake (state, pid and
+        # parameters) is done over a short lived blocking connection
+        self.parameters = self.bootstrap(**args)
+        self.realtime_database, self.persistant_database = self.connect_to_redis(**args)
+
+        self.__handlers = {}
+        self.__plans = {}
+        self.__init_script = None
+        self.__own_writes = {}
+        self.__tasks = []
+
+        #silence all print statements based on silence parameters
+        self.silence = self.parameters.get('silence', False)
+        print(f"[{self.NAME}] Silence: {self.silence}")
+        PNT.silence_print(self)
+
+    def bootstrap(self, host='localhost', port=6379, password=None, socket=None):
+        """
+        posts the initialized status and pid, logs the ping rtt and fetches the node's parameters
+        """
+        r_temp, r_pers = PNT.connect_node(self.NAME, host, port, password, socket)
+        try:
+            r_temp.xadd(self.NAME + '_state', {'code': 0, 'status': 'initialized'})
+            r_temp.xadd("pid_stream", {self.NAME: os.getpid()})
+            parameters = json.loads(r_pers.hget("PARAMETERS", self.NAME).decode())
+        except redis.ConnectionError as e:
+            print(f"[{self.NAME}] Error with Redis connection, check again: {e}")
+            sys.exit(1)
+
+        #dropping cached codec plans when an _init stream changes needs keyspace notifications for the whole server,
+        #which every write then pays for, so it is off unless the parameters turn it on
+        self.watch_init_streams = False
+        if parameters.get('watch_init_streams', False):
+            try:
+                PNT.enable_keyspace_events(r_temp, "Kgt")
+                self.watch_init_streams = True
+            except redis.RedisError as e:
+                print(f"[{self.NAME}] could not watch _init streams. codec plans won't be refreshed. original error: {e}")
+        r_temp.close()
+        r_pers.close()
+        return parameters
+
+    def connect_to_redis(self, host='localhost', port=6379, password=None, socket=None):
+        """
+        makes the async clients for both databases. redis binds the db number to each connection so the persistent
+        database gets a small sibling pool built from the realtime pool's connection settings
+        """
+        pool = PNT.make_connection_pool(host, port, password, socket, db=0, pool_class=aioredis.ConnectionPool)
+        persistant_pool = PNT.make_sibling_pool(pool, db=1, max_connections=2)
+        return aioredis.StrictRedis(connection_pool=pool), aioredis.StrictRedis(connection_pool=persistant_pool)
+
+    def add_stream_handler(self, stream_name, handler, block_ms=1000, count=None):
+        """
+        registers a coroutine that is awaited with the list of new entries every time the stream gets data.
+        call this from __init__ or setup() before the node runs
+        """
+        self.__handlers[stream_name] = (handler, block_ms, count)
+
+    async def init_stream(self, stream_name, dtype, packed=False):
+        """
+        async version of init_stream. makes {stream_name}_init with the dtype details in one atomic script call
+        """
+        dtype_dict = PNT.make_init_entry(dtype, packed)
+        if self.__init_script is None:
+            self.__init_script = self.realtime_database.register_script(PNT.LUA_INIT_OR_VERIFY)
+        #the notification of our own init entry can arrive while the script is awaited, so it is expected up front
+        #and taken back if nothing was written
+        self.__own_writes[stream_name] = self.__own_writes.get(stream_name, 0) + 1
+        reply = None
+        try:
+            reply = await self.__init_script(keys=[f"{stream_name}_init"], args=PNT.flatten_fields(dtype_dict))
+        finally:
+            if not self.watch_init_streams or reply is None or not reply[2]:
+                self.__own_writes[stream_name] = max(self.__own_writes[stream_name] - 1, 0)
+        PNT.check_init_reply(stream_name, dtype_dict, reply)
+        self.__plans[stream_name] = PNT.compile_codec_plan(PNT.parse_dtype(dtype_dict["dtype"]), stream_name)
+
+    async def get_codec_plan(self, stream_name):
+        """
+        gets the compiled codec plan of the stream. only goes to redis the first time or after the _init changes
+        """
+        plan = self.__plans.get(stream_name)
+        if plan is None:
+            first_entry = await self.realtime_database.xrange(f"{stream_name}_init", '-', '+', count=1)
+            if len(first_entry) == 0:
+                raise IndexError("can not get stream init because stream is empty")
+            plan = PNT.compile_codec_plan(PNT.parse_dtype(first_entry[0][1][b'dtype']), stream_name)
+            self.__plans[stream_name] = plan
+        return plan
+
+    async def add_to_stream(self, stream_name: str, data, dtype=None):
+        """
+        encodes the data and adds it to the redis stream
+        """
+        plan = PNT.compile_codec_plan(dtype, stream_name) if dtype is not None else await self.get_codec_plan(stream_name)
+        return await self.realtime_database.xadd(stream_name, plan.encode(data))
+
+    async def decode(self, redis_entries, stream_name=None, dtype=None):
+        """
+        decodes the stream entries into a list of (id, dict) using the stream init or the provided dtype
+        """
+        plan = PNT.compile_codec_plan(dtype, stream_name) if dtype is not None else await self.get_codec_plan(stream_name)
+        if isinstance(redis_entries, tuple):
+            redis_entries = [redis_entries]
+        return plan.decode(redis_entries, stream_name)
+
+    #follows one stream from its current head and hands every batch of new entries to the handler
+    async def _follow(self, stream_name, handler, block_ms, count):
+        last_entry = await self.realtime_database.xrevrange(stream_name, '+', '-', count=1)
+        cursor = last_entry[0][0] if len(last_entry) != 0 else b'0-0'
+        while True:
+            response = await self.realtime_database.xread({stream_name: cursor}, count=count, block=block_ms)
+            if not response:
+                continue
+            entries = response[0][1]
+            cursor = entries[-1][0]
+            await handler(entries)
+
+    #drops cached codec plans when their _init stream changes
+    async def _watch_init_streams(self):
+        pubsub = self.realtime_database.pubsub()
+        db = self.realtime_database.connection_pool.connection_kwargs.get("db", 0)
+        await pubsub.psubscribe(f"__keyspace@{db}__:*_init")
+        async for message in pubsub.listen():
+            if message["type"] == "pmessage":
+                stream_name = message["channel"].decode().split(":", 1)[1][:-len("_init")]
+                if message["data"] == b"xadd" and self.__own_writes.get(stream_name, 0) > 0:
+                    self.__own_writes[stream_name] -= 1
+                else:
+                    self.__plans.pop(stream_name, None)
+
+    def _cancel(self):
+        for task in self.__tasks:
+            task.cancel()
+
+    #SIGTERM cancels the main task wherever it is, setup() included, and the node stops through terminate(). the
+    #handler tasks go with it, gather cancels them. once the node is stopping another SIGTERM is ignored so it
+    #can't cut terminate() short
+    def _on_sigterm(self):
+        if not self.__stopping:
+            self.__stopping = True
+            self.__main_task.cancel()
+
+    async def _main(self):
+        #installed before setup() so a SIGTERM while the node is still setting up isn't lost
+        self.__stopping = False
+        self.__main_task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        try:
+            await self.setup()
+            self.__tasks = [asyncio.create_task(self._watch_init_streams())] if self.watch_init_streams else []
+            for stream_name, (handler, block_ms, count) in self.__handlers.items():
+                self.__tasks.append(asyncio.create_task(self._follow(stream_name, handler, block_ms, count)))
+            if type(self).work is not AsyncBRANDNode.work:
+                self.__tasks.append(asyncio.create_task(self._work_loop()))
+            await asyncio.gather(*self.__tasks)
+        except asyncio.CancelledError:
+            print(f"[{self.NAME}] SIGTERM received, stopping")
+        except Exception:
+            #uncaught error occured. logging it to the redis error stream before exiting
+            error = traceback.format_exc()
+            print(f"Uncaught error occured during runtime. Error: {error}")
+            await self.realtime_database.xadd("error_stream", {self.NAME: error})
+        finally:
+            self.__stopping = True
+            self._cancel()
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+            await self.terminate()
+
+    async def _work_loop(self):
+        while True:
+            await self.work()
+
+    #run the node. override with caution because the logic to capture the error trace is implemented here
+    def run(self):
+        asyncio.run(self._main())
+
+    # meant to be overridden. runs inside the event loop before any handler starts, e.g. to init streams
+    async def setup(self):
+        pass
+
+    # meant to be overridden. if it is, it runs in a loop next to the stream handlers
+    async def work(self):
+        pass
+
+    # meant to be overridden
+    async def terminate(self):
+        await self.realtime_database.aclose()
+        await self.persistant_database.aclose()
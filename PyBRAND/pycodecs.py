@@ -0,0 +1,89 @@
+import json
+import struct
+import numpy as np
+
+
+'''
+codecs for serial keys. a serial dtype is "serial" or "serial:<codec>", and the codec is looked up here by name when
+the stream's codec plan is compiled. plain "serial" is json, so streams written before codecs could be picked still
+decode the same. codecs are (encoder, decoder) pairs, the encoder turns a python object into str or bytes and the
+decoder takes the bytes back from redis.
+
+"serial:msgpack" is a compact binary codec, there when the msgpack package is installed. numpy arrays go in as a
+msgpack extension type holding their raw buffer, so number lists cost their width instead of their text, and any
+msgpack library can read them back:
+
+    ext type 1:     uint8 length of the dtype string, numpy dtype string ("<f4"), uint8 ndim, ndim uint32 sizes,
+                    then the little endian data in C order
+
+custom codecs have to be registered with register_serial_codec in every process that reads or writes the stream,
+before its codec plan is compiled
+'''
+
+NDARRAY_EXT = 1
+
+_serial_codecs = {}
+
+
+def register_serial_codec(name, encoder, decoder):
+    _serial_codecs[name.lower()] = (encoder, decoder)
+
+
+def is_serial_dtype(dstring):
+    return isinstance(dstring, str) and (dstring == "serial" or dstring.startswith("serial:"))
+
+
+#gets (encoder, decoder) of a serial dtype. raises ValueError if its codec isn't registered
+def get_serial_codec(dstring):
+    name = dstring.partition(":")[2] or "json"
+    codec = _serial_codecs.get(name)
+    if codec is None:
+        raise ValueError(f"serial codec {name} is not registered. registered codecs are {list(_serial_codecs)}")
+    return codec
+
+
+register_serial_codec("json", json.dumps, json.loads)
+
+
+def _pack_ndarray(array):
+    #not ascontiguousarray, which turns a 0-d array into a 1-d one
+    array = np.require(array, dtype=array.dtype.newbyteorder('<'), requirements='C')
+    dtype_string = array.dtype.str.encode()
+    return b"".join((struct.pack("<B", len(dtype_string)), dtype_string,
+                     struct.pack(f"<B{array.ndim}I", array.ndim, *array.shape), array.tobytes()))
+
+
+def _unpack_ndarray(data):
+    dtype_length = data[0]
+    np_dtype = np.dtype(data[1:1 + dtype_length].decode())
+    ndim = data[1 + dtype_length]
+    shape = struct.unpack_from(f"<{ndim}I", data, 2 + dtype_length)
+    return np.frombuffer(data, dtype=np_dtype, offset=2 + dtype_length + 4 * ndim).reshape(shape).copy()
+
+
+try:
+    import msgpack
+
+    def _default(value):
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind in "biufc":
+                return msgpack.ExtType(NDARRAY_EXT, _pack_ndarray(value))
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f"{type(value)} can not be packed")
+
+    def _ext_hook(code, data):
+        if code == NDARRAY_EXT:
+            return _unpack_ndarray(data)
+        return msgpack.ExtType(code, data)
+
+    def encode_msgpack(value):
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    def decode_msgpack(payload):
+        return msgpack.unpackb(payload, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+    register_serial_codec("msgpack", encode_msgpack, decode_msgpack)
+except ImportError:
+    pass
@@ -0,0 +1,311 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+
+'''
+columnar on disk format for recorded sessions. a dataset is a directory with an index.json and one sub directory
+per stream. every numeric key of a stream is a raw little endian file of fixed size rows that is opened with
+np.memmap, so opening a dataset reads nothing but the index and a stream is only paged in for the rows that get
+used. serial keys are json lines plus an int64 file of row offsets. every stream has an int64 file of the redis
+millisecond timestamps of its rows, which is what time ranges are looked up in.
+
+    session/
+        index.json          {"format": "pybrand-columnar", "version": 1, "streams": {...}}
+        <stream>/timestamps.bin
+        <stream>/<key>.bin          numeric key, index has its numpy dtype and per row shape
+        <stream>/<key>.jsonl        serial key
+        <stream>/<key>.offsets      byte offset of each row of the jsonl file
+
+files are only ever appended to, columns before timestamps, so a stream's row count is the smallest row count of
+its files and a half written row is never visible
+'''
+
+FORMAT_NAME = "pybrand-columnar"
+FORMAT_VERSION = 1
+INDEX_NAME = "index.json"
+
+
+def is_dataset(path):
+    path = Path(path)
+    return (path / INDEX_NAME).exists() if path.is_dir() else path.name == INDEX_NAME
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        #in the index but the writer hasn't made it yet
+        return 0
+
+
+def _row_bytes(layout):
+    return np.dtype(layout["dtype"]).itemsize * int(np.prod(layout["shape"]))
+
+
+#rows that every file of the stream (its entry in the index) has completely
+def count_rows(path, stream):
+    rows = _file_size(path / stream["timestamps"]) // 8
+    for layout in stream["keys"].values():
+        if layout.get("serial"):
+            rows = min(rows, _file_size(path / layout["offsets"]) // 8)
+        else:
+            rows = min(rows, _file_size(path / layout["file"]) // _row_bytes(layout))
+    return rows
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} is not json serializable")
+
+
+class ColumnarDataset():
+    def __init__(self, path):
+        path = Path(path)
+        self.path = path.parent if path.name == INDEX_NAME else path
+        with open(self.path / INDEX_NAME, 'r') as f:
+            index = json.load(f)
+        if index.get("format") != FORMAT_NAME:
+            raise ValueError(f"{self.path} is not a {FORMAT_NAME} dataset")
+        self.index = index
+        self.__memmaps = {}
+
+    @property
+    def streams(self):
+        return list(self.index["streams"].keys())
+
+    def get_dtype(self, stream_name):
+        return self.index["streams"][stream_name]["dtype"]
+
+    def get_keys(self, stream_name):
+        return list(self.index["streams"][stream_name]["keys"].keys())
+
+    def __len__(self):
+        return len(self.index["streams"])
+
+    #rows that every file of the stream has completely
+    def count(self, stream_name):
+        return count_rows(self.path, self.index["streams"][stream_name])
+
+    #memmaps are reopened when the file has grown, e.g. while a recorder is still writing the dataset
+    def _memmap(self, file, dtype, shape, rows):
+        cached = self.__memmaps.get(file)
+        if cached is not None and len(cached) >= rows:
+            return cached[:rows]
+        if rows == 0:
+            return np.empty((0, *shape), dtype=dtype)
+        memmap = np.memmap(self.path / file, dtype=dtype, mode='r', shape=(rows, *shape))
+        self.__memmaps[file] = memmap
+        return memmap
+
+    def get_timestamps(self, stream_name):
+        stream = self.index["streams"][stream_name]
+        return self._memmap(stream["timestamps"], np.int64, (), self.count(stream_name))
+
+    #row range [start, stop) covering the time range. both ends are inclusive and optional
+    def get_rows(self, stream_name, start_ms=None, end_ms=None):
+        timestamps = self.get_timestamps(stream_name)
+        start = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side='left'))
+        stop = len(timestamps) if end_ms is None else int(np.searchsorted(timestamps, end_ms, side='right'))
+        return start, stop
+
+    def _read_serial(self, layout, start, stop, rows):
+        offsets = self._memmap(layout["offsets"], np.int64, (), rows)
+        if start >= stop:
+            return []
+        with open(self.path / layout["file"], 'rb') as f:
+            f.seek(int(offsets[start]))
+            if stop < rows:
+                data = f.read(int(offsets[stop]) - int(offsets[start]))
+            else:
+                data = f.read()
+        return [json.loads(line) for line in data.splitlines()[:stop - start]]
+
+    def _read_rows(self, stream_name, start, stop, keys, rows):
+        stream = self.index["streams"][stream_name]
+        timestamps = self._memmap(stream["timestamps"], np.int64, (), rows)[start:stop]
+        columns = {}
+        for key in (keys if keys is not None else stream["keys"].keys()):
+            layout = stream["keys"][key]
+            if layout.get("serial"):
+                columns[key] = self._read_serial(layout, start, stop, rows)
+            else:
+                columns[key] = self._memmap(layout["file"], np.dtype(layout["dtype"]), tuple(layout["shape"]),
+                                            rows)[start:stop]
+        return timestamps, columns
+
+    def load(self, stream_name, start_ms=None, end_ms=None, keys=None):
+        """
+        returns (timestamps, {key: column}) for the time range. numeric columns are memmapped views, nothing is read
+        from disk until the data is used
+        """
+        rows = self.count(stream_name)
+        start, stop = self.get_rows(stream_name, start_ms, end_ms)
+        return self._read_rows(stream_name, start, min(stop, rows), keys, rows)
+
+    def iter_chunks(self, stream_name, chunk_size, start_ms=None, end_ms=None, keys=None):
+        """
+        yields (timestamps, {key: column}) chunks of at most chunk_size rows over the time range so a derivative
+        can stream over data larger than memory
+        """
+        rows = self.count(stream_name)
+        start, stop = self.get_rows(stream_name, start_ms, end_ms)
+        for chunk_start in range(start, min(stop, rows), chunk_size):
+            yield self._read_rows(stream_name, chunk_start, min(chunk_start + chunk_size, stop, rows), keys, rows)
+
+
+class ColumnarWriter():
+    '''
+    appends decoded columns (as returned by decode_columnar) to a dataset, making or extending it
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if (self.path / INDEX_NAME).exists():
+            with open(self.path / INDEX_NAME, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "streams": {}}
+            self.write_index()
+        self.__files = {}
+        self.__serial_ends = {}
+        #a crash in the middle of an append leaves some files longer than others. those rows were never visible,
+        #but new rows would be appended after them and the columns wouldn't line up anymore
+        for stream_name in self.index["streams"]:
+            self.truncate(stream_name)
+
+    #the index is swapped in whole so a reader never sees half of it
+    def write_index(self):
+        temp_path = self.path / (INDEX_NAME + ".tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path / INDEX_NAME)
+
+    def _file(self, name):
+        f = self.__files.get(name)
+        if f is None:
+            (self.path / name).parent.mkdir(parents=True, exist_ok=True)
+            f = open(self.path / name, 'ab')
+            self.__files[name] = f
+        return f
+
+    #where a recorder left off in the redis stream. saved with the next write_index()
+    def get_last_id(self, stream_name):
+        return self.index["streams"].get(stream_name, {}).get("last_id")
+
+    #rows is how many rows the stream had once entry_id was written. both are saved together by write_index() so a
+    #restarted recorder can cut anything written after them and read it again from redis
+    def set_last_id(self, stream_name, entry_id, rows=None):
+        stream = self.index["streams"][stream_name]
+        stream["last_id"] = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        if rows is not None:
+            stream["rows"] = rows
+
+    #rows saved with the last id. None keeps every complete row, for indexes from before rows were saved
+    def get_saved_rows(self, stream_name):
+        stream = self.index["streams"].get(stream_name, {})
+        if "rows" in stream:
+            return stream["rows"]
+        return None if "last_id" in stream else 0
+
+    #rows of the stream that every file has completely
+    def count(self, stream_name):
+        self.flush(fsync=False)
+        return count_rows(self.path, self.index["streams"][stream_name])
+
+    def truncate(self, stream_name, rows=None):
+        """
+        cuts every file of the stream back to its first rows rows, by default to the rows every file has completely
+        """
+        self.close()
+        self.__serial_ends = {}
+        stream = self.index["streams"][stream_name]
+        complete = count_rows(self.path, stream)
+        rows = complete if rows is None else min(rows, complete)
+
+        sizes = {stream["timestamps"]: rows * 8}
+        for layout in stream["keys"].values():
+            if not layout.get("serial"):
+                sizes[layout["file"]] = rows * _row_bytes(layout)
+                continue
+            sizes[layout["offsets"]] = rows * 8
+            end = 0
+            if rows > 0:
+                #the data ends with the line of the last row kept, which starts at its offset
+                last_offset = int(np.fromfile(self.path / layout["offsets"], dtype='<i8', count=1,
+                                              offset=(rows - 1) * 8)[0])
+                with open(self.path / layout["file"], 'rb') as f:
+                    f.seek(last_offset)
+                    end = last_offset + len(f.readline())
+            sizes[layout["file"]] = end
+
+        for name, size in sizes.items():
+            if _file_size(self.path / name) > size:
+                os.truncate(self.path / name, size)
+        return rows
+
+    def add_stream(self, stream_name, dtype):
+        if stream_name not in self.index["streams"]:
+            self.index["streams"][stream_name] = {"dtype": dtype, "timestamps": f"{stream_name}/timestamps.bin",
+                                                  "keys": {}}
+            self.write_index()
+
+    def _get_layout(self, stream_name, key, column):
+        keys = self.index["streams"][stream_name]["keys"]
+        layout = keys.get(key)
+        if layout is None:
+            if isinstance(column, np.ndarray):
+                layout = {"file": f"{stream_name}/{key}.bin", "dtype": column.dtype.newbyteorder('<').str,
+                          "shape": list(column.shape[1:])}
+            else:
+                layout = {"file": f"{stream_name}/{key}.jsonl", "offsets": f"{stream_name}/{key}.offsets",
+                          "serial": True}
+            keys[key] = layout
+            self.write_index()
+        elif not layout.get("serial") and list(column.shape[1:]) != layout["shape"]:
+            raise ValueError(f"{key} of {stream_name} changed shape from {layout['shape']} to {list(column.shape[1:])}")
+        return layout
+
+    def append(self, stream_name, timestamps, columns):
+        if stream_name not in self.index["streams"]:
+            raise KeyError(f"add_stream {stream_name} before appending to it")
+        #every column is checked before anything is written so a rejected one can't leave half a row behind
+        layouts = {key: self._get_layout(stream_name, key, column) for key, column in columns.items()}
+        for key, column in columns.items():
+            layout = layouts[key]
+            if not layout.get("serial"):
+                self._file(layout["file"]).write(np.ascontiguousarray(column, dtype=layout["dtype"]).tobytes())
+                continue
+            if len(column) == 0:
+                continue
+            data_file = self._file(layout["file"])
+            end = self.__serial_ends.get(layout["file"])
+            if end is None:
+                end = data_file.seek(0, os.SEEK_END)
+            lines = [json.dumps(value, default=_to_json).encode() + b'\n' for value in column]
+            offsets = np.cumsum([end] + [len(line) for line in lines[:-1]], dtype=np.int64)
+            data_file.write(b"".join(lines))
+            self._file(layout["offsets"]).write(offsets.tobytes())
+            self.__serial_ends[layout["file"]] = end + sum(len(line) for line in lines)
+        #timestamps last, they are what makes the new rows visible
+        self._file(self.index["streams"][stream_name]["timestamps"]).write(
+            np.ascontiguousarray(timestamps, dtype='<i8').tobytes())
+
+    #flushes python buffers and, unless told not to, makes the data durable
+    def flush(self, fsync=True):
+        for f in self.__files.values():
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        for f in self.__files.values():
+            f.close()
+        self.__files = {}
@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 import yaml
 import pickle as pkl
+from .pydataset import ColumnarDataset, is_dataset
 
 
 class PyDerivative():
@@ -21,11 +22,25 @@ class PyDerivative():
         data_path = Path(args["data"])
         #check if the data file exists 
         if not os.path.exists(data_path):
-            print(f"Data file {self.data} does not exist.")
+            print(f"Data file {data_path} does not exist.")
             sys.exit(1)
 
-        with open(data_path, 'rb') as f:
-            self.data = pkl.load(f)
-
+        # a columnar dataset (directory with an index.json) is memmapped and loaded lazily by stream and time range. 
+        # anything else is a pickle that is loaded whole
+        if is_dataset(data_path):
+            self.data = ColumnarDataset(data_path)
+        else:
+            with open(data_path, 'rb') as f:
+                self.data = pkl.load(f)
 
+    def load_stream(self, stream_name, start_ms=None, end_ms=None, keys=None):
+        """
+        returns (timestamps, {key: column}) of the stream over the time range. only for columnar datasets
+        """
+        return self.data.load(stream_name, start_ms, end_ms, keys)
 
+    def iter_chunks(self, stream_name, chunk_size, start_ms=None, end_ms=None, keys=None):
+        """
+        yields fixed size (timestamps, {key: column}) chunks of the stream. only for columnar datasets
+        """
+        return self.data.iter_chunks(stream_name, chunk_size, start_ms, end_ms, keys)
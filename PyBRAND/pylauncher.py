@@ -0,0 +1,176 @@
+import argparse
+import importlib
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+import redis
+from . import pynode_tools as PNT
+from . import pynode
+
+
+'''
+warm launcher. one zygote process pays for the slow part of starting a node once, the interpreter and the imports
+of numpy, redis, litework and the node classes, and then forks a child per node. the child starts warm and only runs
+the node class's __init__ (argparse, connecting, PARAMETERS) and run(). it makes its own redis connections since
+sockets can't be shared over a fork. a node class is imported in the launcher the first time it is launched, so every
+later launch or restart of it is warm as well
+
+nodes are launched with --node nickname=package.module:ClassName on the command line, and while the launcher runs by
+adding {"nickname": ..., "class": ...} entries to the {launcher nickname}_commands stream. launches and exits are
+posted with the child's pid to the launcher's _state stream, and every node posts its own startup timing to its
+_state stream. SIGTERM is passed on to every child
+
+run with: python -m PyBRAND.pylauncher -n launcher -i localhost -p 6379 --node decoder=my_nodes.decoder:Decoder
+'''
+
+PRELOAD = ["numpy", "redis", "redis.asyncio", "yaml", "litework", "PyBRAND.pynode", "PyBRAND.pyasyncnode"]
+
+
+#"package.module:ClassName" (or "package.module.ClassName") to the class
+def load_class(class_path):
+    module_name, _, class_name = class_path.partition(":")
+    if not class_name:
+        module_name, _, class_name = class_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+#imports the modules and returns how long each took on top of what was already imported. modules that aren't
+#installed are skipped
+def preload(modules):
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"could not preload {module}. original error: {e}")
+            continue
+        timings[module] = round(time.perf_counter() - start, 6)
+    return timings
+
+
+class Launcher():
+    def __init__(self, nickname, host='localhost', port=6379, password=None, socket=None, preload_modules=PRELOAD):
+        self.NAME = nickname
+        self.connection_args = {"-i": host, "-p": port, "-a": password, "-s": socket}
+        self.realtime_database = redis.StrictRedis(
+            connection_pool=PNT.make_connection_pool(host, port, password, socket, db=0))
+        self.children = {}
+        self.classes = {}
+        self.__cursors = {}
+
+        preload_timing = preload(preload_modules)
+        self.realtime_database.xadd(f"{self.NAME}_state", {'code': 0, 'status': 'initialized',
+                                                           'preload': json.dumps(preload_timing)})
+        signal.signal(signal.SIGTERM, self.terminate)
+
+    def _post_state(self, status, **fields):
+        self.realtime_database.xadd(f"{self.NAME}_state", {'code': 0, 'status': status, **fields})
+
+    def launch(self, nickname, class_path):
+        """
+        forks a child that runs the node class as nickname. returns the child's pid, or None if the class can't be
+        imported
+        """
+        node_class = self.classes.get(class_path)
+        if node_class is None:
+            try:
+                node_class = load_class(class_path)
+            except (ImportError, AttributeError, ValueError) as e:
+                print(f"[{self.NAME}] can not launch {nickname}, {class_path} could not be imported. original error: {e}")
+                self._post_state('launch_failed', nickname=nickname, error=str(e))
+                return None
+            self.classes[class_path] = node_class
+
+        argv = [class_path, "-n", nickname]
+        for flag, value in self.connection_args.items():
+            if value is not None:
+                argv += [flag, str(value)]
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(node_class, argv)
+        self.children[pid] = nickname
+        self._post_state('launched', nickname=nickname, pid=pid)
+        return pid
+
+    #runs in the forked child and never returns
+    def _run_child(self, node_class, argv):
+        launched_at = time.perf_counter()
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            sys.argv = argv
+            pynode.LAUNCHED_AT = launched_at
+            node_class().run()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    #collects the children that have exited
+    def reap(self):
+        while len(self.children) > 0:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            nickname = self.children.pop(pid, None)
+            self._post_state('exited', nickname=nickname or "", pid=pid, exit_code=os.waitstatus_to_exitcode(status))
+
+    def run(self, nodes=()):
+        for nickname, class_path in nodes:
+            self.launch(nickname, class_path)
+        commands = f"{self.NAME}_commands"
+        while True:
+            for _, fields in PNT.read_new(self.realtime_database, [commands], self.__cursors, block_ms=500)[commands]:
+                self.launch(fields[b'nickname'].decode(), fields[b'class'].decode())
+            self.reap()
+
+    def terminate(self, sig, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self._post_state('done')
+        self.realtime_database.close()
+        sys.exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nickname', type=str, default='launcher')
+    parser.add_argument('-i', '--host', type=str, default='localhost')
+    parser.add_argument('-p', '--port', type=str, default=6379)
+    parser.add_argument('-a', '--password', type=str, required=False)
+    parser.add_argument('-s', '--socket', type=str, required=False, help="unix socket path, used instead of host/port")
+    parser.add_argument('--node', type=str, action='append', default=[], help="nickname=package.module:ClassName")
+    parser.add_argument('--preload', type=str, nargs='*', default=[], help="more modules to import before forking")
+    args = parser.parse_args()
+
+    nodes = []
+    for spec in args.node:
+        nickname, _, class_path = spec.partition("=")
+        if not class_path:
+            parser.error(f"--node {spec} is not nickname=package.module:ClassName")
+        nodes.append((nickname, class_path))
+
+    launcher = Launcher(args.nickname, args.host, args.port, args.password, args.socket, PRELOAD + args.preload)
+    launcher.run(nodes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import bisect
+import json
+import time
+
+
+'''
+low overhead timing of a node's hot path. every operation (and stream) gets a fixed bucket histogram of its
+duration, filled from the monotonic clock. the node flushes all histograms as one compact entry to the
+{nickname}_metrics stream every interval and starts over. publish to consume latency of read entries is worked out
+from the millisecond time in their redis ids. nothing in here runs unless metrics are turned on in PARAMETERS
+'''
+
+# upper edges of the histogram buckets in microseconds. anything slower lands in the last, open ended bucket
+BUCKET_EDGES_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 1000000)
+
+
+class Histogram():
+    __slots__ = ("counts", "count", "total_us", "max_us")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_EDGES_US) + 1)
+        self.count = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+
+    def record(self, microseconds):
+        self.counts[bisect.bisect_left(BUCKET_EDGES_US, microseconds)] += 1
+        self.count += 1
+        self.total_us += microseconds
+        if microseconds > self.max_us:
+            self.max_us = microseconds
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_us": round(self.total_us / self.count, 2) if self.count else 0.0,
+            "max_us": round(self.max_us, 2),
+            "buckets": self.counts,
+        }
+
+
+class NodeMetrics():
+    def __init__(self, name, interval_s=1.0):
+        self.name = name
+        self.stream_name = f"{name}_metrics"
+        self.interval_s = interval_s
+        self.histograms = {}
+        self.__window_start = time.monotonic()
+
+    #records a duration in seconds of an operation, optionally on a single stream
+    def record(self, operation, seconds, stream_name=None):
+        histogram = self.histograms.get((operation, stream_name))
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[(operation, stream_name)] = histogram
+        histogram.record(seconds * 1e6)
+
+    #records how long ago the entries were published, using the millisecond part of their redis ids
+    def record_latency(self, stream_name, entry_ids):
+        now_ms = time.time() * 1000
+        histogram = self.histograms.get(("latency", stream_name))
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[("latency", stream_name)] = histogram
+        for entry_id in entry_ids:
+            published_ms = int(entry_id.split(b'-', 1)[0] if isinstance(entry_id, bytes) else entry_id.split('-', 1)[0])
+            histogram.record(max(now_ms - published_ms, 0.0) * 1000)
+
+    def due(self):
+        return time.monotonic() - self.__window_start >= self.interval_s
+
+    def snapshot(self):
+        return {
+            "interval_s": round(time.monotonic() - self.__window_start, 3),
+            "bucket_edges_us": BUCKET_EDGES_US,
+            "ops": {operation if stream_name is None else f"{operation}:{stream_name}": histogram.summary()
+                    for (operation, stream_name), histogram in self.histograms.items()},
+        }
+
+    #writes everything since the last flush as one entry to the metrics stream and starts a new window
+    def flush(self, redis_client):
+        redis_client.xadd(self.stream_name, {"metrics": json.dumps(self.snapshot(), separators=(',', ':'))})
+        self.histograms = {}
+        self.__window_start = time.monotonic()
@@ -1,36 +1,68 @@
+import time
+_import_start = time.perf_counter()
 import sys
-import argparse
 import signal
 import json
 import sys
 import os
 from . import pynode_tools as PNT
+from .pymetrics import NodeMetrics
+from .pyscheduler import make_scheduler
+from .pyprofiler import Profiler
 import redis
-import builtins
 import traceback
 
+# how long this module and everything it pulls in took to import. reported in the startup timing
+IMPORT_S = time.perf_counter() - _import_start
+# set by pylauncher in a node forked from the warm launcher to when the fork happened
+LAUNCHED_AT = None
+
 
 class BRANDNode():
     def __init__(self):
+        init_start = time.perf_counter()
 
         # parse input arguments
-        parser = argparse.ArgumentParser()
-        parser.add_argument('-n', '--nickname', type=str, required=True, default='node')
-        parser.add_argument('-i', '--host', type=str, required=True, default='localhost')
-        parser.add_argument('-p', '--port', type=str, required=True, default=6379)
-        parser.add_argument('-a', '--password', type=str, required=False)
-        args = vars(parser.parse_args())
-        self.NAME = args["nickname"]
-        args.pop("nickname")
+        self.NAME, args = PNT.parse_node_args()
+        args_done = time.perf_counter()
 
         # connect to Redis
         self.realtime_database, self.persistant_database = self.connect_to_redis(**args)
+        self.dtype_cache = PNT.get_dtype_cache(self.realtime_database)
+        connected = time.perf_counter()
 
         # initialize parameters
         self.supergraph_id = '0-0'
         self.__stream_ids = {}
-        self.parameters = self.get_parameters()
+        self.__stream_cursors = {}
+        self.__windows = {}
+        self.__aligners = {}
+        self.stream_trim = {}
+        self.last_batch_timing = None
+        # a cached view of PARAMETERS that run() keeps up to date, see on_parameters_changed
+        self.parameter_watch = PNT.ParameterWatch(self.persistant_database, self.NAME)
+        self.parameters = self.parameter_watch.parameters
+        self.parameter_watch.set_interval(self.parameters.get('parameters_interval_s', 1.0))
+        parameters_done = time.perf_counter()
+
+        # hot path timings published to {nickname}_metrics. off unless the parameters turn them on
+        self.metrics = None
+        if self.parameters.get('metrics', False):
+            self.metrics = NodeMetrics(self.NAME, self.parameters.get('metrics_interval_s', 1.0))
+            PNT.enable_metrics(self.realtime_database, self.metrics)
+
+        # dropping cached dtypes as soon as an _init stream changes needs keyspace notifications for the whole server,
+        # so it is off unless the parameters turn it on. add_checked and read_after notice a changed dtype either way
+        if self.parameters.get('watch_init_streams', False):
+            self.dtype_cache.watch(self.realtime_database)
+
+        # paces the work() loop in run(). free running unless the parameters pick another scheduler
+        self.events = {}
+        self.scheduler = make_scheduler(self, self.parameters, self.metrics)
 
+        # takes profiling commands from {nickname}_control, checked by run() every control_interval_s
+        self.profiler = Profiler(self.NAME, self.realtime_database, self.persistant_database,
+                                 self.parameters.get('control_interval_s', 1.0))
     
 
         signal.signal(signal.SIGTERM, self.terminate)
@@ -38,37 +70,47 @@ class BRANDNode():
         #silence all print statements based on silence parameters. I lowkey think this might be a bad feature
         self.silence = self.parameters.get('silence', False)
         print(f"[{self.NAME}] Silence: {self.silence}")
-        builtins._original_print = builtins.print
-        def custom_print(*args, **kwargs):
-            if not self.silence:
-                builtins._original_print(*args, **kwargs)
-        builtins.print = custom_print
+        PNT.silence_print(self)
 
         #print the pid to stream for process tracking
         self.realtime_database.xadd("pid_stream", {self.NAME: os.getpid()})
 
+        #where the startup time went, so slow starting nodes can be told apart from slow graphs
+        self.startup_timing = self.get_startup_timing(init_start, args_done, connected, parameters_done)
+        self.realtime_database.xadd(self.NAME + '_state', {'code': 0, 'status': 'startup',
+                                                          'timing': json.dumps(self.startup_timing)})
+
+
+    def get_startup_timing(self, init_start, args_done, connected, parameters_done):
+        """
+        breakdown of the node's startup in seconds. a node forked by pylauncher did its imports in the launcher,
+        so its launch_s is the time from the fork to __init__ instead
+        """
+        end = time.perf_counter()
+        launched = LAUNCHED_AT is not None
+        timing = {
+            "launcher": launched,
+            "import_s": 0.0 if launched else IMPORT_S,
+            "launch_s": init_start - LAUNCHED_AT if launched else 0.0,
+            "args_s": args_done - init_start,
+            "connect_s": connected - args_done,
+            "parameters_s": parameters_done - connected,
+            "setup_s": end - parameters_done,
+            "total_s": end - LAUNCHED_AT if launched else IMPORT_S + end - init_start,
+        }
+        return {key: round(value, 6) if isinstance(value, float) else value for key, value in timing.items()}
 
-    def connect_to_redis(self, **kwargs):
+    def connect_to_redis(self, host='localhost', port=6379, password=None, socket=None):
         """
         Establish connection to Redis and post initialized status to respective Redis stream
         If we supply a -h flag that starts with a number, then we require a -p for the port
+        A -s unix socket path is used instead of host and port, which saves the loopback tcp stack on every command
         If we fail to connect, then exit status 1
         # If this function completes successfully then it executes the following Redis command:
         # XADD nickname_state * code 0 status "initialized"
         """
 
-        try:
-            if "socket" in kwargs:
-                #r = redis.StrictRedis(unix_socket_path=redis_socket)
-                print("redis socket isn't currently implemented on windows and will never be lmao")
-                #print(f"[{self.NAME}] Redis connection established on socket:"f" {redis_socket}")
-
-            r_temp = redis.StrictRedis(**kwargs, db=0)
-            r_pers = redis.StrictRedis(**kwargs, db=1)
-            #print(f"[{self.NAME}] Redis connection established on host:
-        except ConnectionError as e:
-            print(f"[{self.NAME}] Error with Redis connection, check again: {e}")
-            sys.exit(1)
+        r_temp, r_pers = PNT.connect_node(self.NAME, host, port, password, socket)
 
         initial_data = {
             'code': 0,
@@ -91,11 +133,12 @@ class BRANDNode():
 
     '''
 
-    def init_stream(self, stream_name, dtype: str):
+    def init_stream(self, stream_name, dtype: str, packed=False):
         """
-        you should always do this as best practise. makes a stream named {stream_name}_init with the dype details 
+        you should always do this as best practise. makes a stream named {stream_name}_init with the dype details.
+        packed=True sends each entry of a dict dtype as one binary field (see pypacked)
         """
-        PNT.init_stream(self.realtime_database, stream_name, dtype)
+        PNT.init_stream(self.realtime_database, stream_name, dtype, packed)
 
     def get_stream_init(self, stream_name):
         """
@@ -105,9 +148,21 @@ class BRANDNode():
 
     def get_stream_dtype(self, stream_name):
         """
-        gets just the dtype from the stream init 
+        gets just the dtype from the stream init. served from the dtype cache after the first lookup
+        """
+        return PNT.get_cached_dtype(self.realtime_database, stream_name)
+
+    def get_codec_plan(self, stream_name):
+        """
+        gets the compiled encoders/decoders for the stream's dtype
+        """
+        return PNT.get_codec_plan(self.realtime_database, stream_name)
+
+    def get_dtype_cache_stats(self):
+        """
+        hit/miss counters of the dtype cache shared with pynode_tools. every hit is a sample that cost one round trip
         """
-        return PNT.get_stream_dtype(self.realtime_database, stream_name)
+        return self.dtype_cache.stats()
 
     # get the latest enread entry from the redis stream
     def read_latest(self, stream_name):
@@ -116,6 +171,52 @@ class BRANDNode():
         """
         return PNT.read_latest(self.realtime_database, stream_name, self.__stream_ids)
 
+    # get every unread entry from one or more redis streams
+    def read_new(self, streams, block_ms=None, count=None):
+        """
+        reads every entry added since the last call for each stream in one XREAD and returns {stream: [entries]}.
+        nothing is skipped between calls. pass block_ms to sleep in redis until data arrives instead of polling
+        """
+        return PNT.read_new(self.realtime_database, streams, self.__stream_cursors, block_ms, count)
+
+    # read every entry after a cursor along with the dtype they were written with
+    def read_after(self, stream_name, cursor, count=None):
+        """
+        reads every entry after cursor and the stream's current dtype in one atomic round trip. returns (dtype, entries)
+        """
+        return PNT.read_after(self.realtime_database, stream_name, cursor, count)
+
+    # keep the last n samples of a stream as an array without redecoding them every tick
+    def window(self, stream_name, n, key="data"):
+        """
+        returns the rolling window of the last n samples of the stream key after reading only the new entries.
+        window.view() is a zero copy, oldest to newest (samples x elements) array that is reused between calls
+        """
+        window = self.__windows.get((stream_name, key))
+        if window is None or window.n != n:
+            window = PNT.StreamWindow(stream_name, n, key)
+            self.__windows[(stream_name, key)] = window
+        return PNT.update_window(self.realtime_database, window)
+
+    # read several streams joined on their entry timestamps
+    def read_aligned(self, streams, tolerance_ms=None, mode="nearest", block_ms=None, max_buffer=1000):
+        """
+        reads every stream in one XREAD and returns the (streams[0] entry, streams[1] entry, ...) tuples that line up
+        on their redis timestamps, one per entry of the first stream. mode is nearest, previous (sample and hold) or
+        exact. dropped and unmatched counts are in get_aligned_stats
+        """
+        aligner = self.__aligners.get(tuple(streams))
+        if aligner is None or aligner.mode != mode or aligner.tolerance_ms != tolerance_ms:
+            aligner = PNT.StreamAligner(streams, tolerance_ms, mode, max_buffer)
+            self.__aligners[tuple(streams)] = aligner
+        return PNT.read_aligned(self.realtime_database, aligner, block_ms)
+
+    def get_aligned_stats(self, streams):
+        """
+        emitted, dropped, unmatched and buffered counts of the read_aligned join of these streams
+        """
+        return self.__aligners[tuple(streams)].stats()
+
     # take a series of stream entries and decode them into kvps with the time stamp as index 1 and the value dictionary as index 2 
     def decode(self, redis_entries, stream_name = None, dtype = None):
         """
@@ -123,26 +224,135 @@ class BRANDNode():
         """
         return PNT.decode(self.realtime_database, redis_entries, stream_name, dtype)
 
+    def decode_columnar(self, redis_entries, stream_name = None, dtype = None):
+        """
+        decodes the stream entries into (timestamps, {key: 2d array}). use this instead of decode for large reads
+        """
+        return PNT.decode_columnar(self.realtime_database, redis_entries, stream_name, dtype)
+
     def encode_from_dtype(self, data, dtype):
         """
         encodes the data from the dype 
         """
         PNT.encode_from_dtype(data, dtype)
 
-    def add_to_stream(self, stream_name: str, data, dtype=None):
+    def add_to_stream(self, stream_name: str, data, dtype=None, check_schema=False):
+        """
+        encodes the data and adds it to the redis stream. with check_schema the add is only done if the stream wasn't
+        started over with another dtype since it was encoded (costs a script call instead of a plain XADD)
+        """
+        if check_schema and dtype is None:
+            return PNT.add_checked(self.realtime_database, stream_name, data, self.stream_trim.get(stream_name))
+        PNT.add_to_stream(self.realtime_database, stream_name, data, dtype, self.stream_trim.get(stream_name))
+
+    def set_stream_trim(self, stream_name: str, maxlen=None, minid=None, approximate=True):
+        """
+        trims the stream on every add from this node. keep either the last maxlen entries or everything from minid on.
+        raises ValueError if both are given
+        """
+        if maxlen is None and minid is None:
+            self.stream_trim.pop(stream_name, None)
+        else:
+            trim = {"maxlen": maxlen, "minid": minid, "approximate": approximate}
+            PNT.check_trim(trim)
+            self.stream_trim[stream_name] = trim
+
+    def add_many(self, entries):
+        """
+        encodes a list of (stream_name, data) or (stream_name, data, dtype) entries and sends them in one pipeline.
+        the timing of the batch is kept in last_batch_timing
+        """
+        entry_ids, self.last_batch_timing = PNT.add_many(self.realtime_database, entries, self.stream_trim)
+        return entry_ids
+
+    def batch(self):
+        """
+        context manager version of add_many. everything added inside the with block is sent in one pipeline on exit
+        and the timing is on the batch's timing attribute
+        """
+        return PNT.StreamBatch(self.realtime_database, self.stream_trim)
+
+    def get_scheduler_stats(self):
+        """
+        tick, overrun and skipped tick counts of the run() scheduler and a histogram of how late its ticks woke up
+        """
+        return self.scheduler.stats()
+
+    def start_profile(self, mode="cprofile", seconds=None, ticks=None, interval_ms=1.0, limit=100):
+        """
+        profiles work() with cprofile or a sampling thread for seconds or ticks. the result goes to PROFILES in db1,
+        the same as a start command on the {nickname}_control stream (see pyprofiler)
+        """
+        self.profiler.start(mode, seconds, ticks, interval_ms, limit)
+
+    def stop_profile(self):
         """
-        encodes the data and adds it to the redis stream
+        ends the running profile, saves it to db1 and returns it
         """
-        PNT.add_to_stream(self.realtime_database, stream_name, data, dtype)
+        return self.profiler.stop()
 
     def get_parameters(self):
-        return json.loads(self.persistant_database.hget("PARAMETERS", self.NAME).decode())
+        """
+        reads the node's PARAMETERS from redis as a dict. self.parameters is the cached view of the same thing
+        """
+        raw = self.persistant_database.hget("PARAMETERS", self.NAME)
+        if raw is None:
+            raise KeyError(f"{self.NAME} has no PARAMETERS")
+        return json.loads(raw)
+
+    def update_parameters(self):
+        """
+        swaps in the parameters the watch picked up and calls on_parameters_changed with the keys that changed. run()
+        calls this when PARAMETERS changed. a node that blocks in work() can call self.parameter_watch.check() itself
+        """
+        previous = self.parameters
+        self.parameters = self.parameter_watch.parameters
+        self.silence = self.parameters.get('silence', False)
+        changed = self.parameters.changed_from(previous)
+        if len(changed) > 0:
+            print(f"[{self.NAME}] parameters changed: {sorted(changed)}")
+            self.on_parameters_changed(changed, previous)
+
+    # meant to be overridden. called between ticks with the set of keys that were added, removed or changed, after
+    # self.parameters is the new view. things set up from the parameters in __init__ (the scheduler, metrics,
+    # workers) aren't rebuilt unless this does it
+    def on_parameters_changed(self, changed, previous):
+        pass
 
     #run the function. override with caution because the logic to capture the error trace is implemented here
     def run(self):
         try:
+            # with more than one worker the node runs process() in a pool instead of calling work()
+            if self.parameters.get('workers', 1) > 1:
+                self.run_worker_pool()
+            wait = self.scheduler.wait
+            profiler = self.profiler
+            parameter_watch = self.parameter_watch
+            if self.metrics is None:
+                while True:
+                    wait()
+                    if profiler.active:
+                        profiler.tick(self.work)
+                    else:
+                        self.work()
+                    if time.monotonic() >= profiler.next_poll:
+                        profiler.poll()
+                    if parameter_watch.check():
+                        self.update_parameters()
             while True:
-                self.work()
+                wait()
+                start = time.perf_counter()
+                if profiler.active:
+                    profiler.tick(self.work)
+                else:
+                    self.work()
+                self.metrics.record("work", time.perf_counter() - start)
+                if self.metrics.due():
+                    self.metrics.flush(self.realtime_database)
+                if time.monotonic() >= profiler.next_poll:
+                    profiler.poll()
+                if parameter_watch.check():
+                    self.update_parameters()
         except Exception:
             #uncaught error occured. logging it to the redis error stream before exiting
             error = traceback.format_exc()
@@ -152,6 +362,24 @@ class BRANDNode():
     def work(self):
         pass
 
+    def run_worker_pool(self):
+        """
+        starts the parameter's number of worker processes that share the input_streams through a consumer group and 
+        calls process() on every entry. results are published to output_stream in input order
+        """
+        from .pyworkerpool import WorkerPool
+        self.worker_pool = WorkerPool(self, self.parameters['workers'], self.parameters['input_streams'],
+                                      self.parameters.get('output_stream', f"{self.NAME}_output"),
+                                      block_ms=self.parameters.get('worker_block_ms', 100),
+                                      count=self.parameters.get('worker_count', 10),
+                                      claim_idle_ms=self.parameters.get('worker_claim_idle_ms', 5000))
+        self.worker_pool.run()
+
+    # meant to be overridden when running with workers. gets one (id, fields) entry of stream_name and returns the data
+    # to publish to the output stream, or None to publish nothing
+    def process(self, stream_name, entry):
+        return None
+
     # meant to be overridden 
     def terminate(self, sig, frame):
         #logging.info('SIGINT received, Exiting')
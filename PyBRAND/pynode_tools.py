@@ -1,9 +1,20 @@
 #!/usr/bin/env python
+import argparse
+import builtins
 import json
+import socket
 import struct
+import sys
+import time
+import weakref
+from collections import deque
+from collections.abc import Mapping
 import numpy as np
-from litework import python_analysis_tools as PAT, ArmatureStruct
+import redis
 import warnings
+from . import pyshm as PSHM
+from . import pypacked as PPK
+from . import pycodecs as PCD
 
 
 '''
@@ -21,33 +32,47 @@ SHOULD HANDLE THESE WARNINGS APPROPRIATELY TO CRASH/NOCRASH THE SYSTEM AS NEEDED
 ALSO MAKES PYTESTNG EASIER
 '''
 
+# litework is slow to import and most nodes never need it, so it is only imported the first time a dtype has to be
+# looked up in it. an ArmatureStruct can only exist once someone imported litework, which is what is_armature checks
+def get_analysis_tools():
+    from litework import python_analysis_tools
+    return python_analysis_tools
+
+def is_armature(data):
+    litework = sys.modules.get("litework")
+    return litework is not None and isinstance(data, litework.ArmatureStruct)
+
+
 #class used in place of a warning because this will be wrapped. raises an error instead of a warning
 class WarningError(Exception):
     pass 
 
 
-#MUST TAKE STREAM IDS AS A PARAM AND UPDATE IT. SHOULDN'T BE EXPODED TO THE NODE END WRAPPER BUT NEEDED HERE
-def init_stream(redis_client, stream_name, dtype: str):
-
-    #check to see if an init stream already exists for this stream
-    init_name = f"{stream_name}_init"
-    if redis_client.exists(init_name):
-        first_entry = redis_client.xrange(init_name, '-', '+', count=1)
-        if first_entry is not None:
-            existing_dtype = first_entry[0][1][b'dtype'].decode()
-            print(f"existing dtype: {existing_dtype} and new dtype: {dtype}")
-            if dtype != existing_dtype:
-                raise WarningError(f"can not init. Stream {stream_name} has already been started with a different dtype")
-        return
-    
-    #check if a string represents a valid dtype, if so, return the string 
-    def get_valid_dstring(dstring) -> str:
-        dstring = dstring.lower()
-        if dstring == "serial" or PAT.get_struct_format(dstring) is not None:
+#check if a string represents a valid dtype, if so, return the string 
+def get_valid_dstring(dstring) -> str:
+    if PPK.is_packed_dtype(dstring):
+        return PPK.make_packed_dtype(PPK.parse_packed_dtype(dstring))
+    dstring = dstring.lower()
+    if PCD.is_serial_dtype(dstring):
+        #raises if the codec isn't there
+        PCD.get_serial_codec(dstring)
+        return dstring
+    if get_analysis_tools().get_struct_format(dstring) is not None:
+        return dstring
+    if PSHM.is_shm_dtype(dstring):
+        #payloads that go through shared memory have to be numpy arrays
+        try:
+            np.dtype(PSHM.parse_shm_dtype(dstring)[0])
             return dstring
-        raise ValueError(f"dtype {dstring} is not a valid type")
-
+        except TypeError:
+            pass
+    raise ValueError(f"dtype {dstring} is not a valid type")
 
+#builds the field dict of a stream's init entry from a dtype string or dict. packed dict dtypes are sent as a single
+#binary field per entry, see pypacked
+def make_init_entry(dtype, packed=False):
+    if packed:
+        return {"dtype": PPK.make_packed_dtype(dtype)}
     dtype_dict = {}
     #accept either a string or a dict. 
     if isinstance(dtype, str):
@@ -66,7 +91,28 @@ def init_stream(redis_client, stream_name, dtype: str):
             raise ValueError("could not init stream. EVERY dtype in dict was invalid")
     else:
         pass
-    redis_client.xadd(init_name, dtype_dict)
+    return dtype_dict
+
+
+#MUST TAKE STREAM IDS AS A PARAM AND UPDATE IT. SHOULDN'T BE EXPODED TO THE NODE END WRAPPER BUT NEEDED HERE
+def init_stream(redis_client, stream_name, dtype: str, packed=False):
+    dtype_dict = make_init_entry(dtype, packed)
+    #one atomic round trip. the init entry is only added if there isn't one, so two nodes starting the same stream
+    #can't both add it
+    reply = get_stream_scripts(redis_client).init_or_verify(keys=[f"{stream_name}_init"],
+                                                            args=flatten_fields(dtype_dict))
+    check_init_reply(stream_name, dtype_dict, reply)
+    get_dtype_cache(redis_client).put(stream_name, parse_dtype(dtype_dict["dtype"]), dtype_dict["dtype"].encode(),
+                                      own_write=bool(reply[2]))
+
+#checks the reply of the init_or_verify script. raises if the stream was already started with a different dtype
+def check_init_reply(stream_name, dtype_dict, reply):
+    _, existing_dtype, created = reply
+    if not created:
+        existing_dtype = existing_dtype.decode() if existing_dtype is not None else None
+        print(f"existing dtype: {existing_dtype} and new dtype: {dtype_dict['dtype']}")
+        if existing_dtype != dtype_dict["dtype"]:
+            raise WarningError(f"can not init. Stream {stream_name} has already been started with a different dtype")
 
 
 #check to see if the stream's first entry... exits? how is this useful in any context? couldn't this just combined with below? 
@@ -81,23 +127,547 @@ def get_stream_init(redis_client, stream_name):
 #gets the stream's dtype from the stream init entry. raises error if no stream init
 def get_stream_dtype(redis_client, stream_name):
     init_entry = get_stream_init(redis_client, stream_name)
-    dtype_data = init_entry[b'dtype']
+    return parse_dtype(init_entry[b'dtype'])
+
+#gets (schema version, dtype) of the stream. the version is the raw dtype field of the init entry, which is what
+#the scripts compare against. the init entry id isn't used since a stream deleted and started over within the
+#same millisecond gets the same id again
+def get_stream_version(redis_client, stream_name):
+    init_entry = get_stream_init(redis_client, stream_name)
+    return init_entry[b'dtype'], parse_dtype(init_entry[b'dtype'])
+
+#turns the dtype field of an init entry back into a dtype string or dict
+def parse_dtype(dtype_data):
+    if isinstance(dtype_data, bytes):
+        dtype_data = dtype_data.decode()
     # see if the data is a dict, or a string
     try:
-        dtype_dict = json.loads(dtype_data.decode())
+        dtype_dict = json.loads(dtype_data)
         return dtype_dict
     except ValueError:
         try:
-            dtype = dtype_data.decode()
+            dtype = str(dtype_data)
             return dtype
         except Exception as e:
             raise ValueError(f"could not decode dtype data. original error: {e}")
 
+
+#turns on the keyspace notification classes in flags without dropping the ones the server already has on
+def enable_keyspace_events(redis_client, flags):
+    current = redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+    if isinstance(current, bytes):
+        current = current.decode()
+    # "A" is the server's alias for every data type class
+    covered = current + ("g$lshzxetd" if "A" in current else "")
+    missing = "".join(flag for flag in flags if flag not in covered)
+    if missing:
+        redis_client.config_set("notify-keyspace-events", current + missing)
+
+
+# keepalive probes on idle node connections so a dead peer is noticed in seconds instead of hours. redis-py already
+# sets TCP_NODELAY on every tcp connection, and parses replies with hiredis by itself when hiredis is installed
+KEEPALIVE_OPTIONS = {option: value for option, value in ((getattr(socket, "TCP_KEEPIDLE", None), 10),
+                                                         (getattr(socket, "TCP_KEEPINTVL", None), 5),
+                                                         (getattr(socket, "TCP_KEEPCNT", None), 3))
+                     if option is not None}
+# a median ping slower than this is logged as a warning at node startup
+RTT_WARN_MS = 1.0
+
+#makes the connection pool of one database. a unix socket path takes the place of host and port. pass the pool
+#class of redis.asyncio for async clients
+def make_connection_pool(host='localhost', port=6379, password=None, socket_path=None, db=0,
+                         pool_class=redis.ConnectionPool, **kwargs):
+    if socket_path is not None:
+        #from_url picks the unix socket connection class that goes with the pool class
+        return pool_class.from_url(f"unix://{socket_path}", db=db, password=password, **kwargs)
+    return pool_class(host=host, port=int(port), db=db, password=password, socket_keepalive=True,
+                      socket_keepalive_options=KEEPALIVE_OPTIONS, **kwargs)
+
+#a pool for another database (or a forked process) with the same connection settings as an existing pool. redis
+#binds the db to each connection, so two databases can't share the connections of one pool
+def make_sibling_pool(pool, db=None, max_connections=None):
+    connection_kwargs = dict(pool.connection_kwargs)
+    if db is not None:
+        connection_kwargs["db"] = db
+    return type(pool)(connection_class=pool.connection_class, max_connections=max_connections, **connection_kwargs)
+
+def get_parser_name():
+    return "hiredis" if redis.utils.HIREDIS_AVAILABLE else "python"
+
+#times n PINGs and returns the min/median/max round trip in milliseconds
+def measure_rtt(redis_client, n=10):
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        redis_client.ping()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {"min_ms": durations[0], "median_ms": durations[n // 2], "max_ms": durations[-1]}
+
+#startup self check so a node talking to the wrong or a remote redis is obvious in the log. measures the ping rtt,
+#logs it with where the node is connected and the parser, warns if it is slow for a local redis and returns it
+def report_rtt(name, redis_client, where):
+    rtt = measure_rtt(redis_client)
+    print(f"[{name}] Redis connection established on {where} with the {get_parser_name()} parser. "
+          f"ping rtt min {rtt['min_ms']:.3f} median {rtt['median_ms']:.3f} max {rtt['max_ms']:.3f} ms")
+    if rtt["median_ms"] > RTT_WARN_MS:
+        print(f"[{name}] WARNING: redis round trips are slow for a local redis. check the host, or use a unix "
+              f"socket (-s)")
+    return rtt
+
+# startup shared by BRANDNode and AsyncBRANDNode
+
+#parses the command line the supervisor starts every node with. returns the nickname and the connection arguments
+def parse_node_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nickname', type=str, required=True, default='node')
+    parser.add_argument('-i', '--host', type=str, required=False, default='localhost')
+    parser.add_argument('-p', '--port', type=str, required=False, default=6379)
+    parser.add_argument('-a', '--password', type=str, required=False)
+    parser.add_argument('-s', '--socket', type=str, required=False, help="unix socket path, used instead of host/port")
+    args = vars(parser.parse_args())
+    return args.pop("nickname"), args
+
+#makes the blocking clients of the realtime (db0) and persistent (db1) databases and logs the ping rtt. a unix
+#socket path is used instead of host and port. a node that can't reach redis can't do anything, so it exits with
+#status 1
+def connect_node(name, host='localhost', port=6379, password=None, socket_path=None):
+    try:
+        pool = make_connection_pool(host, port, password, socket_path, db=0)
+        r_temp = redis.StrictRedis(connection_pool=pool)
+        r_pers = redis.StrictRedis(connection_pool=make_sibling_pool(pool, db=1))
+        report_rtt(name, r_temp, f"socket {socket_path}" if socket_path is not None else f"{host}:{port}")
+    except redis.ConnectionError as e:
+        print(f"[{name}] Error with Redis connection, check again: {e}")
+        sys.exit(1)
+    return r_temp, r_pers
+
+#routes print through a wrapper that drops everything while node.silence is set
+def silence_print(node):
+    #only the first node in a process saves print, a later one would save the first one's wrapper and recurse
+    if not hasattr(builtins, '_original_print'):
+        builtins._original_print = builtins.print
+    def custom_print(*args, **kwargs):
+        if not node.silence:
+            builtins._original_print(*args, **kwargs)
+    builtins.print = custom_print
+
+
+# lua run server side so the multi step stream operations are atomic and cost one round trip. they are sent
+# with EVALSHA, see StreamScripts
+
+# KEYS: init stream. ARGV: fields of the init entry. adds the init entry if the stream has none.
+# returns {init entry id, existing dtype or nil, 1 if it was added}
+LUA_INIT_OR_VERIFY = """
+local first = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', 1)
+if #first == 0 then
+    return {redis.call('XADD', KEYS[1], '*', unpack(ARGV)), false, 1}
+end
+local fields = first[1][2]
+for i = 1, #fields, 2 do
+    if fields[i] == 'dtype' then
+        return {first[1][1], fields[i + 1], 0}
+    end
+end
+return {first[1][1], false, 0}
+"""
+
+# KEYS: stream, init stream. ARGV: schema version, then the XADD arguments after the key (trim, id, fields).
+# only adds the entry if the dtype of the init entry is still the one the data was encoded with
+LUA_CHECKED_XADD = """
+local first = redis.call('XRANGE', KEYS[2], '-', '+', 'COUNT', 1)
+local dtype = false
+if #first > 0 then
+    local fields = first[1][2]
+    for i = 1, #fields, 2 do
+        if fields[i] == 'dtype' then
+            dtype = fields[i + 1]
+        end
+    end
+end
+if dtype ~= ARGV[1] then
+    return redis.error_reply('STALESCHEMA ' .. KEYS[1] .. ' was started over with another dtype since it was read')
+end
+return redis.call('XADD', KEYS[1], unpack(ARGV, 2))
+"""
+
+# KEYS: stream, init stream. ARGV: cursor, max entries (0 for all). returns {init entry or nil, entries after cursor}
+LUA_READ_AFTER = """
+local init = redis.call('XRANGE', KEYS[2], '-', '+', 'COUNT', 1)
+local entries
+if tonumber(ARGV[2]) > 0 then
+    entries = redis.call('XRANGE', KEYS[1], '(' .. ARGV[1], '+', 'COUNT', ARGV[2])
+else
+    entries = redis.call('XRANGE', KEYS[1], '(' .. ARGV[1], '+')
+end
+return {init[1] or false, entries}
+"""
+
+_stream_scripts = weakref.WeakKeyDictionary()
+
+class StreamScripts():
+    '''
+    the lua scripts above, registered on one connection. every call is an EVALSHA of the script's sha and redis-py
+    loads the script and retries by itself when the server answers NOSCRIPT, e.g. after a restart or SCRIPT FLUSH
+    '''
+    def __init__(self, redis_client):
+        self.init_or_verify = redis_client.register_script(LUA_INIT_OR_VERIFY)
+        self.checked_xadd = redis_client.register_script(LUA_CHECKED_XADD)
+        self.read_after = redis_client.register_script(LUA_READ_AFTER)
+
+#gets the scripts for this connection, registering them on first use
+def get_stream_scripts(redis_client) -> StreamScripts:
+    scripts = _stream_scripts.get(redis_client)
+    if scripts is None:
+        scripts = StreamScripts(redis_client)
+        _stream_scripts[redis_client] = scripts
+    return scripts
+
+#{field: value} to the flat [field, value, ...] list redis commands and scripts take
+def flatten_fields(fields):
+    return [item for pair in fields.items() for item in pair]
+
+#scripts get raw replies, so entries come back as [id, [field, value, ...]]
+def _parse_entry(entry):
+    return entry[0], dict(zip(entry[1][::2], entry[1][1::2]))
+
+
+# one dtype cache per redis connection, shared by the node and the bare pynode_tools functions
+_dtype_caches = weakref.WeakKeyDictionary()
+
+class DtypeCache():
+    '''
+    caches stream dtypes, compiled into codec plans, so add_to_stream and decode don't do an XRANGE on 
+    {stream}_init for every sample.
+    entries are filled by init_stream and on the first lookup and are dropped by invalidate(). add_checked and
+    read_after check the cached version against the _init stream in their scripts, so they notice a stream that was
+    started over by themselves. watch() subscribes to the _init streams and drops an entry as soon as its _init
+    stream changes, but it turns on keyspace notifications for the whole server, which every write then pays for,
+    so it is opt in. hits and misses are counted so the hot path can be checked
+    '''
+    def __init__(self, redis_client, watch=False):
+        self.plans = {}
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.watching = False
+        self._pubsub = None
+        #notifications of init entries this cache wrote itself, which must not drop the entry they just cached
+        self._own_writes = {}
+        if watch:
+            self.watch(redis_client)
+
+    def watch(self, redis_client):
+        if self.watching:
+            return True
+        try:
+            enable_keyspace_events(redis_client, "Kgt")
+            db = redis_client.connection_pool.connection_kwargs.get("db", 0)
+            self._pubsub = redis_client.pubsub()
+            self._pubsub.psubscribe(f"__keyspace@{db}__:*_init")
+            self.watching = True
+        except redis.RedisError as e:
+            self._pubsub = None
+            print(f"could not watch _init streams for changes. dtype cache must be invalidated by hand. original error: {e}")
+        return self.watching
+
+    #reads the pending notifications off the pubsub socket. this never sends a command so it costs no round trip
+    def _drain(self):
+        try:
+            message = self._pubsub.get_message()
+            while message is not None:
+                if message["type"] == "pmessage":
+                    stream_name = message["channel"].decode().split(":", 1)[1][:-len("_init")]
+                    if message["data"] == b"xadd" and self._own_writes.get(stream_name, 0) > 0:
+                        self._own_writes[stream_name] -= 1
+                    else:
+                        self.invalidate(stream_name)
+                message = self._pubsub.get_message()
+        except redis.ConnectionError as e:
+            #lost the notifications so nothing in the cache can be trusted anymore
+            print(f"lost connection watching _init streams. clearing dtype cache. original error: {e}")
+            self._pubsub = None
+            self.watching = False
+            self._own_writes.clear()
+            self.invalidate()
+
+    def get(self, redis_client, stream_name):
+        return self.get_plan(redis_client, stream_name).dtype
+
+    #gets the compiled codec plan for the stream
+    def get_plan(self, redis_client, stream_name):
+        if self._pubsub is not None:
+            self._drain()
+        plan = self.plans.get(stream_name)
+        if plan is None:
+            self.misses += 1
+            version, dtype = get_stream_version(redis_client, stream_name)
+            plan = compile_codec_plan(dtype, stream_name)
+            self.plans[stream_name] = plan
+            self.versions[stream_name] = version
+        else:
+            self.hits += 1
+        return plan
+
+    #gets the schema version (raw init dtype) the cached plan was compiled from
+    def get_version(self, redis_client, stream_name):
+        if stream_name not in self.versions:
+            #plans put without a version are looked up again
+            self.plans.pop(stream_name, None)
+        self.get_plan(redis_client, stream_name)
+        return self.versions[stream_name]
+
+    #own_write is true when the caller just added the stream's init entry itself, so the notification of that
+    #add is skipped instead of dropping the entry again
+    def put(self, stream_name, dtype, version=None, own_write=False):
+        if own_write and self.watching:
+            self._own_writes[stream_name] = self._own_writes.get(stream_name, 0) + 1
+        self.plans[stream_name] = compile_codec_plan(dtype, stream_name)
+        if version is not None:
+            self.versions[stream_name] = version
+        else:
+            self.versions.pop(stream_name, None)
+
+    #drop a single stream, or everything if no stream is given
+    def invalidate(self, stream_name=None):
+        if stream_name is None:
+            self.invalidations += len(self.plans)
+            self.plans.clear()
+            self.versions.clear()
+        elif self.plans.pop(stream_name, None) is not None:
+            self.versions.pop(stream_name, None)
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": len(self.plans),
+            "watching": self.watching,
+        }
+
+#gets the dtype cache for this connection, making it on first use
+def get_dtype_cache(redis_client) -> DtypeCache:
+    cache = _dtype_caches.get(redis_client)
+    if cache is None:
+        cache = DtypeCache(redis_client)
+        _dtype_caches[redis_client] = cache
+    return cache
+
+#same as get_stream_dtype but only goes to redis on a cache miss
+def get_cached_dtype(redis_client, stream_name):
+    return get_dtype_cache(redis_client).get(redis_client, stream_name)
+
+#gets the codec plan for an explicitly provided dtype, or for the stream's dtype through the cache
+def get_codec_plan(redis_client, stream_name=None, dtype=None):
+    if dtype is not None:
+        return compile_codec_plan(dtype, stream_name)
+    return get_dtype_cache(redis_client).get_plan(redis_client, stream_name)
+
+
+class Parameters(Mapping):
+    '''
+    read only view of a node's PARAMETERS. it is a Mapping, so parameters["gain"] and parameters.get("gain", 1.0)
+    work as they did on the dict. the typed getters convert a value once and keep the result, and since a reload
+    makes a new view instead of changing this one, a reference held through a tick never changes under it
+    '''
+    __slots__ = ("_values", "_typed", "version")
+
+    def __init__(self, values, version=0):
+        self._values = values
+        self._typed = {}
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Parameters(version={self.version}, {self._values})"
+
+    #the value converted with cast, or default if the key isn't there. raises ValueError if it can't be converted
+    def get_typed(self, key, cast, default=None):
+        try:
+            return self._typed[(key, cast)]
+        except KeyError:
+            pass
+        if key not in self._values:
+            return default
+        try:
+            value = cast(self._values[key])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"parameter {key}={self._values[key]!r} is not a {getattr(cast, '__name__', cast)}. "
+                             f"original error: {e}")
+        self._typed[(key, cast)] = value
+        return value
+
+    def get_int(self, key, default=None):
+        return self.get_typed(key, int, default)
+
+    def get_float(self, key, default=None):
+        return self.get_typed(key, float, default)
+
+    def get_bool(self, key, default=None):
+        return self.get_typed(key, to_bool, default)
+
+    #the value as a numpy array. it is shared by every caller so it is read only
+    def get_array(self, key, dtype=np.float64, default=None):
+        dtype = np.dtype(dtype)
+        array = self._typed.get((key, dtype))
+        if array is None:
+            if key not in self._values:
+                return default
+            array = np.array(self._values[key], dtype=dtype)
+            array.flags.writeable = False
+            self._typed[(key, dtype)] = array
+        return array
+
+    #keys that were added, removed or changed since the other view
+    def changed_from(self, other):
+        missing = object()
+        return {key for key in self._values.keys() | other._values.keys()
+                if self._values.get(key, missing) != other._values.get(key, missing)}
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        if value.lower() in ("true", "1", "yes", "on"):
+            return True
+        if value.lower() in ("false", "0", "no", "off"):
+            return False
+        raise ValueError(f"{value} is not true or false")
+    return bool(value)
+
+
+class ParameterWatch():
+    '''
+    keeps a node's Parameters up to date with its field of the PARAMETERS hash in the persistent database.
+    when the server allows keyspace notifications it subscribes to PARAMETERS and check() only reads the pending
+    notifications off the pubsub socket, which costs no round trip, so it can be called every tick. otherwise
+    check() does an HGET at most every interval_s. either way the view is only rebuilt when the node's own json
+    changed, not when another node's field was written
+    '''
+    def __init__(self, persistent_client, name, watch=True, interval_s=1.0):
+        self.persistent_client = persistent_client
+        self.NAME = name
+        self.interval_s = interval_s
+        self.next_poll = time.monotonic() + interval_s
+        self.watching = False
+        self.reloads = 0
+        self._pubsub = None
+        self._raw = None
+        self.parameters = None
+        self.previous = None
+        #subscribe before the first read so a change in between isn't missed
+        if watch:
+            self._watch()
+        self.refresh()
+        if self.parameters is None:
+            raise KeyError(f"{name} has no PARAMETERS")
+
+    #changes how often check() polls and schedules the next poll with the new interval, e.g. once the interval has
+    #been read from the parameters the watch just loaded
+    def set_interval(self, interval_s):
+        self.interval_s = interval_s
+        self.next_poll = time.monotonic() + interval_s
+
+    def _watch(self):
+        try:
+            enable_keyspace_events(self.persistent_client, "Khg")
+            db = self.persistent_client.connection_pool.connection_kwargs.get("db", 0)
+            self._pubsub = self.persistent_client.pubsub()
+            self._pubsub.subscribe(f"__keyspace@{db}__:PARAMETERS")
+            self.watching = True
+        except redis.RedisError as e:
+            self._pubsub = None
+            print(f"could not watch PARAMETERS for changes. checking every {self.interval_s} s instead. "
+                  f"original error: {e}")
+
+    #reads the pending notifications. true if PARAMETERS was written since the last call
+    def _drain(self):
+        written = False
+        try:
+            message = self._pubsub.get_message()
+            while message is not None:
+                written = written or message["type"] == "message"
+                message = self._pubsub.get_message()
+        except redis.ConnectionError as e:
+            #lost the notifications, so changes can only be found by polling from now on
+            print(f"lost connection watching PARAMETERS. checking every {self.interval_s} s instead. "
+                  f"original error: {e}")
+            self._pubsub = None
+            self.watching = False
+            written = True
+        return written
+
+    #gets the node's parameters again. true if they changed
+    def refresh(self):
+        raw = self.persistent_client.hget("PARAMETERS", self.NAME)
+        if raw is None or raw == self._raw:
+            return False
+        try:
+            values = json.loads(raw)
+        except ValueError as e:
+            #a half edited value shouldn't take the node down, it keeps running on the last good parameters
+            print(f"PARAMETERS of {self.NAME} are not valid json, keeping the last ones. original error: {e}")
+            return False
+        self._raw = raw
+        self.previous = self.parameters
+        self.parameters = Parameters(values, self.reloads)
+        self.reloads += 1
+        return True
+
+    #true if the parameters changed since the last check. the new view is on parameters and the old one on previous
+    def check(self):
+        if self._pubsub is not None:
+            return self._drain() and self.refresh()
+        now = time.monotonic()
+        if now < self.next_poll:
+            return False
+        self.next_poll = now + self.interval_s
+        return self.refresh()
+
+    def stats(self):
+        return {
+            "version": self.parameters.version,
+            "reloads": self.reloads - 1,
+            "watching": self.watching,
+        }
+
+# hot path timings are collected per connection, only for connections that have metrics turned on. the functions
+# below check the registry once per call, which is a single empty dict check when metrics are off. it is keyed on
+# id() instead of being a WeakKeyDictionary because those build a weakref on every lookup
+_metrics = {}
+
+def enable_metrics(redis_client, metrics):
+    if id(redis_client) not in _metrics:
+        weakref.finalize(redis_client, _metrics.pop, id(redis_client), None)
+    _metrics[id(redis_client)] = metrics
+
+def disable_metrics(redis_client):
+    _metrics.pop(id(redis_client), None)
+
+def get_metrics(redis_client):
+    return _metrics.get(id(redis_client)) if _metrics else None
+
+
 # get the latest enread entry from the redis stream
 #ALSO NEEDS TO RECIEVE THE HEAD IDS AND UPDATE THEM 
 def read_latest(redis_client, stream_name, stream_head_id):
+    metrics = get_metrics(redis_client)
+    if metrics is not None:
+        start = time.perf_counter()
     # get the top entry from the redis data base
     last_entry = redis_client.xrevrange(stream_name, '+', '-', count=1)
+    if metrics is not None:
+        metrics.record("read_latest", time.perf_counter() - start, stream_name)
     # get the id by only looking at the linux epoch time since all entries will share that
     if len(last_entry) != 0:
         redis_time_id = last_entry[0][0].decode()
@@ -108,25 +678,314 @@ def read_latest(redis_client, stream_name, stream_head_id):
             return last_entry[0]
     return None
 
+# read every entry added to the streams since the last call with a single XREAD. unlike read_latest nothing
+# between calls is dropped. stream_cursors holds the last id read per stream and is updated in place. streams
+# seen for the first time start at their current last entry so only new data is returned.
+# block_ms=None returns right away, block_ms=0 blocks until something arrives
+def read_new(redis_client, streams, stream_cursors, block_ms=None, count=None):
+    if isinstance(streams, str):
+        streams = [streams]
+
+    #place the cursor of untracked streams at their head in one pipelined round trip
+    untracked = [stream_name for stream_name in streams if stream_name not in stream_cursors]
+    if len(untracked) > 0:
+        pipe = redis_client.pipeline(transaction=False)
+        for stream_name in untracked:
+            pipe.xrevrange(stream_name, '+', '-', count=1)
+        for stream_name, last_entry in zip(untracked, pipe.execute()):
+            stream_cursors[stream_name] = last_entry[0][0] if len(last_entry) != 0 else b'0-0'
+
+    metrics = get_metrics(redis_client)
+    if metrics is not None:
+        start = time.perf_counter()
+    response = redis_client.xread({stream_name: stream_cursors[stream_name] for stream_name in streams},
+                                  count=count, block=block_ms)
+    new_entries = {stream_name: [] for stream_name in streams}
+    for stream_name, entries in response or []:
+        stream_name = stream_name.decode()
+        new_entries[stream_name] = entries
+        stream_cursors[stream_name] = entries[-1][0]
+    if metrics is not None:
+        #includes the time spent blocked waiting for data
+        metrics.record("read_new", time.perf_counter() - start)
+        for stream_name, entries in new_entries.items():
+            metrics.record_latency(stream_name, [entry[0] for entry in entries])
+    return new_entries
+
+#reads every entry after the cursor together with the stream's current dtype in one atomic round trip, so entries
+#are never decoded with the dtype from before the stream was started over. returns (dtype, entries) where dtype is
+#None if the stream has no init entry. the dtype cache is refreshed when the schema changed
+def read_after(redis_client, stream_name, cursor, count=None):
+    metrics = get_metrics(redis_client)
+    if metrics is not None:
+        start = time.perf_counter()
+    init_entry, entries = get_stream_scripts(redis_client).read_after(keys=[stream_name, f"{stream_name}_init"],
+                                                                     args=[cursor, count or 0])
+    entries = [_parse_entry(entry) for entry in entries]
+    if metrics is not None:
+        metrics.record("read_after", time.perf_counter() - start, stream_name)
+        metrics.record_latency(stream_name, [entry[0] for entry in entries])
+    if init_entry is None:
+        return None, entries
+    _, fields = _parse_entry(init_entry)
+    version = fields[b'dtype']
+    dtype = parse_dtype(version)
+    cache = get_dtype_cache(redis_client)
+    if cache.versions.get(stream_name) != version:
+        cache.put(stream_name, dtype, version)
+    return dtype, entries
+
+# consumer groups let several processes share one input stream. every entry goes to exactly one consumer and
+# stays pending until it is acked
+def create_group(redis_client, stream_name, group, start_id='$'):
+    try:
+        redis_client.xgroup_create(stream_name, group, id=start_id, mkstream=True)
+    except redis.ResponseError as e:
+        #the group already exists, which is fine when several workers start at once
+        if "BUSYGROUP" not in str(e):
+            raise
+
+# reads entries never delivered to anyone in the group for one or more streams. returns {stream: [entries]}
+def read_group(redis_client, group, consumer, streams, block_ms=None, count=None):
+    if isinstance(streams, str):
+        streams = [streams]
+    response = redis_client.xreadgroup(group, consumer, {stream_name: '>' for stream_name in streams},
+                                       count=count, block=block_ms)
+    new_entries = {stream_name: [] for stream_name in streams}
+    for stream_name, entries in response or []:
+        new_entries[stream_name.decode()] = entries
+    return new_entries
+
+# takes over entries that another consumer has left pending for longer than min_idle_ms, e.g. because it crashed
+def claim_stale(redis_client, stream_name, group, consumer, min_idle_ms, count=100):
+    response = redis_client.xautoclaim(stream_name, group, consumer, min_idle_ms, count=count)
+    return response[1]
+
+# pending entry count and lag of the group plus the pending count and idle time of every consumer in it
+def get_group_stats(redis_client, stream_name, group):
+    group_info = next((info for info in redis_client.xinfo_groups(stream_name) 
+                       if info["name"].decode() == group), None)
+    if group_info is None:
+        raise KeyError(f"stream {stream_name} has no group {group}")
+    consumers = {info["name"].decode(): {"pending": info["pending"], "idle_ms": info["idle"]}
+                 for info in redis_client.xinfo_consumers(stream_name, group)}
+    return {
+        "pending": group_info["pending"],
+        "lag": group_info.get("lag"), #only reported by redis 7+
+        "consumers": consumers,
+    }
+
 # take a series of stream entries and decode them into kvps with the time stamp as index 1 and the value dictionary as index 2 
 def decode(redis_client, redis_entries, stream_name = None, dtype = None):
     #check to see if a dtype is provided
-    if dtype is None:
-        try:
-            dtype = get_stream_dtype(redis_client, stream_name)
-        except: 
-            print(f"could not get dtype from stream init and none provided. can not decode for {stream_name}")
-            return
+    try:
+        plan = get_codec_plan(redis_client, stream_name, dtype)
+    except: 
+        print(f"could not get dtype from stream init and none provided. can not decode for {stream_name}")
+        return
 
     #code expects an array. if the output is just a single entry, make it an array
     if isinstance(redis_entries, tuple):
         redis_entries = [redis_entries]
     
-    decoded_entries = PAT.decode_entries(redis_entries, dtype)
+    metrics = get_metrics(redis_client)
+    if metrics is None:
+        return plan.decode(redis_entries, stream_name)
+    start = time.perf_counter()
+    decoded_entries = plan.decode(redis_entries, stream_name)
+    metrics.record("decode", time.perf_counter() - start, stream_name)
     return decoded_entries
             
 
 
+# decode a series of stream entries into one 2d array per key (entries x elements) plus an int64 array of the redis 
+# millisecond timestamps. much cheaper than decode for large reads since it makes one array per key, not per entry
+def decode_columnar(redis_client, redis_entries, stream_name = None, dtype = None):
+    try:
+        plan = get_codec_plan(redis_client, stream_name, dtype)
+    except: 
+        print(f"could not get dtype from stream init and none provided. can not decode for {stream_name}")
+        return
+
+    if isinstance(redis_entries, tuple):
+        redis_entries = [redis_entries]
+    return plan.decode_columnar(redis_entries, stream_name)
+
+
+class StreamWindow():
+    '''
+    keeps the last n samples of one key of a stream in a single preallocated array. every sample is written twice,
+    n rows apart, so the newest n samples are always one contiguous slice and view() never copies or reorders.
+    update() only reads and decodes the newest n of the entries added since its own cursor. the view is overwritten by later
+    updates so copy it if it has to outlive the tick
+    '''
+    def __init__(self, stream_name, n, key="data"):
+        self.stream_name = stream_name
+        self.n = n
+        self.key = key
+        self.cursor = None
+        self.buffer = None
+        self.timestamps = np.zeros(2 * n, dtype=np.int64)
+        self._end = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    #the width of a sample is only known once the first one arrives
+    def _allocate(self, samples):
+        self.buffer = np.zeros((2 * self.n, *samples.shape[1:]), dtype=samples.dtype)
+
+    def push(self, timestamps, samples):
+        if self.buffer is None:
+            self._allocate(samples)
+        n_new = min(len(samples), self.n)
+        positions = (self._end + np.arange(n_new)) % self.n
+        self.buffer[positions] = samples[-n_new:]
+        self.buffer[positions + self.n] = samples[-n_new:]
+        self.timestamps[positions] = timestamps[-n_new:]
+        self.timestamps[positions + self.n] = timestamps[-n_new:]
+        self._end = (self._end + n_new) % self.n
+        self._count = min(self._count + n_new, self.n)
+
+    #oldest to newest view of the window, (samples x elements)
+    def view(self):
+        if self.buffer is None:
+            return None
+        return self.buffer[self.n + self._end - self._count:self.n + self._end]
+
+    def timestamps_view(self):
+        return self.timestamps[self.n + self._end - self._count:self.n + self._end]
+
+    #reads whatever was added since the last update, newest first and at most n entries, so catching up after a
+    #stall never pulls more of the backlog than the window keeps. the first update fills it with the last n entries
+    def update(self, redis_client, plan):
+        start = '-' if self.cursor is None else b'(' + self.cursor
+        entries = redis_client.xrevrange(self.stream_name, '+', start, count=self.n)[::-1]
+        if self.cursor is None:
+            self.cursor = b'0-0'
+        if len(entries) == 0:
+            return
+        self.cursor = entries[-1][0]
+        timestamps, columns = plan.decode_columnar(entries, self.stream_name)
+        samples = columns[self.key]
+        if not isinstance(samples, np.ndarray):
+            raise ValueError(f"can not window {self.key} of {self.stream_name} because it isn't a numpy dtype")
+        self.push(timestamps, samples)
+
+# brings the window up to date with its stream using the stream's dtype and returns it
+def update_window(redis_client, window: StreamWindow, dtype=None):
+    plan = get_codec_plan(redis_client, window.stream_name, dtype)
+    window.update(redis_client, plan)
+    return window
+
+
+
+class StreamAligner():
+    '''
+    joins several streams on the millisecond time in their redis ids. the first stream is the reference, and every
+    reference entry comes out as one tuple (reference entry, entry of streams[1], ...) once every other stream has
+    an entry for it. how an entry is picked for the reference time t:
+
+        nearest     the entry closest to t. waits until the stream has an entry at or after t so a closer one
+                    can't still be coming
+        previous    sample and hold, the last entry at or before t. never waits
+        exact       an entry at t itself. waits until the stream gets to t
+
+    a match further than tolerance_ms from t (None for no limit, not used by exact) doesn't count. a reference entry
+    without a match on some stream is dropped and counted as unmatched on that stream. every stream is buffered in a
+    deque of at most max_buffer entries, and entries pushed out of a full buffer are counted as dropped
+    '''
+    MODES = ("nearest", "previous", "exact")
+
+    def __init__(self, streams, tolerance_ms=None, mode="nearest", max_buffer=1000):
+        if mode not in self.MODES:
+            raise ValueError(f"mode {mode} is not one of {self.MODES}")
+        if len(streams) < 2:
+            raise ValueError("aligning needs at least two streams")
+        self.streams = list(streams)
+        self.tolerance_ms = tolerance_ms
+        self.mode = mode
+        self.cursors = {}
+        self.buffers = {stream_name: deque(maxlen=max_buffer) for stream_name in self.streams}
+        self.emitted = 0
+        self.dropped = {stream_name: 0 for stream_name in self.streams}
+        self.unmatched = {stream_name: 0 for stream_name in self.streams[1:]}
+
+    def push(self, stream_name, entries):
+        buffer = self.buffers[stream_name]
+        for entry in entries:
+            if len(buffer) == buffer.maxlen:
+                self.dropped[stream_name] += 1
+            buffer.append((int(entry[0].split(b'-', 1)[0]), entry))
+
+    #the entry of the buffer that goes with reference time t, False if there is none, or None to wait for more.
+    #entries no later reference can use are popped on the way
+    def _match(self, buffer, t):
+        if self.mode == "exact":
+            while len(buffer) > 0 and buffer[0][0] < t:
+                buffer.popleft()
+            if len(buffer) == 0:
+                return None
+            return buffer[0] if buffer[0][0] == t else False
+
+        #leave the last entry at or before t at the front
+        while len(buffer) > 1 and buffer[1][0] <= t:
+            buffer.popleft()
+        if self.mode == "previous":
+            match = buffer[0] if len(buffer) > 0 and buffer[0][0] <= t else None
+        elif len(buffer) == 0 or (buffer[0][0] < t and len(buffer) == 1):
+            return None
+        elif buffer[0][0] >= t or t - buffer[0][0] <= buffer[1][0] - t:
+            match = buffer[0]
+        else:
+            match = buffer[1]
+        if match is None or (self.tolerance_ms is not None and abs(match[0] - t) > self.tolerance_ms):
+            return False
+        return match
+
+    #takes every reference entry that can be decided now off the buffers and returns the aligned tuples
+    def align(self):
+        aligned = []
+        references = self.buffers[self.streams[0]]
+        while len(references) > 0:
+            t, reference = references[0]
+            matches = [reference]
+            waiting = False
+            for stream_name in self.streams[1:]:
+                match = self._match(self.buffers[stream_name], t)
+                if match is False:
+                    self.unmatched[stream_name] += 1
+                    matches = None
+                    break
+                if match is None:
+                    waiting = True
+                else:
+                    matches.append(match[1])
+            if matches is not None and waiting:
+                break
+            references.popleft()
+            if matches is not None:
+                aligned.append(tuple(matches))
+        self.emitted += len(aligned)
+        return aligned
+
+    def stats(self):
+        return {
+            "emitted": self.emitted,
+            "dropped": dict(self.dropped),
+            "unmatched": dict(self.unmatched),
+            "buffered": {stream_name: len(buffer) for stream_name, buffer in self.buffers.items()},
+        }
+
+# reads every stream of the aligner in one XREAD and returns the tuples that could be aligned with what has arrived
+# so far. each stream starts at its head on the first call
+def read_aligned(redis_client, aligner: StreamAligner, block_ms=None, count=None):
+    new_entries = read_new(redis_client, aligner.streams, aligner.cursors, block_ms, count)
+    for stream_name, entries in new_entries.items():
+        aligner.push(stream_name, entries)
+    return aligner.align()
+
 #method that takes accepted formats and encodes them appropriately
 def encode_from_dtype(data, dtype):
     try:
@@ -138,13 +997,146 @@ def encode_from_dtype(data, dtype):
                 encoded_data = np.array(data, dtype=dtype).tobytes()
                 return encoded_data
             except ValueError:
-                struct_format = PAT.get_struct_format(dtype)
+                struct_format = get_analysis_tools().get_struct_format(dtype)
                 encoded_data = struct.pack(struct_format, data)
                 return encoded_data
     except Exception as e:
         print(f"could not encode data. original error: {e}")
 
 
+#builds the encoder and decoder for a single dtype string. the choice between numpy, struct, serial and shared 
+#memory is made here once so encoding and decoding never have to try one and fall back to another. also returns the
+#numpy dtype of the payload, or None if the payload isn't a flat numpy buffer
+def compile_key_codec(dstring, segment_name=None):
+    if PCD.is_serial_dtype(dstring):
+        return (*PCD.get_serial_codec(dstring), None)
+    if PSHM.is_shm_dtype(dstring):
+        return (*PSHM.compile_shm_codec(dstring, segment_name), None)
+    try:
+        np_dtype = np.dtype(dstring)
+    except TypeError:
+        struct_format = get_analysis_tools().get_struct_format(dstring)
+        if struct_format is None:
+            raise ValueError(f"dtype {dstring} is not a valid type")
+        packer = struct.Struct(struct_format)
+        return packer.pack, lambda payload: np.array(packer.unpack(payload)), None
+    return (lambda data: np.asarray(data, dtype=np_dtype).tobytes(),
+            lambda payload: np.frombuffer(payload, dtype=np_dtype).copy(),
+            np_dtype)
+
+
+class CodecPlan():
+    '''
+    a stream dtype compiled into prebound encoders and decoders. a string dtype uses one codec for every key,
+    a dict dtype has one codec per key. encode and decode are straight line code with no try/except dispatch
+    '''
+    __slots__ = ("dtype", "encoders", "decoders", "np_dtypes", "default_encoder", "default_decoder", 
+                 "default_np_dtype")
+
+    def __init__(self, dtype, stream_name=None):
+        self.dtype = dtype
+        self.encoders = None
+        self.decoders = None
+        self.np_dtypes = None
+        self.default_encoder = None
+        self.default_decoder = None
+        self.default_np_dtype = None
+        if isinstance(dtype, dict):
+            self.encoders = {}
+            self.decoders = {}
+            self.np_dtypes = {}
+            for key, dstring in dtype.items():
+                encoder, decoder, np_dtype = compile_key_codec(dstring, PSHM.get_segment_name(stream_name, key))
+                self.encoders[key] = encoder
+                #decoders are looked up with the raw field name that comes back from redis
+                self.decoders[key.encode()] = (key, decoder)
+                self.np_dtypes[key.encode()] = np_dtype
+        else:
+            self.default_encoder, self.default_decoder, self.default_np_dtype = compile_key_codec(
+                dtype, PSHM.get_segment_name(stream_name, "data"))
+
+    #turns the data into the field dict that gets xadded
+    def encode(self, data):
+        if not isinstance(data, dict):
+            data = data.summarize() if is_armature(data) else {"data": data}
+        if self.encoders is None:
+            encoder = self.default_encoder
+            return {key: encoder(value) for key, value in data.items()}
+        encoders = self.encoders
+        return {key: encoders[key](value) for key, value in data.items()}
+
+    #looks up the decoder of a field that came back from redis. a field the dict dtype doesn't have is a WarningError
+    #naming the stream and the field instead of a bare KeyError
+    def get_decoder(self, key, stream_name=None):
+        try:
+            return self.decoders[key]
+        except KeyError:
+            raise WarningError(f"can not decode field {key.decode()} of {stream_name}. it isn't in the stream's dtype "
+                               f"{list(self.dtype)}") from None
+
+    #decodes a list of redis entries into (id, {key: value}) tuples
+    def decode(self, redis_entries, stream_name=None):
+        if self.decoders is None:
+            decoder = self.default_decoder
+            return [(entry_id, {key.decode(): decoder(value) for key, value in fields.items()})
+                    for entry_id, fields in redis_entries]
+        decoders = self.decoders
+        decoded_entries = []
+        for entry_id, fields in redis_entries:
+            decoded = {}
+            for key, value in fields.items():
+                name, decoder = decoders.get(key) or self.get_decoder(key, stream_name)
+                decoded[name] = decoder(value)
+            decoded_entries.append((entry_id, decoded))
+        return decoded_entries
+
+    #decodes a list of redis entries column by column. each numpy key becomes one (entries x elements) array made
+    #from a single frombuffer over the joined payloads, serial and struct keys become a list of decoded values.
+    #returns the int64 millisecond timestamps of the entries and the dict of columns
+    def decode_columnar(self, redis_entries, stream_name=None):
+        n_entries = len(redis_entries)
+        timestamps = np.fromiter((int(entry_id.split(b'-', 1)[0]) for entry_id, _ in redis_entries), 
+                                 dtype=np.int64, count=n_entries)
+        columns = {}
+        if n_entries == 0:
+            return timestamps, columns
+
+        for key in redis_entries[0][1]:
+            if self.decoders is None:
+                name, decoder, np_dtype = key.decode(), self.default_decoder, self.default_np_dtype
+            else:
+                name, decoder = self.get_decoder(key, stream_name)
+                np_dtype = self.np_dtypes[key]
+            payloads = [fields[key] for _, fields in redis_entries]
+
+            if np_dtype is None:
+                columns[name] = [decoder(payload) for payload in payloads]
+                continue
+            if n_entries == 1:
+                #a single payload can be viewed without copying
+                columns[name] = np.frombuffer(payloads[0], dtype=np_dtype).reshape(1, -1)
+                continue
+            if len(set(map(len, payloads))) != 1:
+                raise ValueError(f"can not decode {name} into columns because the entries have different lengths")
+            columns[name] = np.frombuffer(b"".join(payloads), dtype=np_dtype).reshape(n_entries, -1)
+        return timestamps, columns
+
+
+#plans are shared between every stream and call that uses the same dtype. shared memory plans write to a segment
+#named after the stream so those are kept per stream
+_codec_plans = {}
+
+def compile_codec_plan(dtype, stream_name=None) -> CodecPlan:
+    plan_key = dtype if isinstance(dtype, str) else json.dumps(dtype, sort_keys=True)
+    if "shm:" in plan_key:
+        plan_key = (plan_key, stream_name)
+    plan = _codec_plans.get(plan_key)
+    if plan is None:
+        plan = PPK.PackedCodecPlan(dtype) if PPK.is_packed_dtype(dtype) else CodecPlan(dtype, stream_name)
+        _codec_plans[plan_key] = plan
+    return plan
+
+
 
 '''
 data handling:
@@ -155,31 +1147,157 @@ float type: if the data is a float, then it is converted to a struct and sent to
 else: if the data is none of the above, then it is converted to a json and sent to the stream
 '''
 
-#auto decodes the content of your data and adds it to the redis stream. has special handling for armature structs
-def add_to_stream(redis_client, stream_name: str, data, dtype=None):
+#encodes the content of your data into the field dict that gets xadded. has special handling for armature structs.
+#returns None if there is no dtype to encode with or the data doesn't fit it
+def encode_entry(redis_client, stream_name: str, data, dtype=None):
     #check if the dtype can be gotten from the stream or is provided
-    if dtype is None:
+    try:
+        plan = get_codec_plan(redis_client, stream_name, dtype)
+    except Exception as e: 
+        print(f"could not get dtype from stream init and none provided. can not encode for {stream_name}. original error {e}")
+        return None
+
+    try:
+        return plan.encode(data)
+    except Exception as e:
+        print(f"could not serialize data for {stream_name}. original error: {e}")
+        return None
+
+#redis trims a stream by length or by id, not both. raises ValueError if both are set
+def check_trim(trim):
+    if trim.get("maxlen") is not None and trim.get("minid") is not None:
+        raise ValueError(f"a stream is trimmed with either maxlen or minid, not both. got {trim}")
+
+#turns a per stream trim setting ({"maxlen": n} or {"minid": id}, approximate unless told otherwise) into xadd kwargs
+def get_trim_args(trim):
+    if not trim:
+        return {}
+    check_trim(trim)
+    return {
+        "maxlen": trim.get("maxlen"),
+        "minid": trim.get("minid"),
+        "approximate": trim.get("approximate", True),
+    }
+
+#auto decodes the content of your data and adds it to the redis stream. has special handling for armature structs
+def add_to_stream(redis_client, stream_name: str, data, dtype=None, trim=None):
+    metrics = get_metrics(redis_client)
+    if metrics is not None:
+        start = time.perf_counter()
+    encoded_data_dict = encode_entry(redis_client, stream_name, data, dtype)
+    if encoded_data_dict is None:
+        return
+    if metrics is not None:
+        encoded = time.perf_counter()
+    redis_client.xadd(stream_name, encoded_data_dict, **get_trim_args(trim))
+    if metrics is not None:
+        #split what we spend encoding from the redis round trip
+        metrics.record("encode", encoded - start, stream_name)
+        metrics.record("xadd", time.perf_counter() - encoded, stream_name)
+
+
+#trim setting as raw XADD arguments, for the scripts that call XADD themselves
+def get_trim_tokens(trim):
+    if not trim:
+        return []
+    check_trim(trim)
+    approximate = '~' if trim.get("approximate", True) else '='
+    if trim.get("maxlen") is not None:
+        return ['MAXLEN', approximate, trim["maxlen"]]
+    if trim.get("minid") is not None:
+        return ['MINID', approximate, trim["minid"]]
+    return []
+
+#like add_to_stream, but redis only adds the entry if the stream's init dtype is still the one the data was encoded
+#with. if the stream was started over with another dtype in between, the data is encoded again with the new dtype and sent once more.
+#returns the id of the new entry
+def add_checked(redis_client, stream_name: str, data, trim=None):
+    metrics = get_metrics(redis_client)
+    if metrics is not None:
+        start = time.perf_counter()
+    cache = get_dtype_cache(redis_client)
+    scripts = get_stream_scripts(redis_client)
+    for _ in range(2):
+        version = cache.get_version(redis_client, stream_name)
+        fields = flatten_fields(cache.plans[stream_name].encode(data))
         try:
-            dtype = get_stream_dtype(redis_client, stream_name)
-        except Exception as e: 
-            print(f"could not get dtype from stream init and none provided. can not encode for {stream_name}. original error {e}")
+            entry_id = scripts.checked_xadd(keys=[stream_name, f"{stream_name}_init"],
+                                            args=[version, *get_trim_tokens(trim), '*', *fields])
+        except redis.ResponseError as e:
+            if not str(e).startswith("STALESCHEMA"):
+                raise
+            cache.invalidate(stream_name)
+            continue
+        if metrics is not None:
+            metrics.record("add_checked", time.perf_counter() - start, stream_name)
+        return entry_id
+    raise WarningError(f"could not add to {stream_name}. it was started over again while adding")
+
+
+class StreamBatch():
+    '''
+    collects entries for any number of streams and sends all the XADDs in one pipelined round trip instead of one 
+    per entry. use it as a context manager to send on exit or call execute() yourself. trim maps stream names to 
+    a trim setting (see get_trim_args). the encode and send times of the last execute are kept in timing
+    '''
+    def __init__(self, redis_client, trim=None):
+        self.redis_client = redis_client
+        self.trim = trim if trim is not None else {}
+        self.timing = None
+        self._pipe = redis_client.pipeline(transaction=False)
+        self._size = 0
+        self._encode_s = 0.0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, stream_name: str, data, dtype=None):
+        start = time.perf_counter()
+        encoded_data_dict = encode_entry(self.redis_client, stream_name, data, dtype)
+        self._encode_s += time.perf_counter() - start
+        if encoded_data_dict is None:
             return
+        self._pipe.xadd(stream_name, encoded_data_dict, **get_trim_args(self.trim.get(stream_name)))
+        self._size += 1
 
-    #see if the data is an armature struct or not a dict
-    if isinstance(data, ArmatureStruct):
-        data = data.summarize()
-    elif not isinstance(data, dict):
-        data = {"data": data}
-    
-    encoded_data_dict = {}
-    for key, value in data.items():
-        try:
-            # get dtype for each key if the keys are not uniform
-            key_dtype = dtype[key]
-            encoded_data_dict[key] = encode_from_dtype(value, key_dtype)
-        except (KeyError, TypeError):
-            encoded_data_dict[key] = encode_from_dtype(value, dtype)
-        except Exception as e:
-            print(f"could not serialize data. original error: {e}")
-    redis_client.xadd(stream_name, encoded_data_dict)
+    #queues a field dict that is already encoded, e.g. raw fields copied from another stream
+    def add_encoded(self, stream_name: str, fields):
+        self._pipe.xadd(stream_name, fields, **get_trim_args(self.trim.get(stream_name)))
+        self._size += 1
+
+    #sends everything queued so far and returns the new entry ids in the order they were added
+    def execute(self):
+        start = time.perf_counter()
+        entry_ids = self._pipe.execute() if self._size > 0 else []
+        send_s = time.perf_counter() - start
+        self.timing = {
+            "entries": self._size,
+            "encode_s": self._encode_s,
+            "send_s": send_s,
+            "total_s": self._encode_s + send_s,
+        }
+        self._size = 0
+        self._encode_s = 0.0
+        return entry_ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        #only send if the block finished. a half built batch is thrown away
+        if exc_type is None:
+            self.execute()
+        else:
+            self._pipe.reset()
+            self._size = 0
+            self._encode_s = 0.0
+        return False
 
+#adds a list of (stream_name, data) or (stream_name, data, dtype) entries in one round trip. returns the entry ids
+#and the timing of the batch
+def add_many(redis_client, entries, trim=None):
+    batch = StreamBatch(redis_client, trim)
+    for entry in entries:
+        batch.add(*entry)
+    entry_ids = batch.execute()
+    return entry_ids, batch.timing
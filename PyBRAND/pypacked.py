@@ -0,0 +1,162 @@
+import json
+import struct
+import zlib
+import numpy as np
+from . import pycodecs as PCD
+
+
+'''
+packed entry format for dict dtypes. instead of one redis field per key, a sample is a single binary field:
+
+    header      8 bytes: b"PK", format version, a zero byte, crc32 schema id of the dtype
+    fixed       every numeric key at a fixed offset, laid out as one numpy structured dtype
+    tail        only if there are serial keys: their uint32 byte lengths, then their encoded values, in dtype order
+
+redis only stores field names for an entry when they differ from the stream's master entry, so one field with the
+same name in every entry costs no name bytes, and the fixed keys of a whole read are decoded with one frombuffer.
+the size of every numeric key has to be known up front, so they take a shape: "float32[8]" or "int16[2,3]". a key
+without a shape is a single value. a stream is packed by init_stream(..., packed=True), which stores the dtype as
+"packed:" followed by the json of the dict
+'''
+
+PREFIX = "packed:"
+FIELD = "packed"
+RAW_FIELD = b"packed" # the field name as it comes back from redis
+MAGIC = b"PK"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBxI")
+
+
+def is_packed_dtype(dtype):
+    return isinstance(dtype, str) and dtype.startswith(PREFIX)
+
+
+#"float32[2,3]" -> (little endian numpy dtype, (2, 3)). single values are kept as one element arrays, the same as
+#they come back from an unpacked stream
+def parse_key_dtype(dstring):
+    base, bracket, shape = dstring.partition("[")
+    try:
+        np_dtype = np.dtype(base)
+        shape = tuple(int(n) for n in shape[:-1].split(",")) if bracket else (1,)
+    except (TypeError, ValueError):
+        raise ValueError(f"dtype {dstring} is not a valid packed type")
+    if np_dtype.kind not in "biufc" or (bracket and not dstring.endswith("]")) or min(shape) < 1:
+        raise ValueError(f"dtype {dstring} is not a valid packed type")
+    return np_dtype.newbyteorder('<'), shape
+
+
+#checks every key of a dict dtype can be packed and returns the packed dtype string
+def make_packed_dtype(dtype) -> str:
+    if not isinstance(dtype, dict) or len(dtype) == 0:
+        raise ValueError("packed streams need a dict dtype")
+    for dstring in dtype.values():
+        if PCD.is_serial_dtype(dstring):
+            PCD.get_serial_codec(dstring)
+        else:
+            parse_key_dtype(dstring)
+    return PREFIX + json.dumps(dtype)
+
+
+def parse_packed_dtype(dtype: str) -> dict:
+    return json.loads(dtype[len(PREFIX):])
+
+
+class PackedCodecPlan():
+    '''
+    codec plan of a packed dtype, with the same encode/decode/decode_columnar as CodecPlan. the header of every entry
+    is checked against the plan's schema id so entries written with another layout are never misread
+    '''
+    __slots__ = ("dtype", "schema_id", "header", "header_value", "fixed_keys", "serial_keys", "record_dtype",
+                 "fixed_size", "tail_lengths", "serial_codecs")
+
+    def __init__(self, dtype: str):
+        self.dtype = dtype
+        layout = parse_packed_dtype(dtype)
+        self.schema_id = zlib.crc32(dtype.encode())
+        self.header = HEADER.pack(MAGIC, FORMAT_VERSION, self.schema_id)
+        self.header_value = int.from_bytes(self.header, 'little')
+        self.fixed_keys = [key for key, dstring in layout.items() if not PCD.is_serial_dtype(dstring)]
+        self.serial_keys = [key for key, dstring in layout.items() if PCD.is_serial_dtype(dstring)]
+        self.serial_codecs = [PCD.get_serial_codec(layout[key]) for key in self.serial_keys]
+
+        formats = [parse_key_dtype(layout[key]) for key in self.fixed_keys]
+        offsets = []
+        self.fixed_size = HEADER.size
+        for np_dtype, shape in formats:
+            offsets.append(self.fixed_size)
+            self.fixed_size += np_dtype.itemsize * int(np.prod(shape))
+        self.record_dtype = np.dtype({"names": self.fixed_keys, "formats": formats, "offsets": offsets,
+                                      "itemsize": self.fixed_size})
+        self.tail_lengths = struct.Struct(f"<{len(self.serial_keys)}I")
+
+    #turns the data into the field dict that gets xadded
+    def encode(self, data):
+        if not isinstance(data, dict):
+            #packed data is always a dict, or an ArmatureStruct that summarizes into one
+            data = data.summarize()
+        payload = bytearray(self.fixed_size)
+        payload[:HEADER.size] = self.header
+        record = np.ndarray((), dtype=self.record_dtype, buffer=payload)
+        for key in self.fixed_keys:
+            record[key] = data[key]
+        #the payload can't grow while numpy still has a view of it
+        del record
+        if self.serial_keys:
+            serials = [encoder(data[key]) for key, (encoder, _) in zip(self.serial_keys, self.serial_codecs)]
+            serials = [value.encode() if isinstance(value, str) else value for value in serials]
+            payload += self.tail_lengths.pack(*map(len, serials))
+            payload += b"".join(serials)
+        return {FIELD: bytes(payload)}
+
+    def _decode_tail(self, payload):
+        lengths = self.tail_lengths.unpack_from(payload, self.fixed_size)
+        position = self.fixed_size + self.tail_lengths.size
+        values = {}
+        for key, (_, decoder), length in zip(self.serial_keys, self.serial_codecs, lengths):
+            values[key] = decoder(payload[position:position + length])
+            position += length
+        return values
+
+    #decodes a list of redis entries into (id, {key: value}) tuples
+    def decode(self, redis_entries, stream_name=None):
+        decoded_entries = []
+        for entry_id, fields in redis_entries:
+            payload = fields[RAW_FIELD]
+            if payload[:HEADER.size] != self.header:
+                raise ValueError(f"can not decode packed entries of {stream_name} written with a different dtype")
+            record = np.frombuffer(payload, dtype=self.record_dtype, count=1).copy()
+            decoded = {key: record[key][0] for key in self.fixed_keys}
+            if self.serial_keys:
+                decoded.update(self._decode_tail(payload))
+            decoded_entries.append((entry_id, decoded))
+        return decoded_entries
+
+    #decodes a list of redis entries into the int64 millisecond timestamps and one (entries x shape) array per
+    #numeric key, all from a single frombuffer. serial keys become a list of decoded values
+    def decode_columnar(self, redis_entries, stream_name=None):
+        n_entries = len(redis_entries)
+        timestamps = np.fromiter((int(entry_id.split(b'-', 1)[0]) for entry_id, _ in redis_entries),
+                                 dtype=np.int64, count=n_entries)
+        columns = {}
+        if n_entries == 0:
+            return timestamps, columns
+
+        payloads = [fields[RAW_FIELD] for _, fields in redis_entries]
+        if self.serial_keys:
+            fixed = b"".join(payload[:self.fixed_size] for payload in payloads)
+        else:
+            fixed = b"".join(payloads)
+        if len(fixed) != n_entries * self.fixed_size:
+            raise ValueError(f"can not decode packed entries of {stream_name} written with a different dtype")
+        #the header of every entry, read in place as one uint64 per record
+        headers = np.ndarray((n_entries,), dtype='<u8', buffer=fixed, strides=(self.fixed_size,))
+        if (headers != self.header_value).any():
+            raise ValueError(f"can not decode packed entries of {stream_name} written with a different dtype")
+        records = np.frombuffer(fixed, dtype=self.record_dtype)
+        for key in self.fixed_keys:
+            columns[key] = records[key]
+        if self.serial_keys:
+            tails = [self._decode_tail(payload) for payload in payloads]
+            for key in self.serial_keys:
+                columns[key] = [tail[key] for tail in tails]
+        return timestamps, columns
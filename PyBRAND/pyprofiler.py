@@ -0,0 +1,322 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+import redis
+from . import pynode_tools as PNT
+
+
+'''
+on demand profiling of a running node's work(). run() polls the node's {nickname}_control stream every
+control_interval_s (default 1.0) with one non blocking XREAD and a profile is started and stopped by entries on it:
+
+    command     start or stop
+    mode        cprofile (default) or sample
+    seconds     stop after this many seconds
+    ticks       stop after this many work() calls. with neither the profile runs until a stop command
+    interval_ms time between samples of the sample mode (default 1)
+    limit       how many functions are kept, the most expensive first (default 100)
+
+cprofile traces every call made inside work(), exact counts but slower while it runs. sample wakes up every
+interval_ms in a thread and records the stack of the node's thread if it is inside work(), so the node runs at
+close to full speed and the result is statistical. the sampler needs the GIL to look, so while work() runs pure
+python it gets a sample at most every sys.getswitchinterval() (5 ms by default) whatever interval_ms is. only
+work() is profiled, never the time the scheduler waits
+
+the result is written as json to the PROFILES hash of the persistent database (db1) under the node's nickname, the
+same way PARAMETERS is, and the start, end and any error of a profile are posted to the node's _state stream.
+fetch and render it (or start one) with:
+
+    python -m PyBRAND.pyprofiler -n decoder start --mode sample --seconds 10
+    python -m PyBRAND.pyprofiler -n decoder show --sort own --folded decoder.folded
+
+--sort is tottime, cumtime or ncalls for a cprofile profile and own or total for a sample profile. tottime and
+cumtime also sort a sample profile by own and total. --folded writes the sampled stacks in the folded format
+flamegraph.pl and speedscope read
+'''
+
+PROFILES = "PROFILES"
+MODES = ("cprofile", "sample")
+MAX_STACKS = 1000
+#the --sort names of each mode and the column of the profile they sort by. the column names work too
+SORT_KEYS = {
+    "cprofile": {"tottime": "tottime_s", "cumtime": "cumtime_s", "ncalls": "ncalls"},
+    "sample": {"own": "own_samples", "total": "samples", "tottime": "own_samples", "cumtime": "samples"},
+}
+
+
+#"file.py:line(function)" the way pstats names functions
+def function_name(filename, line, name):
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profiler, thread_id, interval_s):
+        super().__init__(daemon=True)
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        stop_at = Profiler.tick.__code__
+        while not self.stopped.wait(self.interval_s):
+            if not self.profiler.in_work:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            #walk out to the tick() that called work()
+            while frame is not None and frame.f_code is not stop_at:
+                code = frame.f_code
+                stack.append(function_name(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+
+class Profiler():
+    def __init__(self, name, redis_client, persistent_client, interval_s=1.0):
+        self.NAME = name
+        self.redis_client = redis_client
+        self.persistent_client = persistent_client
+        self.control_stream = f"{name}_control"
+        self.interval_s = interval_s
+        self.next_poll = time.monotonic() + interval_s
+        self.active = False
+        self.in_work = False
+        self.__capture = None
+        #places the control cursor at the head so commands sent before the node started are ignored. the control
+        #stream is read with plain xrevrange and xread, not read_new, so idle polls stay out of the node's metrics
+        last_entry = redis_client.xrevrange(self.control_stream, '+', '-', count=1)
+        self.__cursor = last_entry[0][0] if len(last_entry) != 0 else b'0-0'
+
+    def _post_state(self, status, **fields):
+        self.redis_client.xadd(f"{self.NAME}_state", {'code': 0, 'status': status, **fields})
+
+    #reads the control stream and acts on its commands. called from run() once next_poll has passed
+    def poll(self):
+        self.next_poll = time.monotonic() + self.interval_s
+        response = self.redis_client.xread({self.control_stream: self.__cursor})
+        entries = response[0][1] if response else []
+        if len(entries) != 0:
+            self.__cursor = entries[-1][0]
+        for _, fields in entries:
+            command = {key.decode(): value.decode() for key, value in fields.items()}
+            try:
+                if command.get("command") == "start":
+                    self.start(command.get("mode", "cprofile"), float(command.get("seconds", 0)) or None,
+                               int(command.get("ticks", 0)) or None, float(command.get("interval_ms", 1)),
+                               int(command.get("limit", 100)))
+                elif command.get("command") == "stop":
+                    self.stop()
+                else:
+                    raise ValueError(f"unknown control command {command.get('command')}")
+            except (ValueError, RuntimeError) as e:
+                print(f"[{self.NAME}] could not run control command {command}. original error: {e}")
+                self._post_state('profile_error', error=str(e))
+        if self.active and self.__capture["seconds"] is not None and \
+                time.perf_counter() - self.__capture["started"] >= self.__capture["seconds"]:
+            self.stop()
+
+    def start(self, mode="cprofile", seconds=None, ticks=None, interval_ms=1.0, limit=100):
+        """
+        starts profiling work() for seconds or ticks, whichever comes first, or until stop()
+        """
+        if self.active:
+            raise RuntimeError("a profile is already running")
+        if mode not in MODES:
+            raise ValueError(f"profile mode {mode} is not one of {MODES}")
+        capture = {"mode": mode, "seconds": seconds, "ticks": ticks, "limit": limit, "count": 0, "work_s": 0.0,
+                   "interval_ms": interval_ms, "time": time.time(), "started": time.perf_counter()}
+        if mode == "cprofile":
+            capture["profile"] = cProfile.Profile()
+        else:
+            capture["sampler"] = _Sampler(self, threading.get_ident(), interval_ms / 1000)
+            capture["sampler"].start()
+        self.__capture = capture
+        self.active = True
+        self._post_state('profile_started', mode=mode)
+
+    #calls work() inside the profile. only used while a profile is running
+    def tick(self, work):
+        capture = self.__capture
+        profile = capture.get("profile")
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+            try:
+                work()
+            finally:
+                profile.disable()
+        else:
+            self.in_work = True
+            try:
+                work()
+            finally:
+                self.in_work = False
+        end = time.perf_counter()
+        capture["work_s"] += end - start
+        capture["count"] += 1
+        if (capture["ticks"] is not None and capture["count"] >= capture["ticks"]) or \
+                (capture["seconds"] is not None and end - capture["started"] >= capture["seconds"]):
+            self.stop()
+
+    def stop(self):
+        """
+        ends the running profile, writes the result to PROFILES in db1 and returns it
+        """
+        if not self.active:
+            return None
+        capture = self.__capture
+        self.active = False
+        self.__capture = None
+        result = {
+            "mode": capture["mode"],
+            "time": capture["time"],
+            "duration_s": round(time.perf_counter() - capture["started"], 6),
+            "ticks": capture["count"],
+            "work_s": round(capture["work_s"], 6),
+        }
+        if capture["mode"] == "cprofile":
+            result.update(self._summarize_profile(capture["profile"], capture["limit"]))
+        else:
+            sampler = capture["sampler"]
+            sampler.stopped.set()
+            sampler.join()
+            result.update(self._summarize_samples(sampler, capture["interval_ms"], capture["limit"]))
+        self.persistent_client.hset(PROFILES, self.NAME, json.dumps(result))
+        self._post_state('profile_done', mode=capture["mode"], ticks=capture["count"])
+        return result
+
+    @staticmethod
+    def _summarize_profile(profile, limit):
+        stats = pstats.Stats(profile).stats
+        functions = [{"function": function_name(*key), "ncalls": ncalls, "primitive_calls": primitive_calls,
+                      "tottime_s": round(tottime, 9), "cumtime_s": round(cumtime, 9)}
+                     for key, (primitive_calls, ncalls, tottime, cumtime, _) in stats.items()]
+        functions.sort(key=lambda function: function["cumtime_s"], reverse=True)
+        return {"functions": functions[:limit]}
+
+    @staticmethod
+    def _summarize_samples(sampler, interval_ms, limit):
+        own = Counter()
+        total = Counter()
+        for stack, count in sampler.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            #a recursive function is counted once per sample
+            for frame in set(frames):
+                total[frame] += count
+        functions = [{"function": function, "samples": count, "own_samples": own[function]}
+                     for function, count in total.most_common()]
+        functions.sort(key=lambda function: (function["own_samples"], function["samples"]), reverse=True)
+        return {"interval_ms": interval_ms, "samples": sampler.samples, "functions": functions[:limit],
+                "stacks": dict(sampler.stacks.most_common(MAX_STACKS))}
+
+
+#gets the last profile of the node from db1, or None if it was never profiled
+def get_profile(persistent_client, name):
+    profile = persistent_client.hget(PROFILES, name)
+    return json.loads(profile) if profile is not None else None
+
+
+#the column of the profile that sort names. raises a ValueError naming the choices if the mode has no such column
+def get_sort_key(profile, sort):
+    keys = SORT_KEYS[profile["mode"]]
+    if sort in keys:
+        return keys[sort]
+    if sort in keys.values():
+        return sort
+    raise ValueError(f"can not sort a {profile['mode']} profile by {sort}. use one of {', '.join(keys)}")
+
+
+#the profile as a table, most expensive first by the sort column
+def render_profile(profile, sort=None, limit=30):
+    if sort is not None:
+        sort = get_sort_key(profile, sort)
+    header = (f"{profile['mode']} profile of {profile['ticks']} ticks over {profile['duration_s']:.3f} s, "
+              f"{profile['work_s']:.3f} s in work()")
+    if profile["mode"] == "cprofile":
+        functions = sorted(profile["functions"], key=lambda function: function[sort or "cumtime_s"], reverse=True)
+        lines = [header, f"{'ncalls':>12} {'tottime_s':>12} {'cumtime_s':>12}  function"]
+        for function in functions[:limit]:
+            ncalls = function["ncalls"] if function["ncalls"] == function["primitive_calls"] else \
+                f"{function['ncalls']}/{function['primitive_calls']}"
+            lines.append(f"{ncalls:>12} {function['tottime_s']:>12.6f} {function['cumtime_s']:>12.6f}  "
+                         f"{function['function']}")
+    else:
+        samples = max(profile["samples"], 1)
+        functions = sorted(profile["functions"], key=lambda function: function[sort or "own_samples"], reverse=True)
+        lines = [f"{header}, {profile['samples']} samples every {profile['interval_ms']} ms",
+                 f"{'own':>8} {'own %':>7} {'total':>8} {'total %':>7}  function"]
+        for function in functions[:limit]:
+            lines.append(f"{function['own_samples']:>8} {100 * function['own_samples'] / samples:>6.1f}% "
+                         f"{function['samples']:>8} {100 * function['samples'] / samples:>6.1f}%  "
+                         f"{function['function']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nickname', type=str, required=True, help="node to profile")
+    parser.add_argument('-i', '--host', type=str, default='localhost')
+    parser.add_argument('-p', '--port', type=str, default=6379)
+    parser.add_argument('-a', '--password', type=str, required=False)
+    parser.add_argument('-s', '--socket', type=str, required=False, help="unix socket path, used instead of host/port")
+    commands = parser.add_subparsers(dest='command', required=True)
+    start = commands.add_parser('start', help="start profiling the node's work()")
+    start.add_argument('--mode', choices=MODES, default='cprofile')
+    start.add_argument('--seconds', type=float, required=False)
+    start.add_argument('--ticks', type=int, required=False)
+    start.add_argument('--interval-ms', type=float, default=1.0, help="time between samples of the sample mode")
+    start.add_argument('--limit', type=int, default=100, help="functions kept in the result")
+    commands.add_parser('stop', help="stop the running profile and save it")
+    show = commands.add_parser('show', help="print the node's last profile")
+    show.add_argument('--sort', type=str, required=False,
+                      help="tottime, cumtime or ncalls for cprofile, own or total for sample")
+    show.add_argument('--limit', type=int, default=30)
+    show.add_argument('--folded', type=str, required=False, help="write the sampled stacks to this file")
+    show.add_argument('--json', action='store_true', help="print the profile as it is stored")
+    args = parser.parse_args()
+
+    pool = PNT.make_connection_pool(args.host, args.port, args.password, args.socket, db=0)
+    if args.command == 'start':
+        command = {"command": "start", "mode": args.mode, "interval_ms": args.interval_ms, "limit": args.limit}
+        if args.seconds is not None:
+            command["seconds"] = args.seconds
+        if args.ticks is not None:
+            command["ticks"] = args.ticks
+        redis.StrictRedis(connection_pool=pool).xadd(f"{args.nickname}_control", command)
+    elif args.command == 'stop':
+        redis.StrictRedis(connection_pool=pool).xadd(f"{args.nickname}_control", {"command": "stop"})
+    else:
+        profile = get_profile(redis.StrictRedis(connection_pool=PNT.make_sibling_pool(pool, db=1)), args.nickname)
+        if profile is None:
+            print(f"{args.nickname} has no profile")
+            sys.exit(1)
+        if args.json:
+            print(json.dumps(profile))
+        else:
+            try:
+                print(render_profile(profile, args.sort, args.limit))
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+        if args.folded is not None:
+            with open(args.folded, 'w') as f:
+                for stack, count in profile.get("stacks", {}).items():
+                    f.write(f"{stack} {count}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import time
+from .pynode import BRANDNode
+from . import pynode_tools as PNT
+from .pydataset import ColumnarWriter
+
+
+'''
+recorder node. follows a set of streams with paged XREADs, decodes every page with decode_columnar using the
+stream's _init dtype and appends it to a columnar dataset (see pydataset) that PyDerivative can open directly.
+once a batch is fsynced the recorder trims what it wrote from redis with XTRIM MINID, so db0 stays the same size
+however long the session runs. where it left off in each stream is saved in the dataset index together with the
+row count at that point, so a restarted recorder cuts off whatever it wrote after the last sync and carries on
+from there without recording anything twice
+
+a page of a stream that can't be recorded, e.g. entries of a numeric key with different lengths, is skipped and
+reported on the recorder's _state stream with status record_error. the other streams keep recording
+
+PARAMETERS:
+    streams             streams to record
+    path                dataset directory, made if it doesn't exist
+    page_size           max entries read per stream per XREAD (default 1000)
+    block_ms            how long to wait in XREAD for new entries (default 100)
+    fsync_interval_s    how often written data is made durable and trimmed (default 1.0)
+    trim                trim recorded entries from redis (default true)
+'''
+
+
+class BRANDRecorder(BRANDNode):
+    def __init__(self):
+        super().__init__()
+        self.streams = list(self.parameters['streams'])
+        self.page_size = self.parameters.get('page_size', 1000)
+        self.block_ms = self.parameters.get('block_ms', 100)
+        self.fsync_interval_s = self.parameters.get('fsync_interval_s', 1.0)
+        self.trim = self.parameters.get('trim', True)
+        self.writer = ColumnarWriter(self.parameters['path'])
+
+        #start where the last recording of this dataset stopped, or at the start of the stream. rows written after the
+        #last sync are read again, so they are cut off first
+        self.__cursors = {stream_name: self.writer.get_last_id(stream_name) or b'0-0' for stream_name in self.streams}
+        for stream_name in self.streams:
+            if stream_name in self.writer.index["streams"]:
+                self.writer.truncate(stream_name, self.writer.get_saved_rows(stream_name))
+        self.errors = {}
+        self.__written = {}
+        self.__last_sync = time.monotonic()
+
+    #streams are only added to the dataset once their dtype can be read, so an uninitialized stream is retried
+    def _add_stream(self, stream_name):
+        if stream_name in self.writer.index["streams"]:
+            return True
+        try:
+            self.writer.add_stream(stream_name, self.get_stream_dtype(stream_name))
+            return True
+        except IndexError:
+            return False
+
+    def work(self):
+        streams = [stream_name for stream_name in self.streams if self._add_stream(stream_name)]
+        if len(streams) > 0:
+            new_entries = PNT.read_new(self.realtime_database, streams, self.__cursors, self.block_ms, self.page_size)
+            for stream_name, entries in new_entries.items():
+                if len(entries) == 0:
+                    continue
+                try:
+                    timestamps, columns = self.decode_columnar(entries, stream_name)
+                    self.writer.append(stream_name, timestamps, columns)
+                except (ValueError, TypeError, PNT.WarningError) as e:
+                    self.report_error(stream_name, entries, e)
+                    continue
+                self.__written[stream_name] = entries[-1][0]
+        else:
+            time.sleep(self.block_ms / 1000)
+
+        if time.monotonic() - self.__last_sync >= self.fsync_interval_s:
+            self.sync()
+
+    def report_error(self, stream_name, entries, error):
+        """
+        counts and reports a page of entries that couldn't be recorded
+        """
+        self.errors[stream_name] = self.errors.get(stream_name, 0) + len(entries)
+        print(f"[{self.NAME}] could not record {len(entries)} entries of {stream_name} from {entries[0][0]} to "
+              f"{entries[-1][0]}. original error: {error}")
+        self.realtime_database.xadd(f"{self.NAME}_state", {'code': 0, 'status': 'record_error', 'stream': stream_name,
+                                                           'entries': len(entries), 'error': str(error)})
+
+    def sync(self):
+        """
+        makes everything written so far durable, saves the cursors and trims the recorded entries from redis
+        """
+        self.__last_sync = time.monotonic()
+        if len(self.__written) == 0:
+            return
+        self.writer.flush(fsync=True)
+        for stream_name, entry_id in self.__written.items():
+            self.writer.set_last_id(stream_name, entry_id, self.writer.count(stream_name))
+        self.writer.write_index()
+
+        if self.trim:
+            pipe = self.realtime_database.pipeline(transaction=False)
+            for stream_name, entry_id in self.__written.items():
+                #MINID keeps everything from the given id on, so trim up to just after the last written entry
+                milliseconds, _, sequence = entry_id.decode().partition('-')
+                pipe.xtrim(stream_name, minid=f"{milliseconds}-{int(sequence) + 1}", approximate=False)
+            pipe.execute()
+        self.__written = {}
+
+    def terminate(self, sig, frame):
+        self.sync()
+        self.writer.close()
+        super().terminate(sig, frame)
+
+
+if __name__ == "__main__":
+    recorder = BRANDRecorder()
+    recorder.run()
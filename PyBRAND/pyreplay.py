@@ -0,0 +1,234 @@
+import argparse
+import heapq
+import json
+import time
+from operator import itemgetter
+import redis
+from . import pynode_tools as PNT
+from .pydataset import ColumnarDataset
+from .pymetrics import Histogram
+
+
+'''
+replays a recorded session into redis so a node or a whole graph can be run under the load of a real session
+without the rig. each stream is started again with its recorded _init dtype and its entries are published in
+timestamp order, merged over every stream, with pipelined XADDs (one StreamBatch per send)
+
+sources:
+    redis       streams of a redis database, e.g. a saved session loaded into another db. the raw fields are copied
+                as they are, nothing is decoded. the end of every stream is fixed when the replay starts, so
+                replaying into the database that is being read doesn't replay its own entries again
+    dataset     a columnar dataset written by the recorder (see pydataset). rows are encoded again with the
+                stream's dtype
+
+with a speed the original inter-arrival times are kept, divided by the speed (2.0 is twice as fast). entries are
+due at start + (timestamp - first timestamp) / speed and the lag is how long after that they were actually sent.
+entries that are due together, or that are already late, go out in one pipeline. speed 0 sends everything as fast
+as possible in batches of batch_size and the achieved speed is reported instead
+
+run with: python -m PyBRAND.pyreplay -i localhost -p 6379 -d session/ --speed 1.0 --prefix replay_
+'''
+
+
+class RedisSource():
+    encoded = True
+
+    def __init__(self, redis_client, streams=None, start_ms=None, end_ms=None, page_size=1000):
+        self.redis_client = redis_client
+        self.streams = list(streams) if streams else self.find_streams(redis_client)
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.page_size = page_size
+
+    #every stream that has an init entry
+    @staticmethod
+    def find_streams(redis_client):
+        streams = [key.decode()[:-len("_init")] for key in redis_client.scan_iter(match="*_init", _type="stream")]
+        return sorted(stream_name for stream_name in streams if redis_client.exists(stream_name))
+
+    def get_dtype(self, stream_name):
+        return PNT.get_stream_dtype(self.redis_client, stream_name)
+
+    #yields (millisecond timestamp, raw fields) of the stream in paged XRANGEs
+    def iter_entries(self, stream_name):
+        last_entry = self.redis_client.xrevrange(stream_name, '+', '-', count=1)
+        if len(last_entry) == 0:
+            return
+        end = last_entry[0][0] if self.end_ms is None else str(self.end_ms)
+        cursor = '-' if self.start_ms is None else f"{self.start_ms}-0"
+        while True:
+            entries = self.redis_client.xrange(stream_name, cursor, end, count=self.page_size)
+            for entry_id, fields in entries:
+                yield int(entry_id.split(b'-', 1)[0]), fields
+            if len(entries) < self.page_size:
+                return
+            milliseconds, _, sequence = entries[-1][0].decode().partition('-')
+            cursor = f"{milliseconds}-{int(sequence) + 1}"
+
+
+class DatasetSource():
+    encoded = False
+
+    def __init__(self, dataset, streams=None, start_ms=None, end_ms=None, chunk_size=1000):
+        self.dataset = dataset if isinstance(dataset, ColumnarDataset) else ColumnarDataset(dataset)
+        self.streams = list(streams) if streams else self.dataset.streams
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.chunk_size = chunk_size
+
+    def get_dtype(self, stream_name):
+        return self.dataset.get_dtype(stream_name)
+
+    #yields (millisecond timestamp, {key: value}) of the stream one chunk of rows at a time
+    def iter_entries(self, stream_name):
+        for timestamps, columns in self.dataset.iter_chunks(stream_name, self.chunk_size, self.start_ms, self.end_ms):
+            keys = list(columns)
+            for row, timestamp in enumerate(timestamps.tolist()):
+                yield timestamp, {key: columns[key][row] for key in keys}
+
+
+class Replay():
+    def __init__(self, redis_client, source, speed=1.0, prefix="", batch_size=500, trim=None):
+        if speed < 0:
+            raise ValueError(f"speed can't be negative, not {speed}")
+        self.redis_client = redis_client
+        self.source = source
+        self.speed = speed
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.trim = {prefix + stream_name: trim for stream_name in source.streams} if trim else None
+        self.lag = Histogram()
+        self.report = None
+        self.__due = []
+        self.__send_s = 0.0
+        self.__batches = 0
+
+    #starts every replayed stream with its recorded dtype
+    def init_streams(self):
+        for stream_name in self.source.streams:
+            PNT.init_stream(self.redis_client, self.prefix + stream_name, self.source.get_dtype(stream_name))
+
+    def _tagged(self, stream_name):
+        for timestamp, data in self.source.iter_entries(stream_name):
+            yield timestamp, stream_name, data
+
+    #every stream's entries in one timestamp order
+    def entries(self):
+        return heapq.merge(*(self._tagged(stream_name) for stream_name in self.source.streams), key=itemgetter(0))
+
+    def _send(self, batch):
+        if len(batch) == 0:
+            return
+        batch.execute()
+        sent = time.perf_counter()
+        self.__send_s += batch.timing["send_s"]
+        self.__batches += 1
+        if self.speed:
+            for due in self.__due:
+                self.lag.record((sent - due) * 1e6)
+        self.__due = []
+
+    def run(self):
+        """
+        replays the whole source and returns the report
+        """
+        self.init_streams()
+        batch = PNT.StreamBatch(self.redis_client, self.trim)
+        add = batch.add_encoded if self.source.encoded else batch.add
+        counts = {stream_name: 0 for stream_name in self.source.streams}
+        failed = 0
+        first_ms = last_ms = None
+
+        #the entry after the one being waited for is always already fetched, so a slow page or chunk read of the
+        #source happens during the wait instead of holding back a send
+        entries = self.entries()
+        entry = next(entries, None)
+        following = next(entries, None)
+        start = time.perf_counter()
+        def get_due(timestamp):
+            return start + (timestamp - first_ms) / 1000 / self.speed
+
+        while entry is not None:
+            timestamp, stream_name, data = entry
+            if first_ms is None:
+                first_ms = timestamp
+            last_ms = timestamp
+            if self.speed:
+                due = get_due(timestamp)
+                remaining = due - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.__due.append(due)
+
+            size = len(batch)
+            add(self.prefix + stream_name, data)
+            if len(batch) == size:
+                #encode_entry already said why
+                failed += 1
+                if self.speed:
+                    self.__due.pop()
+            else:
+                counts[stream_name] += 1
+            #entries due together, or already late, share a pipeline. anything else goes out before the next wait
+            if len(batch) >= self.batch_size or \
+                    (self.speed and (following is None or get_due(following[0]) > time.perf_counter())):
+                self._send(batch)
+            entry, following = following, next(entries, None)
+        self._send(batch)
+        duration_s = time.perf_counter() - start
+
+        entries = sum(counts.values())
+        recorded_s = (last_ms - first_ms) / 1000 if first_ms is not None else 0.0
+        self.report = {
+            "entries": entries,
+            "streams": counts,
+            "failed": failed,
+            "batches": self.__batches,
+            "duration_s": round(duration_s, 6),
+            "send_s": round(self.__send_s, 6),
+            "rate_hz": round(entries / duration_s, 2) if duration_s > 0 else None,
+            "recorded_s": recorded_s,
+            "speed": self.speed or None,
+            "achieved_speed": round(recorded_s / duration_s, 3) if duration_s > 0 else None,
+            "lag_us": self.lag.summary() if self.speed else None,
+        }
+        return self.report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--host', type=str, default='localhost', help="redis to replay into")
+    parser.add_argument('-p', '--port', type=str, default=6379)
+    parser.add_argument('-a', '--password', type=str, required=False)
+    parser.add_argument('-s', '--socket', type=str, required=False, help="unix socket path, used instead of host/port")
+    parser.add_argument('-d', '--dataset', type=str, required=False, help="columnar dataset to replay")
+    parser.add_argument('--source-host', type=str, required=False, help="redis to replay from, default the target")
+    parser.add_argument('--source-port', type=str, required=False)
+    parser.add_argument('--source-password', type=str, required=False)
+    parser.add_argument('--source-db', type=int, default=0)
+    parser.add_argument('--streams', type=str, nargs='*', default=None, help="default every recorded stream")
+    parser.add_argument('--speed', type=float, default=1.0, help="playback speed, 0 for as fast as possible")
+    parser.add_argument('--prefix', type=str, default="", help="put in front of every replayed stream name")
+    parser.add_argument('--start-ms', type=int, required=False)
+    parser.add_argument('--end-ms', type=int, required=False)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    redis_client = redis.StrictRedis(
+        connection_pool=PNT.make_connection_pool(args.host, args.port, args.password, args.socket, db=0))
+    if args.dataset is not None:
+        source = DatasetSource(args.dataset, args.streams, args.start_ms, args.end_ms)
+    else:
+        if args.source_host is None:
+            source_pool = PNT.make_sibling_pool(redis_client.connection_pool, db=args.source_db)
+        else:
+            source_pool = PNT.make_connection_pool(args.source_host, args.source_port or 6379, args.source_password,
+                                                   db=args.source_db)
+        source = RedisSource(redis.StrictRedis(connection_pool=source_pool), args.streams, args.start_ms, args.end_ms)
+
+    replay = Replay(redis_client, source, args.speed, args.prefix, args.batch_size)
+    print(json.dumps(replay.run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import time
+from .pymetrics import Histogram
+
+
+'''
+loop schedulers for BRANDNode.run(). run() waits on the scheduler before every work() call, and the "scheduler"
+parameter picks which one:
+
+    free        (default) work() back to back, the way run() always did
+    fixed_rate  work() at rate_hz on absolute deadlines. tick k is due at start + k / rate_hz, so a late tick never
+                pushes the ones after it back and there is no drift. the wait sleeps, or with spin_us set sleeps
+                until spin_us before the deadline and spins the rest on the clock, for sub millisecond precision at
+                the cost of that much cpu per tick. when work() runs past a deadline the tick is an overrun and
+                any ticks missed completely are skipped instead of being run back to back to catch up
+    event       blocks in one XREAD on event_streams (up to event_block_ms at a time) and only calls work() once
+                one of them has new entries. the entries are on node.events, {stream: [entries]}
+
+PARAMETERS:
+    scheduler       free, fixed_rate or event
+    rate_hz         ticks per second for fixed_rate
+    spin_us         how long before each deadline fixed_rate stops sleeping and spins (default 0, never spin)
+    event_streams   streams that wake the event scheduler
+    event_block_ms  longest single XREAD of the event scheduler (default 1000)
+
+every scheduler counts its ticks, and fixed_rate its overruns, skipped ticks and a histogram of how late each tick
+woke up (the jitter). with metrics on the jitter also goes to the node's metrics stream as tick_jitter
+'''
+
+
+class Scheduler():
+    mode = "free"
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = Histogram()
+
+    #returns when the next work() is due
+    def wait(self):
+        self.ticks += 1
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_us": self.jitter.summary(),
+        }
+
+
+class FixedRateScheduler(Scheduler):
+    mode = "fixed_rate"
+
+    def __init__(self, rate_hz, spin_us=0, metrics=None):
+        super().__init__(metrics)
+        if rate_hz <= 0:
+            raise ValueError(f"rate_hz has to be positive, not {rate_hz}")
+        self.period = 1.0 / rate_hz
+        self.spin_s = spin_us / 1e6
+        self.__deadline = None
+
+    def wait(self):
+        now = time.perf_counter()
+        if self.__deadline is None:
+            #the first tick is right away and sets the grid every later deadline is on
+            self.__deadline = now
+        elif now > self.__deadline:
+            #work() ran past this tick's deadline. it still runs now, late, but the ticks that were missed
+            #completely are dropped
+            self.overruns += 1
+            missed = int((now - self.__deadline) / self.period)
+            self.skipped += missed
+            self.__deadline += missed * self.period
+        else:
+            remaining = self.__deadline - now
+            if remaining > self.spin_s:
+                time.sleep(remaining - self.spin_s)
+            while time.perf_counter() < self.__deadline:
+                pass
+
+        late_s = time.perf_counter() - self.__deadline
+        self.jitter.record(late_s * 1e6)
+        if self.metrics is not None:
+            self.metrics.record("tick_jitter", late_s)
+        self.__deadline += self.period
+        self.ticks += 1
+
+
+class EventScheduler(Scheduler):
+    mode = "event"
+
+    def __init__(self, node, streams, block_ms=1000, metrics=None):
+        super().__init__(metrics)
+        if len(streams) == 0:
+            raise ValueError("the event scheduler needs at least one stream in event_streams")
+        self.node = node
+        self.streams = list(streams)
+        self.block_ms = block_ms
+
+    def wait(self):
+        while True:
+            events = self.node.read_new(self.streams, block_ms=self.block_ms)
+            if any(len(entries) > 0 for entries in events.values()):
+                self.node.events = events
+                self.ticks += 1
+                return
+
+
+#makes the scheduler the node's parameters ask for
+def make_scheduler(node, parameters, metrics=None):
+    mode = parameters.get('scheduler', 'free')
+    if mode == "free":
+        return Scheduler(metrics)
+    if mode == "fixed_rate":
+        return FixedRateScheduler(parameters['rate_hz'], parameters.get('spin_us', 0), metrics)
+    if mode == "event":
+        return EventScheduler(node, parameters['event_streams'], parameters.get('event_block_ms', 1000), metrics)
+    raise ValueError(f"scheduler {mode} is not one of free, fixed_rate or event")
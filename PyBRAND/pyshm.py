@@ -0,0 +1,184 @@
+import atexit
+import json
+import re
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+'''
+shared memory side channel for large arrays between nodes on the same machine. a stream initialized with a dtype
+of "shm:<dtype>" (or "shm:<dtype>:<slots>") writes each array into a ring of slots in a shared memory segment and
+only XADDs a small descriptor (segment, slot, offset, shape, dtype, generation). the reader attaches the segment once
+and decodes the descriptor into a numpy view of the slot with no copy.
+
+segment layout: a 64 byte segment header (n_slots, slot_bytes), a table of one uint64 generation per slot, then the
+slots themselves, every part aligned to 64 bytes. the writer zeroes a slot's generation while copying into it and
+sets the new generation after, so a reader can tell a slot was overwritten (or is being written) by comparing the
+generation in the table with the one in the descriptor. descriptors only make sense on the machine that wrote them
+'''
+
+DEFAULT_SLOTS = 64
+ALIGNMENT = 64
+
+
+def _align(n_bytes):
+    return (n_bytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+#segment names end up as file names under /dev/shm so keep them plain
+def get_segment_name(stream_name, key):
+    return re.sub(r'[^A-Za-z0-9_]', '_', f"pybrand_{stream_name}_{key}")
+
+
+#splits "shm:<dtype>[:<slots>]" into the payload dtype string and the slot count
+def parse_shm_dtype(dstring):
+    parts = dstring.split(":")
+    if len(parts) not in (2, 3) or parts[0] != "shm":
+        raise ValueError(f"dtype {dstring} is not a valid shm type")
+    n_slots = int(parts[2]) if len(parts) == 3 else DEFAULT_SLOTS
+    return parts[1], n_slots
+
+
+def is_shm_dtype(dstring):
+    return isinstance(dstring, str) and dstring.startswith("shm:")
+
+
+#attaching a segment made by another process. before python 3.13 the resource tracker of an attaching process
+#unlinks the segment when it exits, which would pull it out from under the writer
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class ShmRing():
+    def __init__(self, segment, n_slots, slot_bytes):
+        self.segment = segment
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        self.generations = np.ndarray((n_slots,), dtype=np.uint64, buffer=segment.buf, offset=ALIGNMENT)
+        self.data_offset = ALIGNMENT + _align(8 * n_slots)
+        self.generation = int(self.generations.max()) if n_slots > 0 else 0
+        self.stale_reads = 0
+
+    @classmethod
+    def create(cls, name, n_slots, slot_bytes):
+        slot_bytes = _align(slot_bytes)
+        size = ALIGNMENT + _align(8 * n_slots) + n_slots * slot_bytes
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            #left over from an earlier run. reuse it if the layout still fits so attached readers keep working
+            segment = _attach(name)
+            layout = np.ndarray((2,), dtype=np.uint64, buffer=segment.buf)
+            if segment.size < size or int(layout[0]) != n_slots or int(layout[1]) != slot_bytes:
+                segment.close()
+                segment.unlink()
+                segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        np.ndarray((2,), dtype=np.uint64, buffer=segment.buf)[:] = (n_slots, slot_bytes)
+        return cls(segment, n_slots, slot_bytes)
+
+    @classmethod
+    def attach(cls, name):
+        segment = _attach(name)
+        n_slots, slot_bytes = (int(value) for value in np.ndarray((2,), dtype=np.uint64, buffer=segment.buf))
+        return cls(segment, n_slots, slot_bytes)
+
+    #copies the array into the next slot and returns its descriptor
+    def write(self, array):
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.slot_bytes:
+            raise ValueError(f"{array.nbytes} byte array does not fit the {self.slot_bytes} byte slots of "
+                             f"{self.segment.name}")
+        self.generation += 1
+        slot = self.generation % self.n_slots
+        offset = self.data_offset + slot * self.slot_bytes
+        self.generations[slot] = 0
+        np.ndarray(array.shape, dtype=array.dtype, buffer=self.segment.buf, offset=offset)[...] = array
+        self.generations[slot] = self.generation
+        return {
+            "seg": self.segment.name,
+            "slot": slot,
+            "off": offset,
+            "shape": array.shape,
+            "dtype": array.dtype.str,
+            "gen": self.generation,
+        }
+
+    def is_valid(self, descriptor):
+        return int(self.generations[descriptor["slot"]]) == descriptor["gen"]
+
+    #zero copy view of the slot, or None if the slot was overwritten since the descriptor was made
+    def read(self, descriptor):
+        if not self.is_valid(descriptor):
+            self.stale_reads += 1
+            return None
+        return np.ndarray(descriptor["shape"], dtype=np.dtype(descriptor["dtype"]), buffer=self.segment.buf,
+                          offset=descriptor["off"])
+
+
+# rings this process writes to and reads from, by segment name
+_writers = {}
+_readers = {}
+
+
+def get_writer(name, n_slots, slot_bytes):
+    ring = _writers.get(name)
+    if ring is None:
+        ring = ShmRing.create(name, n_slots, slot_bytes)
+        _writers[name] = ring
+    return ring
+
+
+def get_reader(name):
+    ring = _readers.get(name)
+    if ring is None:
+        ring = _writers.get(name) or ShmRing.attach(name)
+        _readers[name] = ring
+    return ring
+
+
+#builds the encoder and decoder of a shm key. the ring is only made on the first write since the slot size is the
+#size of the first array
+def compile_shm_codec(dstring, segment_name):
+    payload_dtype, n_slots = parse_shm_dtype(dstring)
+    np_dtype = np.dtype(payload_dtype)
+
+    def encode(data):
+        array = np.asarray(data, dtype=np_dtype)
+        ring = get_writer(segment_name, n_slots, array.nbytes)
+        return json.dumps(ring.write(array))
+
+    def decode(payload):
+        descriptor = json.loads(payload)
+        return get_reader(descriptor["seg"]).read(descriptor)
+
+    return encode, decode
+
+
+#checks that a view returned by decode hasn't been overwritten while it was being used
+def is_payload_valid(payload):
+    descriptor = json.loads(payload)
+    return get_reader(descriptor["seg"]).is_valid(descriptor)
+
+
+@atexit.register
+def _close_rings():
+    for ring in _readers.values():
+        if ring.segment.name not in _writers:
+            ring.generations = None
+            try:
+                ring.segment.close()
+            except BufferError:
+                #a decoded view is still alive. the mapping goes away with the process
+                pass
+    for ring in _writers.values():
+        ring.generations = None
+        try:
+            ring.segment.unlink()
+            ring.segment.close()
+        except (BufferError, FileNotFoundError):
+            pass
@@ -0,0 +1,160 @@
+import multiprocessing
+import sys
+import time
+import json
+import traceback
+import redis
+from . import pynode_tools as PNT
+
+
+'''
+runs one node nickname as N worker processes so heavy nodes can use more than one core. the workers share the input
+streams through a redis consumer group named after the node, so every input entry is processed by exactly one
+worker. workers put their results on a staging stream and the parent process puts them back in input order before
+publishing them to the output stream. stale entries of a dead worker are claimed by the others
+
+the parent only releases a result once nothing with a smaller input id can still show up. for that it takes one
+atomic snapshot of the group (last delivered id and smallest pending id) BEFORE reading the staging stream. workers
+stage a result and ack its input in one transaction, so anything not pending at snapshot time is already staged
+'''
+
+# fields the workers add to a staged result so the parent can put it back in order
+SOURCE_FIELD = b'_stream'
+SEQUENCE_FIELD = b'_seq'
+
+
+#redis ids compare as (milliseconds, sequence) pairs, not as strings
+def parse_id(entry_id):
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    milliseconds, _, sequence = entry_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+class WorkerPool():
+    def __init__(self, node, n_workers, input_streams, output_stream, block_ms=100, count=10, claim_idle_ms=5000,
+                 stats_interval_s=1.0):
+        self.node = node
+        self.n_workers = n_workers
+        self.input_streams = list(input_streams)
+        self.output_stream = output_stream
+        self.staging_stream = f"{output_stream}_staging"
+        self.group = node.NAME
+        self.block_ms = block_ms
+        self.count = count
+        self.claim_idle_ms = claim_idle_ms
+        self.stats_interval_s = stats_interval_s
+        self.stats = {}
+        self.processes = []
+        self.__staged = {stream_name: {} for stream_name in self.input_streams}
+        #start from the beginning so results staged before a restart are still released
+        self.__staging_cursor = {self.staging_stream: b'0-0'}
+
+    def run(self):
+        r = self.node.realtime_database
+        for stream_name in self.input_streams:
+            PNT.create_group(r, stream_name, self.group)
+
+        #fork so the workers start with the node exactly as it was built
+        context = multiprocessing.get_context("fork")
+        self.processes = [context.Process(target=self._worker_main, args=(i,), name=f"{self.group}-{i}", daemon=True)
+                          for i in range(self.n_workers)]
+        for process in self.processes:
+            process.start()
+
+        try:
+            last_stats = 0.0
+            while True:
+                self._check_workers()
+                self._release(r)
+                if time.monotonic() - last_stats > self.stats_interval_s:
+                    self._report(r)
+                    last_stats = time.monotonic()
+        finally:
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+
+    #a dead worker means lost capacity and a bug in process(). fail the same way a single process node would
+    def _check_workers(self):
+        for process in self.processes:
+            if process.exitcode is not None:
+                raise RuntimeError(f"worker {process.name} exited with code {process.exitcode}")
+
+    #publishes every staged result that can no longer be overtaken, in input order
+    def _release(self, r):
+        snapshot = r.pipeline(transaction=True)
+        for stream_name in self.input_streams:
+            snapshot.xinfo_groups(stream_name)
+            snapshot.xpending(stream_name, self.group)
+        replies = snapshot.execute()
+
+        staged = PNT.read_new(r, self.staging_stream, self.__staging_cursor, self.block_ms)[self.staging_stream]
+        for staged_id, fields in staged:
+            stream_name = fields[SOURCE_FIELD].decode()
+            self.__staged[stream_name][parse_id(fields[SEQUENCE_FIELD])] = (staged_id, fields)
+
+        pipe = r.pipeline(transaction=False)
+        released_ids = []
+        for i, stream_name in enumerate(self.input_streams):
+            group_info = next(info for info in replies[2 * i] if info["name"].decode() == self.group)
+            last_delivered = parse_id(group_info["last-delivered-id"])
+            pending = replies[2 * i + 1]
+            oldest_pending = parse_id(pending["min"]) if pending["pending"] > 0 else None
+
+            buffered = self.__staged[stream_name]
+            ready = [sequence for sequence in buffered 
+                     if sequence <= last_delivered and (oldest_pending is None or sequence < oldest_pending)]
+            for sequence in sorted(ready):
+                staged_id, fields = buffered.pop(sequence)
+                pipe.xadd(self.output_stream, {key: value for key, value in fields.items()
+                                               if key not in (SOURCE_FIELD, SEQUENCE_FIELD)})
+                released_ids.append(staged_id)
+        if len(released_ids) > 0:
+            pipe.xdel(self.staging_stream, *released_ids)
+            pipe.execute()
+
+    #per worker pending counts and idle time plus the lag and pending count of each input stream
+    def _report(self, r):
+        self.stats = {stream_name: PNT.get_group_stats(r, stream_name, self.group) for stream_name in self.input_streams}
+        for stream_name, stats in self.stats.items():
+            stats["staged"] = len(self.__staged[stream_name])
+        r.xadd(f"{self.group}_workers", {"stats": json.dumps(self.stats)})
+
+    def _worker_main(self, index):
+        consumer = f"{self.group}-{index}"
+        node = self.node
+        #fresh client so the worker doesn't share sockets (or the dtype cache's subscription) with the parent
+        r = redis.StrictRedis(connection_pool=PNT.make_sibling_pool(node.realtime_database.connection_pool))
+        node.realtime_database = r
+        try:
+            last_claim = time.monotonic()
+            while True:
+                new_entries = PNT.read_group(r, self.group, consumer, self.input_streams, self.block_ms, self.count)
+                if time.monotonic() - last_claim > self.claim_idle_ms / 1000:
+                    for stream_name in self.input_streams:
+                        new_entries[stream_name] = PNT.claim_stale(r, stream_name, self.group, consumer,
+                                                                   self.claim_idle_ms) + new_entries[stream_name]
+                    last_claim = time.monotonic()
+                for stream_name, entries in new_entries.items():
+                    for entry in entries:
+                        self._process(r, node, consumer, stream_name, entry)
+        except Exception:
+            error = traceback.format_exc()
+            print(f"Uncaught error occured in worker {consumer}. Error: {error}")
+            r.xadd("error_stream", {consumer: error})
+            sys.exit(1)
+
+    #stages the result and acks the input in one transaction so the parent never sees one without the other
+    def _process(self, r, node, consumer, stream_name, entry):
+        result = node.process(stream_name, entry)
+        pipe = r.pipeline(transaction=True)
+        if result is not None:
+            encoded = PNT.encode_entry(r, self.output_stream, result)
+            if encoded is None:
+                raise ValueError(f"could not encode the result of {stream_name} entry {entry[0]} for {self.output_stream}")
+            encoded[SOURCE_FIELD] = stream_name
+            encoded[SEQUENCE_FIELD] = entry[0]
+            pipe.xadd(self.staging_stream, encoded)
+        pipe.xack(stream_name, self.group, entry[0])
+        pipe.execute()
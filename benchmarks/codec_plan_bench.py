@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+import timeit
+import numpy as np
+from PyBRAND import pynode_tools as PNT
+
+'''
+microbenchmark of the per sample encode cost before and after codec plans.
+"before" is the old path, encode_from_dtype called for every key with try/except dispatch on the dtype.
+"after" is CodecPlan.encode with the codecs bound once. no redis needed
+
+run with: python benchmarks/codec_plan_bench.py
+'''
+
+CASES = {
+    "int8 scalar": ("int8", 15),
+    "float32 x96": ("float32", np.random.rand(96).astype(np.float32)),
+    "dict int8/int16/serial": ({"a": "int8", "b": "int16", "c": "serial"},
+                               {"a": [12, 32, 12, 1, 0], "b": [10, 2, 421, 2], "c": {"x": 1, "y": 2}}),
+}
+
+
+#the encode loop add_to_stream ran before codec plans
+def encode_before(data, dtype):
+    if not isinstance(data, dict):
+        data = {"data": data}
+    encoded_data_dict = {}
+    for key, value in data.items():
+        try:
+            encoded_data_dict[key] = PNT.encode_from_dtype(value, dtype[key])
+        except (KeyError, TypeError):
+            encoded_data_dict[key] = PNT.encode_from_dtype(value, dtype)
+    return encoded_data_dict
+
+
+def bench(number=100000):
+    results = {}
+    for name, (dtype, data) in CASES.items():
+        plan = PNT.compile_codec_plan(dtype)
+        assert encode_before(data, dtype) == plan.encode(data)
+        before = min(timeit.repeat(lambda: encode_before(data, dtype), number=number, repeat=3)) / number
+        after = min(timeit.repeat(lambda: plan.encode(data), number=number, repeat=3)) / number
+        results[name] = {"before_us": before * 1e6, "after_us": after * 1e6, "speedup": before / after}
+        print(f"{name:>24}: before {before * 1e6:7.2f} us  after {after * 1e6:7.2f} us  ({before / after:.1f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import argparse
+import json
+import sys
+
+'''
+compares two result files of run_benchmarks.py. a case regresses when its p50 latency grew by more than the
+threshold (10% by default). exits with 1 if anything regressed so it can gate a build
+
+run with: python benchmarks/compare.py old.json new.json
+'''
+
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data["meta"], {(row["operation"], row["dtype"], row["payload_bytes"]): row for row in data["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline', type=str)
+    parser.add_argument('candidate', type=str)
+    parser.add_argument('-t', '--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    baseline_meta, baseline = load(args.baseline)
+    candidate_meta, candidate = load(args.candidate)
+    if baseline_meta["backend"] != candidate_meta["backend"]:
+        print(f"warning: comparing a {baseline_meta['backend']} run with a {candidate_meta['backend']} run")
+
+    regressions = 0
+    for case in sorted(baseline.keys() & candidate.keys(), key=str):
+        old, new = baseline[case]["p50_us"], candidate[case]["p50_us"]
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{case[0]:>18} {case[1]:>8} {case[2]:>8} B: p50 {old:>9} -> {new:>9} us ({change:+.1%}){flag}")
+    for case in sorted(baseline.keys() ^ candidate.keys(), key=str):
+        print(f"only in one run: {case}")
+
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
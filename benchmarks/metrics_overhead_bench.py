@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+import timeit
+import numpy as np
+from PyBRAND import pynode_tools as PNT
+from PyBRAND.pymetrics import NodeMetrics
+
+'''
+overhead of the hot path instrumentation. times decode of one small entry with metrics off, with metrics on for a
+different connection (the registry isn't empty) and with metrics on for this connection. decode is used because
+with an explicit dtype it never touches redis, so the numbers are only the instrumentation. no redis needed
+
+run with: python benchmarks/metrics_overhead_bench.py
+'''
+
+
+#stand in for a redis client. the metrics registry only needs something it can weakly reference
+class Connection():
+    pass
+
+
+def bench(number=200000):
+    entry = (b'1700000000000-0', {b'data': np.arange(96, dtype=np.float32).tobytes()})
+    connection, other_connection = Connection(), Connection()
+    run = lambda: PNT.decode(connection, entry, dtype="float32")
+
+    results = {}
+    results["off"] = min(timeit.repeat(run, number=number, repeat=5)) / number
+    PNT.enable_metrics(other_connection, NodeMetrics("other"))
+    results["on_elsewhere"] = min(timeit.repeat(run, number=number, repeat=5)) / number
+    PNT.enable_metrics(connection, NodeMetrics("bench"))
+    results["on"] = min(timeit.repeat(run, number=number, repeat=5)) / number
+    PNT.disable_metrics(connection)
+    PNT.disable_metrics(other_connection)
+
+    for name, seconds in results.items():
+        print(f"{name:>12}: {seconds * 1e9:8.1f} ns per decode ({(seconds - results['off']) * 1e9:+.1f} ns)")
+    return {name: seconds * 1e9 for name, seconds in results.items()}
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+import argparse
+import time
+import numpy as np
+import redis
+from PyBRAND import pynode_tools as PNT
+from run_benchmarks import get_backend
+
+'''
+compares the packed entry format with the default one field per key format for a wide dict dtype (dozens of small
+keys per tick). reports redis memory per entry from MEMORY USAGE of the whole stream, the bytes sent per entry, and
+the time to decode a read with decode and decode_columnar. uses the same redis as run_benchmarks.py. fakeredis has
+no MEMORY USAGE so --stand-in only gives the decode times and the bytes sent
+
+run with: python benchmarks/packed_entry_bench.py
+'''
+
+N_CHANNELS = 32
+SCHEMA = {**{f"ch{i}": "float32" for i in range(N_CHANNELS)}, "pos": "float32", "state": "serial"}
+PACKED_SCHEMA = {**{f"ch{i}": "float32" for i in range(N_CHANNELS)}, "pos": "float32[3]", "state": "serial"}
+
+
+def make_sample(i):
+    return {**{f"ch{c}": np.float32(i + c) for c in range(N_CHANNELS)},
+            "pos": np.array([i, i + 1, i + 2], dtype=np.float32), "state": {"tick": i}}
+
+
+def get_memory_per_entry(r, stream_name, n_entries):
+    try:
+        return round(r.memory_usage(stream_name, samples=0) / n_entries, 1)
+    except redis.ResponseError:
+        return None
+
+
+def time_decode(function, repetitions):
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def bench(r, n_entries, repetitions):
+    results = {}
+    for name, dtype, packed in (("fields", SCHEMA, False), ("packed", PACKED_SCHEMA, True)):
+        stream_name = f"bench_{name}"
+        PNT.init_stream(r, stream_name, dtype, packed=packed)
+        PNT.add_many(r, [(stream_name, make_sample(i)) for i in range(n_entries)])
+        entries = r.xrange(stream_name)
+        sent = sum(len(key) + len(value) for key, value in entries[0][1].items())
+        decode_s = time_decode(lambda: PNT.decode(r, entries, stream_name), repetitions)
+        columnar_s = time_decode(lambda: PNT.decode_columnar(r, entries, stream_name), repetitions)
+        results[name] = {
+            "memory_per_entry": get_memory_per_entry(r, stream_name, n_entries),
+            "bytes_sent_per_entry": sent,
+            "decode_us_per_entry": round(decode_s / n_entries * 1e6, 3),
+            "decode_columnar_us_per_entry": round(columnar_s / n_entries * 1e6, 3),
+        }
+        print(f"{name:>7}: {results[name]['memory_per_entry']} B in redis, {sent} B sent, "
+              f"decode {results[name]['decode_us_per_entry']} us, "
+              f"decode_columnar {results[name]['decode_columnar_us_per_entry']} us per entry")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--host', type=str, default=None)
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--stand-in', action='store_true', help="use fakeredis even if redis-server is installed")
+    parser.add_argument('-n', '--entries', type=int, default=10000)
+    parser.add_argument('-r', '--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    backend, process, r = get_backend(args)
+    print(f"benchmarking against {backend} with {len(SCHEMA)} keys per entry")
+    try:
+        bench(r, args.entries, args.repetitions)
+        r.flushdb()
+    finally:
+        if process is not None:
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
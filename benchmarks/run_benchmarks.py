@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+import redis
+from PyBRAND import pynode_tools as PNT
+
+'''
+throughput/latency benchmark of pynode_tools. every operation is timed call by call and reported as ops/sec plus
+p50/p99 latency for each dtype and payload size. results are written as json so two runs (e.g. two versions) can
+be compared with compare.py
+
+the redis used is, in order of preference:
+  --host/--port     an already running server. everything is done in --db (default 15) which is flushed!
+  redis-server      found on the PATH, spawned on a free port with persistence off and killed afterwards
+  --stand-in        fakeredis in process. numbers then measure python overhead only, not the redis round trip
+
+run with: python benchmarks/run_benchmarks.py -o results.json
+'''
+
+NUMERIC_DTYPES = ["int8", "int16", "int32", "int64", "uint8", "float32", "float64"]
+PAYLOAD_BYTES = [0, 1024, 64 * 1024, 1024 * 1024] # 0 means a scalar
+DICT_DTYPE = {"a": "int16", "b": "float32", "c": "serial"}
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+#starts a throwaway redis-server and returns (process, client)
+def spawn_redis_server(executable):
+    port = get_free_port()
+    workdir = tempfile.mkdtemp(prefix="pybrand_bench_")
+    process = subprocess.Popen([executable, "--port", str(port), "--save", "", "--appendonly", "no",
+                                "--dir", workdir], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = redis.StrictRedis(host="127.0.0.1", port=port)
+    for _ in range(100):
+        try:
+            client.ping()
+            return process, client
+        except redis.ConnectionError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("redis-server did not come up")
+
+
+def get_backend(args):
+    if args.host is not None:
+        client = redis.StrictRedis(host=args.host, port=args.port, db=args.db)
+        client.flushdb()
+        return "external", None, client
+    executable = shutil.which("redis-server")
+    if executable is not None and not args.stand_in:
+        process, client = spawn_redis_server(executable)
+        return "redis-server", process, client
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("no redis available. install redis-server, pass --host/--port, or pip install fakeredis and use --stand-in")
+    return "fakeredis", None, fakeredis.FakeStrictRedis()
+
+
+def make_payload(dtype, payload_bytes):
+    if dtype == "serial":
+        return {"values": list(range(max(payload_bytes // 8, 1))), "label": "bench"}
+    if dtype == "dict":
+        n = max(payload_bytes // 6, 1)
+        return {"a": np.arange(n, dtype=np.int16), "b": np.ones(n, dtype=np.float32), "c": {"n": n}}
+    np_dtype = np.dtype(dtype)
+    if payload_bytes == 0:
+        return np_dtype.type(1)
+    return (np.arange(payload_bytes // np_dtype.itemsize) % 100).astype(np_dtype)
+
+
+#fewer repetitions for big payloads so a full run stays in the minutes
+def get_repetitions(payload_bytes, quick):
+    repetitions = 2000 if payload_bytes < 64 * 1024 else 200 if payload_bytes < 1024 * 1024 else 30
+    return max(repetitions // 10, 10) if quick else repetitions
+
+
+def time_calls(function, repetitions):
+    durations = np.empty(repetitions, dtype=np.int64)
+    for i in range(repetitions):
+        start = time.perf_counter_ns()
+        function(i)
+        durations[i] = time.perf_counter_ns() - start
+    total_s = durations.sum() / 1e9
+    return {
+        "n": repetitions,
+        "ops_per_s": round(repetitions / total_s, 1) if total_s > 0 else None,
+        "p50_us": round(float(np.percentile(durations, 50)) / 1e3, 2),
+        "p99_us": round(float(np.percentile(durations, 99)) / 1e3, 2),
+    }
+
+
+def bench_case(r, dtype, payload_bytes, repetitions):
+    stream_dtype = DICT_DTYPE if dtype == "dict" else dtype
+    payload = make_payload(dtype, payload_bytes)
+    stream_name = f"bench_{dtype}_{payload_bytes}"
+    results = {}
+
+    #every init is of a new stream, otherwise it is only the "already exists" check
+    results["init_stream"] = time_calls(lambda i: PNT.init_stream(r, f"{stream_name}_{i}", stream_dtype),
+                                        min(repetitions, 500))
+    PNT.init_stream(r, stream_name, stream_dtype)
+
+    if dtype != "dict":
+        results["encode_from_dtype"] = time_calls(lambda i: PNT.encode_from_dtype(payload, stream_dtype), repetitions)
+    trim = {"maxlen": 100}
+    results["add_to_stream"] = time_calls(lambda i: PNT.add_to_stream(r, stream_name, payload, trim=trim), repetitions)
+
+    stream_head_ids = {}
+    results["read_latest"] = time_calls(lambda i: PNT.read_latest(r, stream_name, stream_head_ids), repetitions)
+    entry = r.xrevrange(stream_name, '+', '-', count=1)[0]
+    results["decode"] = time_calls(lambda i: PNT.decode(r, entry, stream_name), repetitions)
+    return results
+
+
+def get_meta(backend):
+    try:
+        from importlib.metadata import version
+        package_version = version("PyBRAND")
+    except Exception:
+        package_version = "unknown"
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "version": package_version,
+        "commit": commit,
+        "backend": backend,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "redis_py": redis.__version__,
+        "machine": platform.machine(),
+        "time": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', type=str, default="bench_results.json")
+    parser.add_argument('-i', '--host', type=str, default=None)
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--stand-in', action='store_true', help="use fakeredis even if redis-server is installed")
+    parser.add_argument('--quick', action='store_true', help="10x fewer repetitions")
+    parser.add_argument('--dtypes', type=str, nargs='*', default=NUMERIC_DTYPES + ["dict", "serial"])
+    args = parser.parse_args()
+
+    backend, process, r = get_backend(args)
+    print(f"benchmarking against {backend}")
+    results = []
+    try:
+        for dtype in args.dtypes:
+            for payload_bytes in PAYLOAD_BYTES:
+                if payload_bytes == 0 and dtype in ("dict", "serial"):
+                    continue
+                for operation, stats in bench_case(r, dtype, payload_bytes,
+                                                   get_repetitions(payload_bytes, args.quick)).items():
+                    results.append({"operation": operation, "dtype": dtype, "payload_bytes": payload_bytes, **stats})
+                    print(f"{operation:>18} {dtype:>8} {payload_bytes:>8} B: {stats['ops_per_s']:>10} ops/s  "
+                          f"p50 {stats['p50_us']:>9} us  p99 {stats['p99_us']:>9} us")
+                r.flushdb()
+    finally:
+        if process is not None:
+            process.kill()
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": get_meta(backend), "results": results}, f, indent=1)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
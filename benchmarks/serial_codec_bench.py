@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import timeit
+import numpy as np
+from PyBRAND import pycodecs as PCD
+from PyBRAND.pydataset import _to_json
+
+'''
+microbenchmark of the serial codecs on the kind of nested data that ends up in serial keys: an armature summary
+and a decoder state, both mostly number lists. reports payload size and encode/decode time per codec. numpy arrays
+are handed to json as lists, which is what a node had to do before serial codecs. no redis needed
+
+run with: python benchmarks/serial_codec_bench.py
+'''
+
+rng = np.random.default_rng(0)
+CASES = {
+    "armature summary": {"joints": {f"j{i}": {"angle": float(rng.random()), "position": rng.random(3).tolist()}
+                                    for i in range(20)}, "name": "arm"},
+    "decoder state": {"weights": rng.random((16, 96)).astype(np.float32), "bias": rng.random(16), "step": 1204},
+}
+
+
+def bench(number=2000):
+    results = {}
+    for case, value in CASES.items():
+        for name in ("json", "msgpack"):
+            try:
+                encoder, decoder = PCD.get_serial_codec(f"serial:{name}")
+            except ValueError:
+                print(f"{case:>18} {name:>8}: not installed")
+                continue
+            if name == "json":
+                encode = lambda: encoder(value, default=_to_json)
+            else:
+                encode = lambda: encoder(value)
+            payload = encode()
+            payload = payload.encode() if isinstance(payload, str) else payload
+            encode_s = min(timeit.repeat(encode, number=number, repeat=3)) / number
+            decode_s = min(timeit.repeat(lambda: decoder(payload), number=number, repeat=3)) / number
+            results[(case, name)] = {"bytes": len(payload), "encode_us": encode_s * 1e6, "decode_us": decode_s * 1e6}
+            print(f"{case:>18} {name:>8}: {len(payload):>7} B  encode {encode_s * 1e6:8.2f} us  "
+                  f"decode {decode_s * 1e6:8.2f} us")
+    return results
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+from PyBRAND.pydataset import ColumnarWriter, ColumnarDataset, is_dataset
+
+'''
+Test of the columnar dataset format PyDerivative loads with -d. Doesn't need redis
+'''
+
+@pytest.fixture
+def dataset_path(tmp_path):
+    writer = ColumnarWriter(tmp_path / "session")
+    writer.add_stream("S", {"a": "int16", "c": "serial"})
+    for chunk in range(3):
+        timestamps = np.arange(10) + 10 * chunk
+        writer.append("S", timestamps, {"a": np.arange(20, dtype=np.int16).reshape(10, 2) + 100 * chunk,
+                                        "c": [{"t": int(t)} for t in timestamps]})
+    writer.close()
+    return tmp_path / "session"
+
+def test_load(dataset_path):
+    assert is_dataset(dataset_path)
+    data = ColumnarDataset(dataset_path)
+    assert data.streams == ["S"]
+    assert data.count("S") == 30
+
+    #time ranges are inclusive on both ends and numeric columns stay memmapped
+    timestamps, columns = data.load("S", 5, 12)
+    assert timestamps.tolist() == list(range(5, 13))
+    assert isinstance(columns["a"], np.memmap)
+    assert columns["a"].shape == (8, 2)
+    assert columns["a"][-1].tolist() == [104, 105]
+    assert columns["c"] == [{"t": t} for t in range(5, 13)]
+
+def test_iter_chunks(dataset_path):
+    data = ColumnarDataset(dataset_path)
+    chunks = list(data.iter_chunks("S", 8, start_ms=3))
+    assert [len(timestamps) for timestamps, _ in chunks] == [8, 8, 8, 3]
+    assert chunks[-1][1]["c"][-1] == {"t": 29}
+
+def test_partial_rows_are_hidden(dataset_path):
+    #a column written without its timestamps yet isn't counted
+    writer = ColumnarWriter(dataset_path)
+    writer.append("S", np.array([], dtype=np.int64), {"a": np.zeros((0, 2), dtype=np.int16), "c": []})
+    with open(dataset_path / "S" / "a.bin", "ab") as f:
+        f.write(np.zeros(2, dtype=np.int16).tobytes())
+    writer.close()
+    assert ColumnarDataset(dataset_path).count("S") == 30
+
+def test_reopen_after_torn_write(dataset_path):
+    #a crash mid append left a value in a.bin and a line in c.jsonl that have no timestamp
+    with open(dataset_path / "S" / "a.bin", "ab") as f:
+        f.write(np.array([999, 999], dtype=np.int16).tobytes())
+    with open(dataset_path / "S" / "c.jsonl", "ab") as f:
+        f.write(b'{"t": 999}\n{"t": 9')
+
+    writer = ColumnarWriter(dataset_path)
+    assert writer.count("S") == 30
+    writer.append("S", np.array([30, 31]), {"a": np.array([[300, 301], [310, 311]], dtype=np.int16),
+                                           "c": [{"t": 30}, {"t": 31}]})
+    writer.close()
+
+    timestamps, columns = ColumnarDataset(dataset_path).load("S", 28)
+    assert timestamps.tolist() == [28, 29, 30, 31]
+    assert columns["a"].tolist() == [[216, 217], [218, 219], [300, 301], [310, 311]]
+    assert columns["c"] == [{"t": 28}, {"t": 29}, {"t": 30}, {"t": 31}]
+
+def test_truncate(dataset_path):
+    writer = ColumnarWriter(dataset_path)
+    assert writer.truncate("S", 12) == 12
+    writer.append("S", np.array([12]), {"a": np.array([[-1, -1]], dtype=np.int16), "c": [{"t": -1}]})
+    writer.close()
+    timestamps, columns = ColumnarDataset(dataset_path).load("S")
+    assert timestamps.tolist() == list(range(13))
+    assert columns["a"][-2:].tolist() == [[102, 103], [-1, -1]]
+    assert columns["c"][-2:] == [{"t": 11}, {"t": -1}]
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import pytest
+import redis
+from PyBRAND.pyasyncnode import AsyncBRANDNode
+
+'''
+Test of the asyncio node: stream handlers get every new entry and SIGTERM stops the node through terminate().
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+class Echo(AsyncBRANDNode):
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self.received = []
+        self.published = 0
+        self.terminated = False
+        self.add_stream_handler('S', self.on_entries, block_ms=50)
+
+    async def setup(self):
+        await self.init_stream('S', {'a': 'int16', 'c': 'serial'})
+
+    #stops the node through SIGTERM once everything arrived, the way the supervisor would
+    async def on_entries(self, entries):
+        self.received += await self.decode(entries, 'S')
+        if len(self.received) >= self.n:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    async def work(self):
+        #give the handler time to start following the stream
+        await asyncio.sleep(0.1)
+        if self.published < self.n:
+            for i in range(self.n):
+                await self.add_to_stream('S', {'a': i, 'c': {'i': i}})
+            self.published = self.n
+
+    async def terminate(self):
+        self.terminated = True
+        await super().terminate()
+
+@pytest.fixture
+def parameters(monkeypatch):
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    r_pers.hset("PARAMETERS", "echo", json.dumps({}))
+    monkeypatch.setattr(sys, "argv", ["pyasyncnode", "-n", "echo"])
+    yield r
+    r.flushdb()
+    r_pers.flushdb()
+    r.close()
+    r_pers.close()
+
+def test_handler_and_sigterm(parameters):
+    r = parameters
+    node = Echo(5)
+    #if the handler never sees the entries the node is stopped anyway and the asserts below fail
+    fallback = threading.Timer(10, os.kill, (os.getpid(), signal.SIGTERM))
+    fallback.start()
+    try:
+        node.run()
+    finally:
+        fallback.cancel()
+
+    assert [fields for _, fields in node.received] == [{'a': i, 'c': {'i': i}} for i in range(5)]
+    assert node.terminated
+    assert r.xlen('error_stream') == 0
+
+class SlowSetup(AsyncBRANDNode):
+    def __init__(self):
+        super().__init__()
+        self.setup_done = False
+        self.worked = False
+        self.terminated = False
+
+    #the supervisor stops the node while it is still setting up
+    async def setup(self):
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(10)
+        self.setup_done = True
+
+    async def work(self):
+        self.worked = True
+        await asyncio.sleep(0.01)
+
+    async def terminate(self):
+        self.terminated = True
+        await super().terminate()
+
+def test_sigterm_during_setup(parameters):
+    node = SlowSetup()
+    start = time.monotonic()
+    node.run()
+    #the signal wasn't lost or fatal, it cut setup short and went through terminate without starting the node
+    assert time.monotonic() - start < 5
+    assert node.terminated
+    assert not node.setup_done and not node.worked
@@ -0,0 +1,66 @@
+import json
+import signal
+import time
+import pytest
+import redis
+from PyBRAND.pylauncher import Launcher
+
+'''
+Test of the warm launcher forking nodes from a class path.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+NODE_MODULE = """
+from PyBRAND.pynode import BRANDNode
+
+class Once(BRANDNode):
+    def work(self):
+        self.realtime_database.xadd(f"{self.NAME}_out", {"nickname": self.NAME, "gain": self.parameters["gain"]})
+        raise SystemExit(3)
+"""
+
+@pytest.fixture
+def launcher(tmp_path, monkeypatch):
+    (tmp_path / "launched_nodes.py").write_text(NODE_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    sigterm = signal.getsignal(signal.SIGTERM)
+    launcher = Launcher("launcher", preload_modules=[])
+    yield launcher
+    signal.signal(signal.SIGTERM, sigterm)
+    launcher.realtime_database.close()
+    r.flushdb()
+    r_pers.flushdb()
+    r.close()
+    r_pers.close()
+
+def wait_for_children(launcher, timeout_s=10):
+    deadline = time.monotonic() + timeout_s
+    while len(launcher.children) > 0 and time.monotonic() < deadline:
+        launcher.reap()
+        time.sleep(0.01)
+    assert len(launcher.children) == 0
+
+def test_launch(launcher):
+    r = launcher.realtime_database
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    r_pers.hset("PARAMETERS", "a", json.dumps({"gain": 2}))
+    r_pers.hset("PARAMETERS", "b", json.dumps({"gain": 5}))
+    pids = [launcher.launch("a", "launched_nodes:Once"), launcher.launch("b", "launched_nodes.Once")]
+    assert launcher.launch("c", "launched_nodes:Missing") is None
+    wait_for_children(launcher)
+
+    #each child ran as its own nickname with its own parameters
+    for nickname, gain in (("a", b"2"), ("b", b"5")):
+        fields = r.xrange(f"{nickname}_out")[0][1]
+        assert fields == {b"nickname": nickname.encode(), b"gain": gain}
+        startup = [fields for _, fields in r.xrange(f"{nickname}_state") if fields[b'status'] == b'startup'][0]
+        assert json.loads(startup[b'timing'])["launcher"] is True
+
+    states = [fields for _, fields in r.xrange("launcher_state")]
+    assert [fields[b'status'] for fields in states] == \
+        [b'initialized', b'launched', b'launched', b'launch_failed', b'exited', b'exited']
+    exits = {int(fields[b'pid']): fields for fields in states if fields[b'status'] == b'exited'}
+    assert set(exits) == set(pids)
+    assert all(fields[b'exit_code'] == b'3' for fields in exits.values())
@@ -0,0 +1,73 @@
+import json
+import time
+import pytest
+import redis
+import PyBRAND.pynode_tools as pnt
+from PyBRAND.pymetrics import BUCKET_EDGES_US, Histogram, NodeMetrics
+
+'''
+Test of the hot path metrics histograms and flushing them to the metrics stream.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+@pytest.fixture
+def redis_client():
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    yield r
+    pnt.disable_metrics(r)
+    r.flushdb()
+    r.close()
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    #bucket edges are upper bounds and inclusive, anything past the last edge is in the open ended bucket
+    for microseconds in (0.5, 1, 1.5, 999, 1000, 1001, 1e6, 5e6):
+        histogram.record(microseconds)
+    counts = histogram.counts
+    assert len(counts) == len(BUCKET_EDGES_US) + 1
+    assert counts[0] == 2
+    assert counts[1] == 1
+    assert counts[BUCKET_EDGES_US.index(1000)] == 2
+    assert counts[BUCKET_EDGES_US.index(2000)] == 1
+    assert counts[BUCKET_EDGES_US.index(1000000)] == 1
+    assert counts[-1] == 1
+    assert sum(counts) == 8
+
+    summary = histogram.summary()
+    assert summary["count"] == 8
+    assert summary["max_us"] == 5e6
+    assert summary["mean_us"] == round((0.5 + 1 + 1.5 + 999 + 1000 + 1001 + 1e6 + 5e6) / 8, 2)
+    assert Histogram().summary()["mean_us"] == 0.0
+
+def test_flush(redis_client):
+    r = redis_client
+    metrics = NodeMetrics("node", interval_s=0.05)
+    assert not metrics.due()
+    metrics.record("work", 0.002)
+    metrics.record("work", 0.004)
+    metrics.record_latency("S", [f"{int(time.time() * 1000) - 5}-0".encode()])
+
+    #the library calls record their own operations once metrics are on for the connection
+    pnt.enable_metrics(r, metrics)
+    pnt.init_stream(r, 'S', 'int16')
+    pnt.add_to_stream(r, 'S', 1)
+    time.sleep(0.05)
+    assert metrics.due()
+    metrics.flush(r)
+
+    entries = r.xrange('node_metrics')
+    assert len(entries) == 1
+    snapshot = json.loads(entries[0][1][b'metrics'])
+    assert snapshot["bucket_edges_us"] == list(BUCKET_EDGES_US)
+    ops = snapshot["ops"]
+    assert ops["work"]["count"] == 2
+    assert ops["work"]["mean_us"] == pytest.approx(3000)
+    assert ops["work"]["buckets"][BUCKET_EDGES_US.index(2000)] == 1
+    assert ops["work"]["buckets"][BUCKET_EDGES_US.index(5000)] == 1
+    assert ops["latency:S"]["mean_us"] >= 5000
+    assert ops["encode:S"]["count"] == 1
+    assert ops["xadd:S"]["count"] == 1
+
+    #a flush starts a new window
+    assert metrics.histograms == {}
+    assert not metrics.due()
@@ -0,0 +1,50 @@
+import json
+import sys
+import time
+import pytest
+import redis
+from PyBRAND.pynode import BRANDNode
+
+'''
+Test of the BRANDNode wrapper itself, built the way the supervisor starts it.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+@pytest.fixture
+def make_node(monkeypatch):
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    def make(**parameters):
+        r_pers.hset("PARAMETERS", "node", json.dumps(parameters))
+        monkeypatch.setattr(sys, "argv", ["pynode", "-n", "node"])
+        return BRANDNode()
+    yield make
+    r.flushdb()
+    r_pers.flushdb()
+    r.close()
+    r_pers.close()
+
+def test_set_stream_trim(make_node):
+    node = make_node()
+    node.set_stream_trim('S', maxlen=10)
+    assert node.stream_trim['S']['maxlen'] == 10
+
+    #redis can't trim by both, so it is refused here instead of failing every add later
+    with pytest.raises(ValueError):
+        node.set_stream_trim('S', maxlen=10, minid='0-1')
+    assert node.stream_trim['S']['minid'] is None
+
+def test_parameters_interval(make_node, monkeypatch):
+    reads = []
+    hget = redis.Redis.hget
+    def counting_hget(self, name, key):
+        reads.append(name)
+        return hget(self, name, key)
+    monkeypatch.setattr(redis.Redis, "hget", counting_hget)
+
+    #the first poll of the watch is already scheduled with the node's interval, not the 1 s default, and the
+    #parameters are only read once to get there
+    node = make_node(parameters_interval_s=5)
+    assert reads.count("PARAMETERS") == 1
+    assert node.parameter_watch.interval_s == 5
+    assert node.parameter_watch.next_poll - time.monotonic() > 4
@@ -1,5 +1,8 @@
+import json
+import time
 import pytest
 import redis
+import numpy as np
 import brandlite.pynode_tools as pnt
 
 '''
@@ -73,6 +76,382 @@ def test_init_stream(redis_client):
 
 
 
+def test_dtype_cache(redis_client):
+    r = redis_client
+
+    pnt.init_stream(r, 'CACHE1', 'int16')
+    cache = pnt.get_dtype_cache(r)
+    pnt.add_to_stream(r, 'CACHE1', 5)
+    before = cache.stats()
+
+    #the dtype is already cached so adding again shouldn't miss
+    pnt.add_to_stream(r, 'CACHE1', 6)
+    after = cache.stats()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+    #invalidating forces the next lookup back to redis
+    cache.invalidate('CACHE1')
+    assert pnt.get_cached_dtype(r, 'CACHE1') == 'int16'
+    assert cache.stats()["misses"] == after["misses"] + 1
+
+
+def test_dtype_cache_watch(redis_client):
+    r = redis_client
+    #the cache doesn't turn on keyspace notifications for the whole server unless it is asked to
+    r.config_set("notify-keyspace-events", "")
+    cache = pnt.get_dtype_cache(r)
+    pnt.init_stream(r, 'WATCH1', 'int16')
+    assert not cache.stats()["watching"]
+    assert r.config_get("notify-keyspace-events")["notify-keyspace-events"] == ""
+
+    #the stream's own init entry doesn't drop the dtype it just cached
+    other = redis.Redis(host='localhost', port=6379, db=0)
+    watched = pnt.get_dtype_cache(other)
+    assert watched.watch(other)
+    pnt.init_stream(other, 'WATCH2', 'int16')
+    pnt.add_to_stream(other, 'WATCH2', 1)
+    time.sleep(0.01)
+    pnt.add_to_stream(other, 'WATCH2', 2)
+    assert watched.stats()["misses"] == 0 and watched.stats()["invalidations"] == 0
+
+    #starting it over from another connection does
+    r.delete('WATCH2_init')
+    r.xadd('WATCH2_init', {'dtype': 'int32'})
+    time.sleep(0.01)
+    assert pnt.get_cached_dtype(other, 'WATCH2') == 'int32'
+    assert watched.stats()["invalidations"] == 1
+    other.close()
+
+
+def test_parameter_watch(redis_client):
+    r = redis_client
+    r.hset("PARAMETERS", "node", json.dumps({"gain": "2.5", "enabled": "false", "taps": [1, 2]}))
+    watch = pnt.ParameterWatch(r, "node", interval_s=0)
+    parameters = watch.parameters
+    assert parameters.get("threshold", 3) == 3
+    assert parameters.get_float("gain") == 2.5
+    assert parameters.get_bool("enabled") is False
+    assert parameters.get_array("taps", np.int32).tolist() == [1, 2]
+    with pytest.raises(ValueError):
+        parameters.get_int("gain")
+    assert not watch.check()
+
+    #writing another node's parameters doesn't reload the view
+    r.hset("PARAMETERS", "other", "{}")
+    time.sleep(0.01)
+    assert not watch.check()
+
+    r.hset("PARAMETERS", "node", json.dumps({"gain": 3.0, "taps": [1, 2]}))
+    time.sleep(0.01)
+    assert watch.check()
+    assert watch.parameters.changed_from(parameters) == {"gain", "enabled"}
+    #the old view doesn't change under whoever still holds it
+    assert parameters["gain"] == "2.5"
+
+    #half edited json keeps the last good parameters
+    r.hset("PARAMETERS", "node", '{"gain": ')
+    time.sleep(0.01)
+    assert not watch.check()
+    assert watch.parameters.get_float("gain") == 3.0
+
+
+def test_stream_scripts(redis_client):
+    r = redis_client
+
+    #initing again with the same dict dtype is fine, a different one isn't
+    pnt.init_stream(r, 'LUA1', {"a": "int8", "b": "serial"})
+    pnt.init_stream(r, 'LUA1', {"a": "int8", "b": "serial"})
+    with pytest.raises(pnt.WarningError):
+        pnt.init_stream(r, 'LUA1', 'int8')
+    assert r.xlen('LUA1_init') == 1
+
+    #the stream is started over with another dtype behind the cache's back. the checked add notices and re-encodes
+    pnt.init_stream(r, 'LUA2', 'int8')
+    pnt.add_checked(r, 'LUA2', np.array([1, 2], dtype=np.int8))
+    r.delete('LUA2_init')
+    r.xadd('LUA2_init', {'dtype': 'int16'})
+    pnt.add_checked(r, 'LUA2', np.array([3, 4], dtype=np.int16))
+
+    dtype, entries = pnt.read_after(r, 'LUA2', b'0-0')
+    assert dtype == 'int16'
+    assert [entry[1][b'data'] for entry in entries] == [b'\x01\x02', b'\x03\x00\x04\x00']
+    assert pnt.read_after(r, 'LUA2', entries[0][0])[1] == entries[1:]
+    assert pnt.read_after(r, 'NOSTREAM', b'0-0') == (None, [])
+
+    #scripts come back by themselves after the server forgets them
+    r.script_flush()
+    pnt.init_stream(r, 'LUA3', 'int8')
+    assert pnt.get_stream_dtype(r, 'LUA3') == 'int8'
+
+
+def test_read_new(redis_client):
+    r = redis_client
+    cursors = {}
+
+    pnt.init_stream(r, 'NEW1', 'int8')
+    pnt.init_stream(r, 'NEW2', 'int16')
+    pnt.add_to_stream(r, 'NEW1', 1)
+
+    #the first read starts at the head so the entry already there isn't returned
+    a = pnt.read_new(r, ['NEW1', 'NEW2'], cursors)
+    assert a == {'NEW1': [], 'NEW2': []}
+
+    #everything added since the last read comes back, not just the latest
+    pnt.add_to_stream(r, 'NEW1', 2)
+    pnt.add_to_stream(r, 'NEW1', 3)
+    pnt.add_to_stream(r, 'NEW2', 4)
+    b = pnt.read_new(r, ['NEW1', 'NEW2'], cursors)
+    assert [entry[1] for entry in b['NEW1']] == [{b'data': b'\x02'}, {b'data': b'\x03'}]
+    assert len(b['NEW2']) == 1
+
+    #nothing new since the last call
+    c = pnt.read_new(r, ['NEW1', 'NEW2'], cursors)
+    assert c == {'NEW1': [], 'NEW2': []}
+
+
+def test_read_aligned(redis_client):
+    r = redis_client
+    nearest = pnt.StreamAligner(['NEURAL', 'CURSOR'], tolerance_ms=5, mode="nearest")
+    held = pnt.StreamAligner(['NEURAL', 'CURSOR'], tolerance_ms=5, mode="previous")
+    exact = pnt.StreamAligner(['NEURAL', 'CURSOR'], mode="exact")
+    for aligner in (nearest, held, exact):
+        pnt.read_aligned(r, aligner)
+
+    for ms in (10, 20, 30):
+        r.xadd('NEURAL', {'v': ms}, id=f"{ms}-0")
+    for ms in (8, 20, 21):
+        r.xadd('CURSOR', {'v': ms}, id=f"{ms}-0")
+
+    def get_ids(aligned):
+        return [tuple(entry[0] for entry in entries) for entries in aligned]
+
+    #30 has to wait for a cursor sample at or after it, which might be closer than 21
+    assert get_ids(pnt.read_aligned(r, nearest)) == [(b'10-0', b'8-0'), (b'20-0', b'20-0')]
+    assert nearest.stats()["buffered"]["NEURAL"] == 1
+    assert get_ids(pnt.read_aligned(r, held)) == [(b'10-0', b'8-0'), (b'20-0', b'20-0')]
+    assert held.stats()["unmatched"]["CURSOR"] == 1
+    assert get_ids(pnt.read_aligned(r, exact)) == [(b'20-0', b'20-0')]
+    assert exact.stats()["unmatched"]["CURSOR"] == 1
+
+    r.xadd('CURSOR', {'v': 32}, id="32-0")
+    assert get_ids(pnt.read_aligned(r, nearest)) == [(b'30-0', b'32-0')]
+
+
+def test_add_many(redis_client):
+    r = redis_client
+
+    pnt.init_stream(r, 'BATCH1', 'int8')
+    pnt.init_stream(r, 'BATCH2', {"a": "int8", "b": "int16"})
+
+    #everything goes out in one pipeline and the ids come back in order
+    ids, timing = pnt.add_many(r, [('BATCH1', 1), ('BATCH2', {"a": 2, "b": 3}), ('BATCH1', 4)])
+    assert len(ids) == 3
+    assert timing["entries"] == 3
+    assert r.xlen('BATCH1') == 2
+
+    #exact trimming keeps only the newest entries
+    with pnt.StreamBatch(r, {'BATCH1': {"maxlen": 2, "approximate": False}}) as batch:
+        for i in range(5):
+            batch.add('BATCH1', i)
+    assert batch.timing["entries"] == 5
+    assert r.xlen('BATCH1') == 2
+
+    #an error inside the block throws the batch away
+    with pytest.raises(RuntimeError):
+        with pnt.StreamBatch(r) as batch:
+            batch.add('BATCH1', 9)
+            raise RuntimeError()
+    assert r.xlen('BATCH1') == 2
+
+    #trimming by length and by id at once is refused where it is set, not when redis sees it
+    with pytest.raises(ValueError):
+        pnt.get_trim_args({"maxlen": 2, "minid": "0-1"})
+    with pytest.raises(ValueError):
+        pnt.add_to_stream(r, 'BATCH1', 1, trim={"maxlen": 2, "minid": "0-1"})
+    assert r.xlen('BATCH1') == 2
+
+
+def test_connection_pool():
+    import redis.asyncio as aioredis
+
+    #a socket path gives unix socket connections, sync or async, and sibling pools keep them
+    pool = pnt.make_connection_pool(socket_path="/tmp/redis.sock", db=0)
+    assert pool.connection_class is redis.UnixDomainSocketConnection
+    sibling = pnt.make_sibling_pool(pool, db=1)
+    assert sibling.connection_class is redis.UnixDomainSocketConnection
+    assert sibling.connection_kwargs["path"] == "/tmp/redis.sock" and sibling.connection_kwargs["db"] == 1
+    async_pool = pnt.make_connection_pool(socket_path="/tmp/redis.sock", pool_class=aioredis.ConnectionPool)
+    assert async_pool.connection_class is aioredis.UnixDomainSocketConnection
+
+    pool = pnt.make_connection_pool("localhost", "6379", db=0)
+    assert pool.connection_kwargs["port"] == 6379 and pool.connection_kwargs["socket_keepalive"]
+
+
+def test_report_rtt(redis_client, capsys, monkeypatch):
+    rtt = pnt.report_rtt("node", redis_client, "localhost:6379")
+    assert rtt["min_ms"] <= rtt["median_ms"] <= rtt["max_ms"]
+    assert "[node] Redis connection established on localhost:6379" in capsys.readouterr().out
+
+    monkeypatch.setattr(pnt, "RTT_WARN_MS", -1)
+    pnt.report_rtt("node", redis_client, "localhost:6379")
+    assert "[node] WARNING: redis round trips are slow" in capsys.readouterr().out
+
+
+def test_codec_plan():
+    #string dtypes encode every key the same way
+    plan = pnt.compile_codec_plan('int16')
+    assert plan.encode(20) == {"data": pnt.encode_from_dtype(20, 'int16')}
+    assert pnt.compile_codec_plan('int16') is plan
+
+    #dict dtypes round trip through decode
+    plan = pnt.compile_codec_plan({"a": "int8", "c": "serial"})
+    encoded = plan.encode({"a": [1, 2], "c": {"x": 1}})
+    assert encoded["c"] == '{"x": 1}'
+    entry = (b'0-1', {b'a': encoded["a"], b'c': encoded["c"].encode()})
+    decoded = plan.decode([entry])
+    assert str(decoded[0][1]) == "{'a': array([1, 2], dtype=int8), 'c': {'x': 1}}"
+
+    #bad dtypes fail when the plan is compiled, not when data is encoded
+    with pytest.raises(ValueError):
+        pnt.compile_codec_plan('int9')
+
+
+def test_decode_columnar(redis_client):
+    r = redis_client
+
+    pnt.init_stream(r, 'COLUMNS', {"a": "int16", "c": "serial"})
+    for i in range(4):
+        pnt.add_to_stream(r, 'COLUMNS', {"a": [i, 2 * i, 3 * i], "c": {"i": i}})
+    entries = r.xrange('COLUMNS')
+
+    timestamps, columns = pnt.decode_columnar(r, entries, 'COLUMNS')
+    assert timestamps.dtype == np.int64 and len(timestamps) == 4
+    assert columns["a"].shape == (4, 3)
+    assert columns["a"][:, 1].tolist() == [0, 2, 4, 6]
+    assert columns["c"] == [{"i": 0}, {"i": 1}, {"i": 2}, {"i": 3}]
+
+    #every row matches the entry by entry decode
+    decoded = pnt.decode(r, entries, 'COLUMNS')
+    assert all((columns["a"][i] == decoded[i][1]["a"]).all() for i in range(4))
+
+    #a field the dict dtype doesn't have names the stream and the field
+    r.xadd('COLUMNS', {"a": np.array([1, 2, 3], dtype=np.int16).tobytes(), "b": b"1"})
+    entries = r.xrange('COLUMNS')
+    with pytest.raises(pnt.WarningError, match="field b of COLUMNS"):
+        pnt.decode(r, entries, 'COLUMNS')
+    with pytest.raises(pnt.WarningError, match="field b of COLUMNS"):
+        pnt.decode_columnar(r, entries[-1:], 'COLUMNS')
+
+
+def test_stream_window(redis_client):
+    r = redis_client
+
+    pnt.init_stream(r, 'WINDOW', 'int32')
+    for i in range(3):
+        pnt.add_to_stream(r, 'WINDOW', [i, -i])
+
+    #the first update fills from what is already in the stream
+    window = pnt.update_window(r, pnt.StreamWindow('WINDOW', 4))
+    assert window.view()[:, 0].tolist() == [0, 1, 2]
+
+    #later updates only add the new entries and keep the last n in order
+    for i in range(3, 7):
+        pnt.add_to_stream(r, 'WINDOW', [i, -i])
+    pnt.update_window(r, window)
+    assert window.view()[:, 0].tolist() == [3, 4, 5, 6]
+    assert window.view()[:, 1].tolist() == [-3, -4, -5, -6]
+    assert len(window.timestamps_view()) == 4
+
+    #the view is a slice of the preallocated buffer, not a copy
+    assert window.view().base is window.buffer
+
+    #after a stall only the newest n entries of the backlog come back from redis
+    pnt.add_many(r, [('WINDOW', [i, -i]) for i in range(7, 1007)])
+    replies = []
+    xrevrange = r.xrevrange
+    def counting_xrevrange(*args, **kwargs):
+        replies.append(xrevrange(*args, **kwargs))
+        return replies[-1]
+    r.xrevrange = counting_xrevrange
+    pnt.update_window(r, window)
+    assert [len(reply) for reply in replies] == [4]
+    assert window.view()[:, 0].tolist() == [1003, 1004, 1005, 1006]
+    pnt.add_to_stream(r, 'WINDOW', [1007, -1007])
+    pnt.update_window(r, window)
+    assert window.view()[:, 0].tolist() == [1004, 1005, 1006, 1007]
+
+
+def test_packed_stream(redis_client):
+    r = redis_client
+    dtype = {"a": "float32", "pos": "float32[3]", "m": "int16[2,2]", "info": "serial"}
+    pnt.init_stream(r, 'PACKED', dtype, packed=True)
+    for i in range(3):
+        pnt.add_to_stream(r, 'PACKED', {"a": i, "pos": [1, 2, 3], "m": np.eye(2) * i, "info": {"i": i}})
+
+    #every entry is a single field
+    entries = r.xrange('PACKED')
+    assert list(entries[0][1].keys()) == [b'packed']
+
+    decoded = pnt.decode(r, entries, 'PACKED')[2][1]
+    assert decoded["a"][0] == 2
+    assert decoded["m"].shape == (2, 2)
+    assert decoded["info"] == {"i": 2}
+
+    timestamps, columns = pnt.decode_columnar(r, entries, 'PACKED')
+    assert columns["pos"].shape == (3, 3)
+    assert list(columns["m"][:, 0, 0]) == [0, 1, 2]
+    assert columns["info"] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+    #entries of another layout are refused instead of misread
+    with pytest.raises(ValueError):
+        pnt.compile_codec_plan('packed:{"a": "float64"}').decode(entries)
+    with pytest.raises(ValueError):
+        pnt.init_stream(r, 'BADPACKED', {"a": "int8[0]"}, packed=True)
+
+
+def test_serial_codecs(redis_client):
+    r = redis_client
+    pytest.importorskip("msgpack")
+    state = {"weights": np.arange(6, dtype=np.float32).reshape(2, 3), "step": np.int64(4), "names": ["a", "b"],
+             "gain": np.array(3.0), "big": np.array([1, 2], dtype='>i4')}
+    pnt.init_stream(r, 'MSGPACK', {"x": "int8", "state": "serial:msgpack"})
+    pnt.add_to_stream(r, 'MSGPACK', {"x": 1, "state": state})
+    decoded = pnt.decode(r, r.xrange('MSGPACK'), 'MSGPACK')[0][1]["state"]
+    assert decoded["weights"].dtype == np.float32
+    assert np.array_equal(decoded["weights"], state["weights"])
+    assert decoded["step"] == 4 and decoded["names"] == ["a", "b"]
+    #0-d arrays keep their shape and big endian arrays come back with the same values
+    assert decoded["gain"].shape == () and decoded["gain"] == 3.0
+    assert decoded["big"].tolist() == [1, 2]
+
+    #plain serial is still json
+    pnt.init_stream(r, 'JSON', 'serial')
+    pnt.add_to_stream(r, 'JSON', [1, 2])
+    assert r.xrange('JSON')[0][1][b'data'] == b'[1, 2]'
+
+    with pytest.raises(ValueError):
+        pnt.init_stream(r, 'NOCODEC', 'serial:nocodec')
+
+
+def test_shm_stream(redis_client):
+    r = redis_client
+
+    #only a descriptor goes through redis, the array comes back as a view of the shared memory
+    pnt.init_stream(r, 'SHM', 'shm:int16:4')
+    frame = np.arange(96 * 30, dtype=np.int16).reshape(96, 30)
+    pnt.add_to_stream(r, 'SHM', frame)
+    entries = r.xrange('SHM')
+    assert len(entries[0][1][b'data']) < 200
+    decoded = pnt.decode(r, entries, 'SHM')[0][1]['data']
+    assert (decoded == frame).all()
+
+    #once the ring wraps around the old descriptor is detected as overwritten
+    for i in range(4):
+        pnt.add_to_stream(r, 'SHM', frame + i)
+    assert pnt.decode(r, entries, 'SHM')[0][1]['data'] is None
+
+
 #Reminder: WHEN DOING NEW TESTS, REMEMBER THE REDIS LINUX TIME STAMP WILL NEVER BE THE SAME (unless you found a way to freeze time)
 #DON'T ASSERT IT!! ALSO REMEMBER TO FLUSH THE DATABASE AFTER EACH TEST 
 def test_read_stream(redis_client):
@@ -153,8 +532,10 @@ def test_read_stream(redis_client):
     print(data)
     '''
 
-r = redis.Redis(host='localhost', port=6379, db=0)
-r.flushdb()
-#test_init_stream(r)
-test_read_stream(r)
-print("done")
\ No newline at end of file
+#only when run as a script. pytest shouldn't flush the database just by importing this file
+if __name__ == "__main__":
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r.flushdb()
+    #test_init_stream(r)
+    test_read_stream(r)
+    print("done")
\ No newline at end of file
@@ -0,0 +1,104 @@
+import os
+import time
+import pytest
+import redis
+import PyBRAND.pynode_tools as pnt
+from PyBRAND.pymetrics import NodeMetrics
+from PyBRAND.pyprofiler import Profiler, get_profile, render_profile, SORT_KEYS
+
+'''
+Test of profiling work() through the control stream.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+@pytest.fixture
+def redis_clients():
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    yield r, r_pers
+    pnt.disable_metrics(r)
+    r.flushdb()
+    r_pers.flushdb()
+    r.close()
+    r_pers.close()
+
+def busy(n=2000):
+    return sum(i * i for i in range(n))
+
+def work():
+    busy()
+    time.sleep(0.002)
+
+def test_cprofile_ticks(redis_clients):
+    r, r_pers = redis_clients
+    profiler = Profiler("node", r, r_pers, interval_s=0)
+    r.xadd("node_control", {"command": "start", "mode": "cprofile", "ticks": 5})
+    profiler.poll()
+    assert profiler.active
+    for _ in range(5):
+        profiler.tick(work)
+    assert not profiler.active
+
+    profile = get_profile(r_pers, "node")
+    assert profile["ticks"] == 5
+    busy_stats = [function for function in profile["functions"] if function["function"].endswith("(busy)")]
+    assert busy_stats[0]["ncalls"] == 5
+    assert "busy" in render_profile(profile)
+    assert [fields[b'status'] for _, fields in r.xrange("node_state")] == [b'profile_started', b'profile_done']
+
+def test_sample_seconds(redis_clients):
+    r, r_pers = redis_clients
+    #commands from before the node started are ignored
+    r.xadd("node_control", {"command": "stop"})
+    profiler = Profiler("node", r, r_pers, interval_s=0)
+    profiler.start("sample", seconds=0.2, interval_ms=0.5)
+    while profiler.active:
+        profiler.tick(lambda: busy(200000))
+    profile = get_profile(r_pers, "node")
+    assert profile["samples"] > 0
+    assert profile["functions"][0]["function"].endswith("(busy)") or \
+        profile["functions"][0]["function"].endswith("(<genexpr>)")
+    assert all(stack.startswith(os.path.basename(__file__)) for stack in profile["stacks"])
+
+    r.xadd("node_control", {"command": "start", "mode": "strace"})
+    profiler.poll()
+    assert not profiler.active
+    assert r.xrevrange("node_state", count=1)[0][1][b'status'] == b'profile_error'
+
+def test_poll_not_in_metrics(redis_clients):
+    r, r_pers = redis_clients
+    metrics = NodeMetrics("node")
+    pnt.enable_metrics(r, metrics)
+    #idle polls of the control stream are not node reads, so they don't show up in read_new or as a latency series
+    profiler = Profiler("node", r, r_pers, interval_s=0)
+    for _ in range(3):
+        profiler.poll()
+    r.xadd("node_control", {"command": "start", "ticks": 1})
+    profiler.poll()
+    assert profiler.active
+    assert metrics.histograms == {}
+
+def test_render_sort(redis_clients):
+    r, r_pers = redis_clients
+    profiler = Profiler("node", r, r_pers, interval_s=0)
+    profiles = []
+    profiler.start("cprofile", ticks=2)
+    while profiler.active:
+        profiler.tick(work)
+    profiles.append(get_profile(r_pers, "node"))
+    profiler.start("sample", seconds=0.1, interval_ms=0.5)
+    while profiler.active:
+        profiler.tick(lambda: busy(200000))
+    profiles.append(get_profile(r_pers, "node"))
+
+    #every sort name and column of the mode works, anything else names the choices
+    for profile in profiles:
+        keys = SORT_KEYS[profile["mode"]]
+        for sort in list(keys) + list(keys.values()):
+            table = render_profile(profile, sort).splitlines()
+            assert len(table) == 2 + min(30, len(profile["functions"]))
+        assert "profile of" in render_profile(profile, "tottime")
+        with pytest.raises(ValueError, match="use one of"):
+            render_profile(profile, "bogus")
+    with pytest.raises(ValueError):
+        render_profile(profiles[1], "tottime_s")
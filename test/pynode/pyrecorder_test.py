@@ -0,0 +1,99 @@
+import json
+import sys
+import pytest
+import redis
+import numpy as np
+import PyBRAND.pynode_tools as pnt
+from PyBRAND.pydataset import ColumnarDataset
+from PyBRAND.pyrecorder import BRANDRecorder
+
+'''
+Test of the recorder node: recording, resuming after a crash and streams it can't record.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+@pytest.fixture
+def redis_client():
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    r_pers = redis.Redis(host='localhost', port=6379, db=1)
+    yield r
+    r.flushdb()
+    r_pers.flushdb()
+    r.close()
+    r_pers.close()
+
+@pytest.fixture
+def make_recorder(redis_client, tmp_path, monkeypatch):
+    def make(**parameters):
+        parameters = {"streams": ["S"], "path": str(tmp_path / "session"), "block_ms": 1,
+                      "fsync_interval_s": 1000, **parameters}
+        redis.Redis(host='localhost', port=6379, db=1).hset("PARAMETERS", "rec", json.dumps(parameters))
+        monkeypatch.setattr(sys, "argv", ["pyrecorder", "-n", "rec"])
+        return BRANDRecorder()
+    return make
+
+def add_entries(r, values):
+    for value in values:
+        pnt.add_to_stream(r, 'S', {'a': np.array([value, -value], dtype=np.int16), 'c': {'v': value}})
+
+def test_record(redis_client, make_recorder, tmp_path):
+    r = redis_client
+    pnt.init_stream(r, 'S', {'a': 'int16', 'c': 'serial'})
+    add_entries(r, range(10))
+    recorder = make_recorder()
+    recorder.work()
+    recorder.sync()
+    recorder.writer.close()
+
+    timestamps, columns = ColumnarDataset(tmp_path / "session").load("S")
+    assert len(timestamps) == 10
+    assert columns['a'][:, 0].tolist() == list(range(10))
+    assert columns['c'][-1] == {'v': 9}
+    #what was recorded is trimmed from redis
+    assert r.xlen('S') == 0
+
+def test_resume(redis_client, make_recorder, tmp_path):
+    r = redis_client
+    pnt.init_stream(r, 'S', {'a': 'int16', 'c': 'serial'})
+    add_entries(r, range(5))
+    recorder = make_recorder(trim=False)
+    recorder.work()
+    recorder.sync()
+
+    #killed after writing more rows but before the next sync
+    add_entries(r, range(5, 10))
+    recorder.work()
+    recorder.writer.flush(fsync=False)
+
+    recorder = make_recorder(trim=False)
+    recorder.work()
+    recorder.sync()
+    recorder.writer.close()
+    _, columns = ColumnarDataset(tmp_path / "session").load("S")
+    assert columns['a'][:, 0].tolist() == list(range(10))
+    assert columns['c'] == [{'v': v} for v in range(10)]
+
+def test_ragged_stream(redis_client, make_recorder, tmp_path):
+    r = redis_client
+    pnt.init_stream(r, 'S', {'a': 'int16', 'c': 'serial'})
+    pnt.init_stream(r, 'R', 'int16')
+    add_entries(r, range(3))
+    pnt.add_to_stream(r, 'R', np.arange(2, dtype=np.int16))
+    pnt.add_to_stream(r, 'R', np.arange(3, dtype=np.int16))
+    recorder = make_recorder(streams=["S", "R"])
+    recorder.work()
+
+    #entries of different lengths in one page and a length change between pages are both reported
+    pnt.add_to_stream(r, 'R', np.arange(2, dtype=np.int16))
+    recorder.work()
+    pnt.add_to_stream(r, 'R', np.arange(4, dtype=np.int16))
+    recorder.work()
+    recorder.sync()
+    recorder.writer.close()
+
+    assert recorder.errors == {'R': 3}
+    errors = [fields for _, fields in r.xrange('rec_state') if fields[b'status'] == b'record_error']
+    assert [fields[b'stream'] for fields in errors] == [b'R', b'R']
+    data = ColumnarDataset(tmp_path / "session")
+    assert data.count("S") == 3
+    assert data.count("R") == 1
@@ -0,0 +1,83 @@
+import time
+import pytest
+import redis
+import numpy as np
+import PyBRAND.pynode_tools as pnt
+from PyBRAND.pydataset import ColumnarWriter
+from PyBRAND.pyreplay import RedisSource, DatasetSource, Replay
+
+'''
+Test of replaying recorded sessions from redis and from a columnar dataset.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+@pytest.fixture
+def redis_client():
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    yield r
+    r.flushdb()
+    r.close()
+
+def test_replay_from_redis(redis_client):
+    r = redis_client
+    pnt.init_stream(r, 'A', 'int16')
+    pnt.init_stream(r, 'B', {'x': 'float32', 'c': 'serial'})
+    for i in range(5):
+        r.xadd('A', {'data': np.int16(i).tobytes()}, id=f"{1000 + 20 * i}-0")
+        r.xadd('B', {'x': np.float32(i).tobytes(), 'c': f'{{"i": {i}}}'}, id=f"{1010 + 20 * i}-0")
+
+    #80 ms of recording at twice the speed
+    source = RedisSource(r, page_size=2)
+    assert source.streams == ['A', 'B']
+    start = time.perf_counter()
+    report = Replay(r, source, speed=2.0, prefix='replay_').run()
+    assert time.perf_counter() - start >= 0.04
+    assert report['entries'] == 10
+    assert report['streams'] == {'A': 5, 'B': 5}
+    assert report['lag_us']['count'] == 10
+
+    assert pnt.get_stream_dtype(r, 'replay_B') == {'x': 'float32', 'c': 'serial'}
+    #fields are copied as they are
+    assert [fields for _, fields in r.xrange('replay_A')] == [fields for _, fields in r.xrange('A')]
+    assert pnt.decode(r, r.xrange('replay_B'), 'replay_B')[-1][1] == {'x': 4.0, 'c': {'i': 4}}
+
+    #replaying into the streams being read doesn't replay its own entries again
+    Replay(r, RedisSource(r, ['A'], page_size=2), speed=0).run()
+    assert r.xlen('A') == 10
+
+def test_replay_from_dataset(redis_client, tmp_path):
+    r = redis_client
+    writer = ColumnarWriter(tmp_path / "session")
+    writer.add_stream("S", {"a": "int16", "c": "serial"})
+    writer.append("S", np.arange(100), {"a": np.arange(200, dtype=np.int16).reshape(100, 2),
+                                        "c": [{"t": t} for t in range(100)]})
+    writer.close()
+
+    report = Replay(r, DatasetSource(tmp_path / "session", start_ms=50), speed=0, batch_size=16).run()
+    assert report['entries'] == 50
+    assert report['batches'] == 4
+    assert report['lag_us'] is None
+    _, columns = pnt.decode_columnar(r, r.xrange('S'), 'S')
+    assert columns['a'][0].tolist() == [100, 101]
+    assert columns['c'][-1] == {"t": 99}
+
+class SlowSource():
+    encoded = True
+    streams = ['SLOW']
+
+    def get_dtype(self, stream_name):
+        return 'int16'
+
+    #every entry takes 20 ms to fetch, like a slow page read, and they are 30 ms apart
+    def iter_entries(self, stream_name):
+        for i in range(8):
+            time.sleep(0.02)
+            yield 1000 + 30 * i, {'data': np.int16(i).tobytes()}
+
+def test_replay_slow_source(redis_client):
+    r = redis_client
+    report = Replay(r, SlowSource(), speed=1.0).run()
+    assert report['entries'] == 8
+    assert report['batches'] == 8
+    #fetching the next entry happens while waiting for the current one, so it doesn't delay the send
+    assert report['lag_us']['max_us'] < 10000
@@ -0,0 +1,67 @@
+import time
+import pytest
+from PyBRAND import pyscheduler
+from PyBRAND.pyscheduler import FixedRateScheduler, make_scheduler
+
+'''
+Test of the run() loop schedulers. Doesn't need redis
+'''
+
+class FakeClock():
+    #every read moves the clock on a microsecond so spinning on it ends, and sleep jumps it forward
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        self.now += 1e-6
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pyscheduler, "time", clock)
+    return clock
+
+def test_fixed_rate(clock):
+    scheduler = FixedRateScheduler(rate_hz=200, spin_us=200)
+    start = clock.perf_counter()
+    for _ in range(41):
+        scheduler.wait()
+    #40 periods after the first tick, with no drift building up
+    assert clock.perf_counter() - start == pytest.approx(0.2, abs=1e-4)
+    stats = scheduler.stats()
+    assert stats["overruns"] == 0
+    assert stats["skipped"] == 0
+    assert stats["jitter_us"]["count"] == 41
+
+def test_fixed_rate_overrun(clock):
+    scheduler = FixedRateScheduler(rate_hz=100)
+    scheduler.wait()
+    #work that takes 3.5 periods misses 2 ticks completely and the next one runs late
+    clock.sleep(0.035)
+    scheduler.wait()
+    stats = scheduler.stats()
+    assert stats["overruns"] == 1
+    assert stats["skipped"] == 2
+    #the late tick doesn't move the grid, the one after is on time again
+    scheduler.wait()
+    assert clock.now == pytest.approx(0.04, abs=1e-4)
+    assert scheduler.stats()["overruns"] == 1
+
+def test_fixed_rate_real_clock():
+    #deadlines are absolute so the ticks can't come early. how late they are depends on the machine
+    scheduler = FixedRateScheduler(rate_hz=200, spin_us=200)
+    start = time.perf_counter()
+    for _ in range(41):
+        scheduler.wait()
+    assert 0.2 <= time.perf_counter() - start < 1.0
+    assert scheduler.stats()["ticks"] == 41
+
+def test_make_scheduler():
+    assert make_scheduler(None, {}).mode == "free"
+    assert make_scheduler(None, {"scheduler": "fixed_rate", "rate_hz": 10}).mode == "fixed_rate"
+    with pytest.raises(ValueError):
+        make_scheduler(None, {"scheduler": "sometimes"})
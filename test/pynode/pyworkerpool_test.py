@@ -0,0 +1,91 @@
+import time
+import pytest
+import redis
+import numpy as np
+import PyBRAND.pynode_tools as pnt
+from PyBRAND.pyworkerpool import WorkerPool
+
+'''
+Test of the forked consumer group worker pool. The pool's loop is stopped from its stats report once the output is
+complete, and run() terminates the workers on the way out.
+YOU MUST LAUNCH REDIS SERVER BEFORE RUNNING THIS SCRIPT SO THERE IS A DATABASE TO CONNECT TO
+'''
+
+class Node():
+    NAME = "pool"
+
+    def __init__(self, r):
+        self.realtime_database = r
+
+    #later entries finish first so the workers hand results back out of order
+    def process(self, stream_name, entry):
+        value = int(np.frombuffer(entry[1][b'data'], dtype=np.int32)[0])
+        time.sleep(0.001 * (10 - value % 10))
+        return value * 10
+
+class Done(Exception):
+    pass
+
+@pytest.fixture
+def redis_client():
+    r = redis.Redis(host='localhost', port=6379, db=0)
+    yield r
+    r.flushdb()
+    r.close()
+
+def run_until(pool, r, n_outputs, timeout_s=20):
+    report = pool._report
+    deadline = time.monotonic() + timeout_s
+    def check(client):
+        report(client)
+        if r.xlen(pool.output_stream) >= n_outputs:
+            raise Done()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"only {r.xlen(pool.output_stream)} of {n_outputs} results were published")
+    pool._report = check
+    with pytest.raises(Done):
+        pool.run()
+    #run() terminates the workers when it exits
+    for process in pool.processes:
+        process.join(2)
+        assert not process.is_alive()
+
+def output_values(r):
+    return [int(np.frombuffer(fields[b'data'], dtype=np.int32)[0]) for _, fields in r.xrange('out')]
+
+def setup_streams(r, n):
+    pnt.init_stream(r, 'in', 'int32')
+    pnt.init_stream(r, 'out', 'int32')
+    pnt.create_group(r, 'in', 'pool', start_id='0')
+    for i in range(n):
+        pnt.add_to_stream(r, 'in', i)
+
+def test_ordered_output(redis_client):
+    r = redis_client
+    setup_streams(r, 40)
+    pool = WorkerPool(Node(r), 4, ['in'], 'out', block_ms=10, stats_interval_s=0)
+    run_until(pool, r, 40)
+
+    assert output_values(r) == [10 * i for i in range(40)]
+    #everything released is gone from the staging stream and acked
+    assert r.xlen('out_staging') == 0
+    stats = pool.stats['in']
+    assert stats['pending'] == 0
+    assert stats['staged'] == 0
+    assert set(stats['consumers']) <= {f"pool-{i}" for i in range(4)}
+    assert r.xlen('pool_workers') > 0
+
+def test_claim_dead_worker(redis_client):
+    r = redis_client
+    setup_streams(r, 20)
+    #a worker that read the first entries and died before acking them
+    dead = pnt.read_group(r, 'pool', 'pool-dead', ['in'], count=5)['in']
+    assert len(dead) == 5
+
+    pool = WorkerPool(Node(r), 2, ['in'], 'out', block_ms=10, claim_idle_ms=200, stats_interval_s=0)
+    start = time.monotonic()
+    run_until(pool, r, 20)
+    #the dead worker's entries could only be taken over once they were idle long enough, and held back the rest
+    assert time.monotonic() - start >= 0.2
+    assert output_values(r) == [10 * i for i in range(20)]
+    assert pnt.get_group_stats(r, 'in', 'pool')['consumers']['pool-dead']['pending'] == 0